@@ -1,4 +1,5 @@
 import argparse
+import atexit
 import os
 import sys
 import subprocess
@@ -6,6 +7,10 @@ import shutil
 import time
 from datetime import datetime
 
+# Path to directory with the shared benchmark modules
+BENCH_LIB = "./bench-lib"
+sys.path.append(BENCH_LIB)
+from results_sink import ResultsSink
 
 # List of the traditional algorithms used for reference
 # Comment out if an algorithm should not be included in the test
@@ -13,34 +18,73 @@ TRADITIONAL_SIG_ALGS = []
 TRADITIONAL_SIG_ALGS.append("rsa3072")
 TRADITIONAL_SIG_ALGS.append("ecdsap256")
 
+# Columns of the results files (key, type, CSV header)
+RESULTS_COLUMNS = [
+    ("algorithm", "str", "Algorithm"),
+    ("variant", "str", "Variant"),
+    ("operation", "str", "Operation"),
+    ("duration", "float", "Duration per Operation [s]"),
+    ("rate", "float", "Operations per Second"),
+]
+
 def run_benchmark_test():
     
-    # Write Header to file for each algorithm
-    results_file = open(results_file_name, "a")
-    results_file.write("Testrun for the Algorithm: "+alg+"\n")
-    results_file.close()
-    
     # Execute OpenSSL library benchmark speed test for given algorithm for 120 seconds (instead of default=10)
     results = subprocess.run(['openssl', 'speed', '-seconds', '120', alg], capture_output=True)
        
     # Save output line by line in array
     output = bytes.decode(results.stdout, 'utf-8').splitlines()
     
-    # Prepare line-by-line write, if in future stripping of the results is to be implemented
-    for result in output:
-        results_file = open(results_file_name, "a")
-        results_file.write(result+"\n")
-        results_file.close()
+    # Write the raw output with a header for each algorithm in one go
+    raw_file = open(raw_file_name, "a")
+    raw_file.write("Testrun for the Algorithm: "+alg+"\n")
+    raw_file.writelines(result+"\n" for result in output)
+    raw_file.write("------------------------------\n")
+    raw_file.close()
     
-    # Add blank line at the end of the algorithm section
-    results_file = open(results_file_name, "a")
-    results_file.write("------------------------------\n")
-    results_file.close()
+    # Hand the parsed rows to the background writer of the results sink
+    results_sink.write_many(parse_speed_output(alg, output))
         
     print('\033[1;32mSUCCESS:\tResults for {} written to file.\n\033[0m'.format(alg), file=sys.stdout)
                 
     return
 
+def parse_speed_output(alg, output):
+    # openssl speed prints tables with a header line (e.g. "keygen signs verify keygens/s sign/s verify/s")
+    # followed by data lines (e.g. "dilithium2 0.000027s 0.000062s 0.000022s 37696.8 16125.7 44831.5")
+    rows = []
+    operations = []
+    
+    for line in output:
+        tokens = line.split()
+        if not tokens:
+            continue
+        
+        if any(token.endswith("/s") for token in tokens) and not any(is_number(token) for token in tokens):
+            # Header line, the operations are the columns without "/s"
+            operations = [token for token in tokens if not token.endswith("/s")]
+            continue
+        
+        # Data line, durations end with "s" and are followed by the rates
+        durations = [i for i, token in enumerate(tokens) if token.endswith("s") and is_number(token[:-1])]
+        if not operations or len(durations) != len(operations):
+            continue
+        
+        variant = " ".join(tokens[:durations[0]])
+        rates = tokens[durations[-1] + 1:]
+        for i, operation in enumerate(operations):
+            rate = rates[i] if i < len(rates) and is_number(rates[i]) else "nan"
+            rows.append((alg, variant, operation, tokens[durations[i]][:-1], rate))
+    
+    return rows
+
+def is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
 def read_pq_sigalgs(sig_file):
     
     algs_from_file=[]
@@ -130,10 +174,12 @@ if __name__ == '__main__':
         print('\033[1;31mERROR:\t\tDirectory "{}" does not exist. Please provide a directory to store the resulting files in.\033[0m'.format(out_dir), file=sys.stderr) 
         sys.exit(-1)
     
-    # Prepare file for benchmark results
-    results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H:%M:%S")+".csv"
-    results_file = open(results_file_name, "a")
-    results_file.close()
+    # Prepare files for benchmark results (raw openssl speed output, binary records and CSV export)
+    # Note: The sink is also closed (and thereby flushed) if the run is aborted
+    results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    raw_file_name = results_file_name+".txt"
+    results_sink = ResultsSink(results_file_name, RESULTS_COLUMNS)
+    atexit.register(results_sink.close)
 
     # Read the post-quantum signature algorithms from file and check if activated in oqs-provider
     pq_sig_algs = read_pq_sigalgs(sig_file)
@@ -147,5 +193,6 @@ if __name__ == '__main__':
         # Run OpenSSL speed benchmark test
         run_benchmark_test()
     
-    print('\033[1;32mSUCCESS:\tResults were stored in "{}". Finished.\033[0m'.format(results_file_name), file=sys.stdout)
+    results_sink.close()
+    print('\033[1;32mSUCCESS:\tResults were stored in "{}.txt", "{}.rec" and "{}.csv". Finished.\033[0m'.format(results_file_name, results_file_name, results_file_name), file=sys.stdout)
     sys.exit(0)
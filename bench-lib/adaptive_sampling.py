@@ -0,0 +1,59 @@
+##############################################################################################
+##      Title:          Adaptive Sampling                                                   ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Stopping rule for adaptive round allocation. A test cell keeps      ##
+##                      collecting rounds until the confidence intervals of the median      ##
+##                      and the 95th percentile of the handshake duration are narrower      ##
+##                      than a target width relative to the estimate.                       ##
+##############################################################################################
+
+import math
+from statistics import NormalDist
+
+# Quantiles which have to converge
+QUANTILES = [0.5, 0.95]
+
+# Confidence level of the quantile confidence intervals
+CONFIDENCE_LEVEL = 0.95
+
+# Number of rounds per batch between two convergence checks
+ADAPTIVE_SAMPLE_SIZE = 100
+
+# Minimum number of successful handshakes before the intervals are considered at all
+MIN_SUCCESSFUL_ROUNDS = 20
+
+
+def quantile_interval(sorted_values, q, confidence=CONFIDENCE_LEVEL):
+    # Distribution-free confidence interval of a quantile based on order statistics
+    # (normal approximation of the binomial distribution of the number of values below the quantile)
+    # Note: A bound whose order statistic lies outside of the sample is None (too few values for the interval), clamping
+    # it to the smallest or largest value would make the interval too narrow
+    n = len(sorted_values)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    spread = z * math.sqrt(n * q * (1 - q))
+
+    lower = math.floor(n * q - spread) - 1
+    upper = math.ceil(n * q + spread) - 1
+    estimate = sorted_values[min(n - 1, max(0, math.ceil(n * q) - 1))]
+    return estimate, sorted_values[lower] if lower >= 0 else None, sorted_values[upper] if upper < n else None
+
+
+def relative_widths(durations, confidence=CONFIDENCE_LEVEL):
+    # Width of the confidence interval of each quantile relative to its estimate, infinite if the interval is not
+    # covered by the sample
+    sorted_values = sorted(durations)
+    widths = []
+    for q in QUANTILES:
+        estimate, lower, upper = quantile_interval(sorted_values, q, confidence)
+        widths.append((upper - lower) / estimate if estimate > 0 and lower is not None and upper is not None else math.inf)
+    return widths
+
+
+def has_converged(durations, target_width, confidence=CONFIDENCE_LEVEL):
+    # Only durations of successful handshakes are passed, failed rounds carry no timing information
+    if len(durations) < MIN_SUCCESSFUL_ROUNDS:
+        return False, None
+    widths = relative_widths(durations, confidence)
+    return all(width <= target_width for width in widths), widths
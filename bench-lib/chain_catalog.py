@@ -0,0 +1,179 @@
+##############################################################################################
+##      Title:          Chain Catalog                                                       ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Encoded sizes of the certificate chain of each signature algorithm  ##
+##                      (CA, ICA, server and client certificates, public key and signature) ##
+##                      and the bytes the Certificate and CertificateVerify messages put on ##
+##                      the wire in each direction of the mutually authenticated handshake. ##
+##                      The PKIs are taken from (or built into) the PKI cache.              ##
+##                                                                                          ##
+##      Usage:          python3 bench-lib/chain_catalog.py -sigs <file> -out <base path>    ##
+##############################################################################################
+
+import argparse
+import math
+import os
+import ssl
+import sys
+
+from pki_cache import PKI_BACKENDS, default_cache_dir, build_pkis, print_pki_errors
+from results_sink import ResultsSink
+
+# Path to OpenSSL RCA config file
+OSSL_RCA_CONFIG = "./emulated-nw-assessmnt/oqs-openssl-rca.cnf"
+# Path to OpenSSL ICA config file
+OSSL_ICA_CONFIG = "./emulated-nw-assessmnt/oqs-openssl-ica.cnf"
+
+# TLS 1.3 framing: handshake message header, certificate list and entry length fields, extensions of a certificate entry
+HANDSHAKE_HEADER = 4
+CERTIFICATE_LIST_LENGTH = 3
+CERTIFICATE_ENTRY_LENGTH = 3
+CERTIFICATE_EXTENSIONS_LENGTH = 2
+# CertificateVerify: signature scheme and signature length
+CERT_VERIFY_FIELDS = 4
+# Protected records: header, content type and AEAD tag, at most 2^14 bytes of plaintext each
+RECORD_OVERHEAD = 5 + 1 + 16
+MAX_RECORD_PLAINTEXT = 16384
+
+# Columns of the catalog (key, type, CSV header), sizes are in bytes
+CATALOG_COLUMNS = [
+    ("algorithm", "str", "Signature Algorithm"),
+    ("ca_cert", "int", "CA Certificate [B]"),
+    ("ica_cert", "int", "ICA Certificate [B]"),
+    ("server_cert", "int", "Server Certificate [B]"),
+    ("client_cert", "int", "Client Certificate [B]"),
+    ("public_key", "int", "Public Key [B]"),
+    ("signature", "int", "Signature [B]"),
+    ("server_auth", "int", "Server Certificate and CertificateVerify [B]"),
+    ("client_auth", "int", "Client Certificate and CertificateVerify [B]"),
+]
+
+
+class CatalogError(Exception):
+    pass
+
+
+def der_element(data, offset):
+    # Tag, offset of the contents and offset after a DER element
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7F
+        length = int.from_bytes(data[offset:offset + count], "big")
+        offset += count
+    if offset + length > len(data):
+        raise CatalogError("Truncated DER element")
+    return tag, offset, offset + length
+
+
+def der_children(data, start, end):
+    # Elements of a constructed DER element (tag, start and end of the contents of each)
+    children = []
+    while start < end:
+        tag, content_start, content_end = der_element(data, start)
+        children.append((tag, content_start, content_end))
+        start = content_end
+    return children
+
+
+def read_certificate(path):
+    # DER encoding of a PEM certificate, certificates issued with "openssl ca" have a text dump before the PEM block
+    with open(path, "r") as cert_file:
+        text = cert_file.read()
+    start = text.find(ssl.PEM_HEADER)
+    end = text.find(ssl.PEM_FOOTER, start)
+    if start < 0 or end < 0:
+        raise CatalogError('"{}" is not a PEM certificate'.format(path))
+    return ssl.PEM_cert_to_DER_cert(text[start:end + len(ssl.PEM_FOOTER)])
+
+
+def key_and_signature_size(der):
+    # Public key (subjectPublicKeyInfo) and signature (signatureValue) sizes of a certificate, without the unused-bits byte
+    tag, start, end = der_element(der, 0)
+    tbs_certificate, signature_algorithm, signature_value = der_children(der, start, end)
+    fields = der_children(der, tbs_certificate[1], tbs_certificate[2])
+    # The version is an explicitly tagged field ([0]), the subjectPublicKeyInfo follows serial, signature, issuer, validity and subject
+    spki = fields[6] if fields[0][0] == 0xA0 else fields[5]
+    algorithm, public_key = der_children(der, spki[1], spki[2])
+    return public_key[2] - public_key[1] - 1, signature_value[2] - signature_value[1] - 1
+
+
+def protected_size(plaintext):
+    # Wire bytes of handshake messages in protected TLS 1.3 records
+    return plaintext + math.ceil(plaintext / MAX_RECORD_PLAINTEXT) * RECORD_OVERHEAD
+
+
+def auth_bytes(certificates, signature):
+    # Certificate (end-entity and ICA certificate, the CA is the trust anchor and not sent) and CertificateVerify message
+    # Note: The certificate request context is empty in both directions
+    certificate = HANDSHAKE_HEADER + 1 + CERTIFICATE_LIST_LENGTH + sum(CERTIFICATE_ENTRY_LENGTH + len(der) + CERTIFICATE_EXTENSIONS_LENGTH for der in certificates)
+    cert_verify = HANDSHAKE_HEADER + CERT_VERIFY_FIELDS + signature
+    return protected_size(certificate + cert_verify)
+
+
+def measure_chain(alg, pki_path):
+    # Catalog row of a PKI set up by pki_setup(), in the order of CATALOG_COLUMNS
+    ca, ica, server, client = (read_certificate(os.path.join(pki_path, *parts)) for parts in (("ca", "ca.crt"), ("ica", "ica.crt"), ("server", "server.crt"), ("client", "client.crt")))
+    # All certificates of a chain use the same algorithm, CertificateVerify signatures have the size of the certificate signatures
+    public_key, signature = key_and_signature_size(server)
+    return (alg, len(ca), len(ica), len(server), len(client), public_key, signature, auth_bytes([server, ica], signature), auth_bytes([client, ica], signature))
+
+
+def read_catalog(path):
+    # Catalog rows by algorithm from a CSV file written by this script
+    catalog = {}
+    with open(path, "r", encoding="UTF-8") as catalog_file:
+        headers = catalog_file.readline().rstrip("\n").split(",")
+        if headers != [column[2] for column in CATALOG_COLUMNS]:
+            raise CatalogError('"{}" is not a chain catalog'.format(path))
+        for line in catalog_file:
+            values = line.rstrip("\n").split(",")
+            catalog[values[0]] = (values[0],) + tuple(int(value) for value in values[1:])
+    return catalog
+
+
+def read_sig_list(sig_file):
+    with open(sig_file, "r", encoding="UTF-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Chain Catalog',
+        description='Encoded certificate chain and signature sizes of signature algorithms, and the bytes they put on the wire in the handshake.')
+    parser.add_argument('-sigs', help='path to the file with the signature algorithms (one per line, e.g. sig-list.txt)', metavar='<file path>', required=False)
+    parser.add_argument('-algs', help='signature algorithms in addition to the file (e.g. ED25519 RSA:3072)', metavar='<algorithm>', nargs='+', default=[], required=False)
+    parser.add_argument('-out', help='base path of the catalog (.rec and .csv are appended)', metavar='<file path>', required=True)
+    parser.add_argument('-pki-cache', help='path to the directory where generated PKIs are cached, default is $PQTLS_PKI_CACHE or ~/.cache/pqtls-pki', metavar='<dir path>', default=default_cache_dir(), required=False)
+    parser.add_argument('-pki-backend', help='how missing PKIs are set up: "cli" (openssl commands) or "libcrypto" (in-process), default is cli', choices=list(PKI_BACKENDS), default='cli', required=False)
+
+    args = parser.parse_args()
+
+    algs = (read_sig_list(args.sigs) if args.sigs is not None else []) + args.algs
+    if not algs:
+        print('\033[1;31mERROR:\t\tNo signature algorithms given. Please provide them with -sigs or -algs. Aborting.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+
+    # Same PKIs (and algorithm names of the PKI paths) as the emulated network runner
+    algnames = {alg: alg.replace(":", "") if alg.startswith("RSA") else alg for alg in algs}
+    pki_paths, pki_errors = build_pkis([(alg, algnames[alg]) for alg in algs], OSSL_RCA_CONFIG, OSSL_ICA_CONFIG, args.pki_cache, args.pki_backend)
+    print_pki_errors(pki_errors)
+
+    sink = ResultsSink(args.out, CATALOG_COLUMNS)
+    for alg in algs:
+        if alg not in pki_paths:
+            continue
+        try:
+            row = measure_chain(alg, pki_paths[alg])
+        except (CatalogError, OSError) as e:
+            print('\033[1;33mWARNING:\tChain of "{}" could not be measured ({}), algorithm removed from list.\033[0m'.format(alg, e), file=sys.stderr)
+            continue
+        print('\033[1;34mINFO:\t\t"{}": server sends {} bytes, client sends {} bytes of certificates and signature.\033[0m'.format(alg, row[7], row[8]), file=sys.stdout)
+        sink.write(row)
+
+    sink.close()
+    print('\033[1;32mSUCCESS:\tCatalog was stored in "{}.rec" and "{}.csv". Finished.\033[0m'.format(args.out, args.out), file=sys.stdout)
+    sys.exit(0)
@@ -0,0 +1,216 @@
+##############################################################################################
+##      Title:          Experiment Specification                                            ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Reads a benchmark sweep from a TOML spec file (dimensions, round    ##
+##                      budget, cell ordering and output formats) and expands it into the   ##
+##                      cell plan of a runner. The plan can be reported with an estimated   ##
+##                      wall time ahead of the run and split into shards, so a big sweep    ##
+##                      can be run in parts (e.g. one shard per night or per host).         ##
+##                      Keys which are not in the spec keep the defaults of the runner.     ##
+##############################################################################################
+
+import heapq
+import itertools
+import math
+import os
+import random
+import tomllib
+
+from path_prober import PROBE_METHODS
+from stimer_records import MODES
+
+# Cell orders: "sequential" (nested loops over the dimensions), "interleaved" (the first dimension, the signature
+# algorithm, changes from cell to cell, so slow drifts of the host affect all algorithms alike) and "randomized"
+ORDER_STRATEGIES = ["sequential", "interleaved", "randomized"]
+
+# Formats of the results files (see ResultsSink)
+OUTPUT_FORMATS = ["rec", "csv"]
+
+# Keys of the spec file (section, key) with the attribute name and value type
+SPEC_KEYS = {
+    ("dimensions", "algorithms"): ("algorithms", "list:str"),
+    ("dimensions", "traditional_algorithms"): ("traditional_algorithms", "list:str"),
+    ("dimensions", "sigs"): ("sigs", "path"),
+    ("dimensions", "rate"): ("rate", "list:float"),
+    ("dimensions", "delay"): ("delay", "list:float"),
+    ("dimensions", "loss"): ("loss", "list:float"),
+    ("dimensions", "initcwnd"): ("initcwnd", "list:int"),
+    ("dimensions", "initrwnd"): ("initrwnd", "list:int"),
+    ("dimensions", "congestion_control"): ("congestion_control", "list:str"),
+    ("dimensions", "groups"): ("groups", "list:str"),
+    ("dimensions", "ciphersuites"): ("ciphersuites", "list:str"),
+    ("dimensions", "modes"): ("modes", "list:str"),
+    ("rounds", "rounds"): ("rounds", "int"),
+    ("rounds", "sample_size"): ("sample_size", "int"),
+    ("rounds", "max_handshake_duration"): ("max_handshake_duration", "int"),
+    ("rounds", "adaptive"): ("adaptive", "bool"),
+    ("rounds", "min_rounds"): ("min_rounds", "int"),
+    ("rounds", "max_rounds"): ("max_rounds", "int"),
+    ("rounds", "ci_width"): ("ci_width", "float"),
+    ("load", "concurrency"): ("concurrency", "list:int"),
+    ("load", "arrival_rate"): ("arrival_rate", "list:float"),
+    ("load", "duration"): ("load_duration", "int"),
+    ("order", "strategy"): ("strategy", "str"),
+    ("order", "seed"): ("seed", "int"),
+    ("order", "parallel"): ("parallel", "int"),
+    ("output", "formats"): ("formats", "list:str"),
+    ("output", "phases"): ("phases", "bool"),
+    ("probe", "method"): ("probe", "str"),
+    ("probe", "interval"): ("probe_interval", "float"),
+    ("probe", "window"): ("probe_window", "float"),
+    ("estimate", "handshake_ms"): ("handshake_ms", "float"),
+    ("estimate", "rtt_ms"): ("rtt_ms", "float"),
+}
+
+# Sections which are tables of their own (name = value), with the attribute name and value type
+SPEC_TABLES = {
+    "ports": ("ports", "int"),
+}
+
+# Wall time estimate: duration of a handshake without network delay in ms (if the spec has no [estimate])
+DEFAULT_HANDSHAKE_MS = 5.0
+# Round trips of a full handshake (TCP connect and TLS 1.3 handshake)
+HANDSHAKE_RTTS = 2
+# Segments of a handshake which can be lost, each lost one costs a retransmission timeout
+HANDSHAKE_SEGMENTS = 20
+MIN_RTO_MS = 200
+# Start of s_server and s_timer per batch in seconds
+BATCH_OVERHEAD_S = 1.0
+
+
+class SpecError(Exception):
+    pass
+
+
+class ExperimentSpec:
+
+    def __init__(self, values):
+        # Values by attribute name (see SPEC_KEYS), the defaults of the runner updated with the spec file
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.values = values
+
+    def round_budget(self):
+        # Rounds of a latency test, in adaptive mode at most max_rounds
+        return self.max_rounds if self.adaptive else self.rounds
+
+
+def check_value(value, value_type, where):
+    # Returns the value converted to its type, integers are accepted for floats
+    if value_type.startswith("list:"):
+        if not isinstance(value, list) or not value:
+            raise SpecError("{} must be a non-empty list".format(where))
+        return [check_value(item, value_type[len("list:"):], where) for item in value]
+    if value_type == "float" and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if value_type == "path":
+        value_type = "str"
+    if type(value).__name__ != value_type:
+        raise SpecError("{} must be of type {}".format(where, value_type))
+    return value
+
+
+def load_spec(path, defaults):
+    # Only the keys the runner has defaults for are accepted, e.g. the real-network runner has no rate, delay or loss
+    try:
+        with open(path, "rb") as spec_file:
+            spec = tomllib.load(spec_file)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise SpecError("Spec file could not be read ({})".format(e))
+
+    values = dict(defaults)
+    for section, entries in spec.items():
+        if not isinstance(entries, dict):
+            raise SpecError('"{}" is not a section'.format(section))
+        if section in SPEC_TABLES:
+            name, value_type = SPEC_TABLES[section]
+            if name not in defaults:
+                raise SpecError('Section [{}] is not supported by this runner'.format(section))
+            values[name] = {key: check_value(value, value_type, "{}.{}".format(section, key)) for key, value in entries.items()}
+            continue
+        for key, value in entries.items():
+            if (section, key) not in SPEC_KEYS or SPEC_KEYS[(section, key)][0] not in defaults:
+                raise SpecError('Key "{}" in section [{}] is not supported by this runner'.format(key, section))
+            name, value_type = SPEC_KEYS[(section, key)]
+            values[name] = check_value(value, value_type, "{}.{}".format(section, key))
+            # Paths are relative to the spec file
+            if value_type == "path":
+                values[name] = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)), values[name]))
+
+    if "modes" in values and not set(values["modes"]) <= set(MODES):
+        raise SpecError("dimensions.modes must be out of {}".format(", ".join(MODES)))
+    if "strategy" in values and values["strategy"] not in ORDER_STRATEGIES:
+        raise SpecError("order.strategy must be one of {}".format(", ".join(ORDER_STRATEGIES)))
+    if "probe" in values and values["probe"] not in PROBE_METHODS + ["none"]:
+        raise SpecError("probe.method must be one of {}".format(", ".join(PROBE_METHODS + ["none"])))
+    if "formats" in values and not set(values["formats"]) <= set(OUTPUT_FORMATS):
+        raise SpecError("output.formats must be out of {}".format(", ".join(OUTPUT_FORMATS)))
+    return ExperimentSpec(values)
+
+
+def expand_plan(dimensions, strategy, seed=None):
+    # Cells (tuples of dimension values) of all combinations of the dimensions (lists of values) in the given order
+    if strategy == "interleaved":
+        # The first dimension varies fastest
+        cells = [combination[-1:] + combination[:-1] for combination in itertools.product(*dimensions[1:], dimensions[0])]
+    else:
+        cells = list(itertools.product(*dimensions))
+    if strategy == "randomized":
+        random.Random(seed).shuffle(cells)
+    return cells
+
+
+def parse_shard(text):
+    # Shard "I/N" (1-based) of a plan, used as argparse type
+    index, count = (int(value) for value in text.split("/"))
+    if count < 1 or index < 1 or index > count:
+        raise ValueError("invalid shard")
+    return (index, count)
+
+
+def select_shard(cells, shard):
+    # Every N-th cell from the I-th on, so all shards get a similar mix of the dimensions
+    index, count = shard
+    return cells[index - 1::count]
+
+
+def handshake_seconds(handshake_ms, rtt_ms, loss):
+    # Expected duration of a handshake (loss in percent per direction)
+    return (handshake_ms + HANDSHAKE_RTTS * rtt_ms + HANDSHAKE_SEGMENTS * loss / 100 * (MIN_RTO_MS + rtt_ms)) / 1000
+
+
+def estimate_cell_seconds(spec, rtt_ms, loss, load):
+    # Expected duration of a cell, a latency test runs its round budget in batches of sample_size rounds
+    if load:
+        return spec.load_duration + BATCH_OVERHEAD_S
+    rounds = spec.round_budget()
+    batches = math.ceil(rounds / spec.sample_size) if hasattr(spec, "sample_size") else 1
+    return rounds * handshake_seconds(spec.handshake_ms, rtt_ms, loss) + batches * BATCH_OVERHEAD_S
+
+
+def estimate_wall_time(cell_seconds, workers):
+    # Cells are started in plan order on the next free worker (namespace pair)
+    finish_times = [0.0] * workers
+    for seconds in cell_seconds:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + seconds)
+    return max(finish_times)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}h {:02d}m {:02d}s".format(hours, minutes, seconds)
+
+
+def print_plan(columns, cells, cell_seconds, workers):
+    # Plan as a table (one line per cell) with the estimated duration of each cell and the wall time of all cells
+    rows = [[str(value) for value in cell] + [format_duration(seconds)] for cell, seconds in zip(cells, cell_seconds)]
+    headers = ["#"] + columns + ["Estimate"]
+    rows = [[str(index)] + row for index, row in enumerate(rows, 1)]
+    widths = [max(len(row[i]) for row in rows + [headers]) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    print('\033[1;34mINFO:\t\t{} cell(s), {} in total, estimated wall time {} on {} worker(s).\033[0m'.format(len(cells), format_duration(sum(cell_seconds)), format_duration(estimate_wall_time(cell_seconds, workers)), workers))
+    return
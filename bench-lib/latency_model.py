@@ -0,0 +1,226 @@
+##############################################################################################
+##      Title:          Latency Model                                                       ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Analytic model of the handshake duration from RTT, packet loss,     ##
+##                      rate, initial congestion window and the chain sizes of the chain    ##
+##                      catalog. The terms of the model (round trips incl. the slow start   ##
+##                      rounds of large flights, serialization and retransmission timeouts) ##
+##                      are weighted by a least squares fit to benchmark results, e.g. the  ##
+##                      results_edge-cases_*.csv files, and predict the handshake duration  ##
+##                      of an algorithm for a network profile without running a sweep.      ##
+##                                                                                          ##
+##      Usage:          Fit:     python3 bench-lib/latency_model.py -catalog <catalog.csv>  ##
+##                               -fit <results.csv|.rec> ... -model <model.json>            ##
+##                      Predict: python3 bench-lib/latency_model.py -catalog <catalog.csv>  ##
+##                               -model <model.json> -rtt <ms> -loss <%>                    ##
+##############################################################################################
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from chain_catalog import CatalogError, read_catalog
+from results_sink import read_header, load_records
+
+# Maximum segment size of the emulated links (Ethernet MTU without IPv4, TCP and timestamp option headers)
+MSS = 1448
+# Initial congestion window of Linux, used where a result has no initcwnd (or 0, the kernel default)
+DEFAULT_INITCWND = 10
+# Round trips of a full handshake (TCP connect and TLS 1.3 handshake)
+HANDSHAKE_RTTS = 2
+# Bytes of the handshake apart from certificates and signatures (hellos with the key shares of x25519_kyber768,
+# EncryptedExtensions, CertificateRequest and Finished messages)
+CLIENT_BASE_BYTES = 1700
+SERVER_BASE_BYTES = 1500
+# Lost data segments are retransmitted after the minimum RTO, a lost SYN or SYN-ACK after the initial RTO of 1s
+MIN_RTO_MS = 200
+SYN_RTO_MS = 1000
+
+# Terms of the model, in the order of the columns of features()
+MODEL_TERMS = ["constant", "round_trips", "serialization", "segment_losses", "syn_losses"]
+
+# Columns used from a results file (key, CSV header), see RESULTS_COLUMNS and TCP_COLUMNS of the emulated runner
+RESULT_KEYS = {
+    "Signature Algorithm": "algorithm",
+    "Rate Limit": "rate",
+    "Delay": "delay",
+    "Packet Loss": "loss",
+    "Initial Congestion Window": "initcwnd",
+    "Success": "success",
+    "Handshake Duration [ms]": "duration",
+}
+
+# Rate in Mbit/s of results without rate column (real network)
+DEFAULT_RATE = 1000.0
+
+
+class ModelError(Exception):
+    pass
+
+
+def slow_start_rounds(segments, initcwnd):
+    # Round trips to send a flight in slow start, the congestion window doubles each round
+    return np.maximum(np.ceil(np.log2(segments / initcwnd + 1)), 1)
+
+
+def features(rtt_ms, loss, rate, initcwnd, server_auth, client_auth):
+    # Terms of the model (see MODEL_TERMS) for arrays of network parameters and chain sizes in bytes (one element per handshake)
+    initcwnd = np.where(initcwnd > 0, initcwnd, DEFAULT_INITCWND)
+    server_segments = np.ceil((server_auth + SERVER_BASE_BYTES) / MSS)
+    client_segments = np.ceil((client_auth + CLIENT_BASE_BYTES) / MSS)
+    # Flights which do not fit into the initial window cost additional round trips
+    round_trips = HANDSHAKE_RTTS + slow_start_rounds(server_segments, initcwnd) - 1 + slow_start_rounds(client_segments, initcwnd) - 1
+    # Serialization in ms of both flights at the rate limit (Mbit/s)
+    serialization = (server_auth + client_auth + SERVER_BASE_BYTES + CLIENT_BASE_BYTES) * 8 / (rate * 1000)
+    # Expected number of lost segments (loss in percent per direction) times the time to recover one
+    probability = loss / 100
+    segment_losses = probability * (server_segments + client_segments) * (MIN_RTO_MS + rtt_ms)
+    syn_losses = probability * 2 * SYN_RTO_MS
+    return np.column_stack([np.ones_like(rtt_ms), rtt_ms * round_trips, serialization, segment_losses, syn_losses])
+
+
+def load_results(path, rtt_ms=None):
+    # Columns of a results file (.csv or .rec) as arrays, without the failed rounds
+    # Note: Results without delay column (real network) need the RTT, the RTT of the emulation is twice the delay
+    if path.endswith(".rec"):
+        records = load_records(path, mmap=False)
+        columns = {key: records[key] for key in [column[0] for column in read_header(path)] if key in RESULT_KEYS.values()}
+        columns["algorithm"] = np.char.decode(columns["algorithm"], "utf-8")
+    else:
+        with open(path, "r", encoding="UTF-8") as results_file:
+            headers = results_file.readline().rstrip("\n").split(",")
+            rows = [line.rstrip("\n").split(",") for line in results_file if line.strip()]
+        columns = {RESULT_KEYS[header]: np.array([row[i] for row in rows]) for i, header in enumerate(headers) if header in RESULT_KEYS}
+        for key in columns:
+            if key != "algorithm":
+                columns[key] = columns[key].astype(np.float64)
+
+    if "algorithm" not in columns or "duration" not in columns:
+        raise ModelError('"{}" has no signature algorithm or handshake duration column'.format(path))
+    if "delay" not in columns and rtt_ms is None:
+        raise ModelError('"{}" has no delay column, please provide the RTT of the measurement'.format(path))
+
+    count = len(columns["duration"])
+    results = {
+        "algorithm": columns["algorithm"],
+        "rtt_ms": 2 * columns["delay"].astype(np.float64) if "delay" in columns else np.full(count, rtt_ms),
+        "loss": columns["loss"].astype(np.float64) if "loss" in columns else np.zeros(count),
+        "rate": columns["rate"].astype(np.float64) if "rate" in columns else np.full(count, DEFAULT_RATE),
+        "initcwnd": columns["initcwnd"].astype(np.float64) if "initcwnd" in columns else np.zeros(count),
+        "duration": columns["duration"].astype(np.float64),
+    }
+    successful = columns["success"].astype(bool) if "success" in columns else np.ones(count, dtype=bool)
+    return {key: values[successful] for key, values in results.items()}
+
+
+def chain_sizes(algorithms, catalog):
+    # Server and client auth bytes of each element of an algorithm array
+    names, inverse = np.unique(algorithms, return_inverse=True)
+    missing = [name for name in names if name not in catalog]
+    if missing:
+        raise ModelError("Algorithm(s) {} not in the chain catalog".format(", ".join(missing)))
+    sizes = np.array([(catalog[name][7], catalog[name][8]) for name in names], dtype=np.float64)
+    return sizes[inverse, 0], sizes[inverse, 1]
+
+
+def fit_model(results, catalog):
+    # Least squares fit of the term weights to the mean duration of each cell, weighted with the square root of the rounds per cell
+    server_auth, client_auth = chain_sizes(results["algorithm"], catalog)
+    terms = features(results["rtt_ms"], results["loss"], results["rate"], results["initcwnd"], server_auth, client_auth)
+    cells, inverse, counts = np.unique(terms, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    means = np.bincount(inverse, weights=results["duration"]) / counts
+    weights = np.sqrt(counts)
+    # The terms are durations, a term with a negative weight is dropped and the others are fitted again
+    active = np.ones(len(MODEL_TERMS), dtype=bool)
+    coefficients = np.zeros(len(MODEL_TERMS))
+    while active.any():
+        coefficients[:] = 0.0
+        coefficients[active] = np.linalg.lstsq(cells[:, active] * weights[:, None], means * weights, rcond=None)[0]
+        if (coefficients >= 0).all():
+            break
+        active &= coefficients > 0
+
+    predicted = cells @ coefficients
+    rmse = math.sqrt(np.average((predicted - means) ** 2, weights=counts))
+    total = np.average((means - np.average(means, weights=counts)) ** 2, weights=counts)
+    r2 = 1 - rmse ** 2 / total if total > 0 else 1.0
+    return {"terms": MODEL_TERMS, "coefficients": coefficients.tolist(), "cells": len(cells), "rounds": int(counts.sum()), "rmse_ms": rmse, "r2": r2}
+
+
+def predict(model, rtt_ms, loss, rate, initcwnd, server_auth, client_auth):
+    # Predicted handshake durations in ms, the arguments are arrays (or scalars) of the same shape
+    if model["terms"] != MODEL_TERMS:
+        raise ModelError("Model was fitted with other terms ({})".format(", ".join(model["terms"])))
+    arrays = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (rtt_ms, loss, rate, initcwnd, server_auth, client_auth)))
+    terms = features(*(array.reshape(-1) for array in arrays))
+    return (terms @ np.array(model["coefficients"])).reshape(arrays[0].shape)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Latency Model',
+        description='Fit the analytic handshake latency model to benchmark results or predict handshake durations for a network profile.')
+    parser.add_argument('-catalog', help='path to the chain catalog (.csv) of the algorithms (see chain_catalog.py)', metavar='<file path>', required=True)
+    parser.add_argument('-model', help='path to the model file (.json), written by -fit and read otherwise', metavar='<file path>', required=True)
+    parser.add_argument('-fit', help='results files (.csv or .rec) to fit the model to', metavar='<file path>', nargs='+', required=False)
+    parser.add_argument('-fit-rtt', help='RTT in ms of results files without delay column (real network), default is none', metavar='FLOAT', type=float, required=False)
+    parser.add_argument('-rtt', help='RTT in ms of the network profile to predict, default is 0.0', metavar='FLOAT', type=float, default='0.0', required=False)
+    parser.add_argument('-loss', help='packet loss rate in percent (per direction) of the network profile to predict, default is 0.0', metavar='FLOAT', type=float, default='0.0', required=False)
+    parser.add_argument('-rate', help='rate in Mbit/s of the network profile to predict, default is 10000.0', metavar='FLOAT', type=float, default='10000.0', required=False)
+    parser.add_argument('-initcwnd', help='initial congestion window in segments of the network profile to predict (0 is the kernel default), default is 0', metavar='INT', type=int, default='0', required=False)
+
+    args = parser.parse_args()
+
+    try:
+        catalog = read_catalog(args.catalog)
+    except (CatalogError, OSError, ValueError) as e:
+        print('\033[1;31mERROR:\t\tChain catalog "{}" could not be read ({}). Aborting.\033[0m'.format(args.catalog, e), file=sys.stderr)
+        sys.exit(-1)
+
+    if args.fit is not None:
+        results = {}
+        for path in args.fit:
+            try:
+                file_results = load_results(path, args.fit_rtt)
+            except (ModelError, OSError, KeyError, ValueError) as e:
+                print('\033[1;31mERROR:\t\tResults "{}" could not be read ({}). Aborting.\033[0m'.format(path, e), file=sys.stderr)
+                sys.exit(-1)
+            for key, values in file_results.items():
+                results[key] = np.concatenate([results[key], values]) if key in results else values
+        try:
+            model = fit_model(results, catalog)
+        except ModelError as e:
+            print('\033[1;31mERROR:\t\tModel could not be fitted ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+            sys.exit(-1)
+        with open(args.model, "w") as model_file:
+            json.dump(model, model_file, indent=2)
+        for term, coefficient in zip(model["terms"], model["coefficients"]):
+            print('\033[1;34mINFO:\t\t{:<16}{:>12.4f}\033[0m'.format(term, coefficient), file=sys.stdout)
+        print('\033[1;32mSUCCESS:\tModel fitted to {} rounds in {} cells (RMSE {:.2f}ms, R^2 {:.3f}) was stored in "{}". Finished.\033[0m'.format(model["rounds"], model["cells"], model["rmse_ms"], model["r2"], args.model), file=sys.stdout)
+        sys.exit(0)
+
+    if not os.path.isfile(args.model):
+        print('\033[1;31mERROR:\t\tModel "{}" does not exist. Please fit it first (-fit). Aborting.\033[0m'.format(args.model), file=sys.stderr)
+        sys.exit(-1)
+    with open(args.model, "r") as model_file:
+        model = json.load(model_file)
+
+    algorithms = sorted(catalog)
+    sizes = np.array([(catalog[alg][7], catalog[alg][8]) for alg in algorithms], dtype=np.float64)
+    try:
+        durations = predict(model, args.rtt, args.loss, args.rate, args.initcwnd, sizes[:, 0], sizes[:, 1])
+    except ModelError as e:
+        print('\033[1;31mERROR:\t\t{}. Aborting.\033[0m'.format(e), file=sys.stderr)
+        sys.exit(-1)
+
+    print('\033[1;34mINFO:\t\tPredicted handshake durations for RTT = {}ms, Packet Loss Rate = {}%, Rate = {}Mbit/s, initcwnd = {}.\033[0m'.format(args.rtt, args.loss, args.rate, args.initcwnd), file=sys.stdout)
+    for alg, duration in sorted(zip(algorithms, durations.tolist()), key=lambda item: item[1]):
+        print("{:<32}{:>12.2f} ms".format(alg, duration))
+    sys.exit(0)
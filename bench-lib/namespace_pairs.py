@@ -0,0 +1,75 @@
+##############################################################################################
+##      Title:          Namespace Pairs                                                     ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Naming and CPU assignment of the server/client namespace pairs      ##
+##                      created by virt-test-env/namespace-setup.sh.                        ##
+##############################################################################################
+
+import os
+
+# Maximum number of namespace pairs, limited by the 192.168.(100+x).0/24 subnets
+MAX_PAIRS = 77
+
+# TCP port the TLS server listens on in each server namespace
+TLS_PORT = 4433
+
+
+class NamespacePair:
+
+    def __init__(self, index, server_cpus=None, client_cpus=None):
+        # Pair i consists of ns(2i-1) (server) and ns(2i) (client), see namespace-setup.sh
+        self.index = index
+        server = 2 * index - 1
+        client = 2 * index
+
+        self.server_ns = "ns{}".format(server)
+        self.client_ns = "ns{}".format(client)
+        self.server_dev = "veth{}".format(100 + server)
+        self.client_dev = "veth{}".format(100 + client)
+        self.server_ip = "192.168.{}.1".format(100 + server)
+        self.client_ip = "192.168.{}.1".format(100 + client)
+        self.server_mac = "00:00:00:00:00:{:02x}".format(server)
+        self.client_mac = "00:00:00:00:00:{:02x}".format(client)
+        self.server_cpus = server_cpus
+        self.client_cpus = client_cpus
+        # Network emulation controller of both ends (see netem_control.py), set by the runner
+        self.netem = None
+
+    def server_address(self):
+        return "{}:{}".format(self.server_ip, TLS_PORT)
+
+    def pin(self, cpus, command):
+        # Prefix the command with taskset, if the pair has CPU cores assigned
+        if cpus is None:
+            return command
+        return ['taskset', '-c', ",".join(str(cpu) for cpu in cpus)] + command
+
+    def server_command(self, command):
+        return ['sudo', 'ip', 'netns', 'exec', self.server_ns] + self.pin(self.server_cpus, command)
+
+    def client_command(self, command):
+        return ['sudo', 'ip', 'netns', 'exec', self.client_ns] + self.pin(self.client_cpus, command)
+
+
+def create_pairs(count):
+    # Split the available CPU cores in disjoint sets per pair, half for the server and half for the client
+    # Note: If there are less cores than pairs, no pinning is done at all
+    cpus = sorted(os.sched_getaffinity(0))
+    cpus_per_pair = len(cpus) // count
+
+    pairs = []
+    for index in range(1, count + 1):
+        if cpus_per_pair == 0:
+            pairs.append(NamespacePair(index))
+            continue
+
+        pair_cpus = cpus[(index - 1) * cpus_per_pair:index * cpus_per_pair]
+        if len(pair_cpus) == 1:
+            # Server and client have to share a single core
+            pairs.append(NamespacePair(index, pair_cpus, pair_cpus))
+        else:
+            half = len(pair_cpus) // 2
+            pairs.append(NamespacePair(index, pair_cpus[:half], pair_cpus[half:]))
+    return pairs
@@ -0,0 +1,268 @@
+##############################################################################################
+##      Title:          Native Handshake Timer                                              ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    In-process replacement of s_timer for full handshakes. libssl and   ##
+##                      the providers (oqsprovider) are loaded once per process through     ##
+##                      ctypes and the client SSL_CTX of an algorithm is built once and     ##
+##                      kept warm across batches and cells. The timed connect/handshake     ##
+##                      loop runs in a thread which entered the client namespace (setns),   ##
+##                      its rounds are produced in the record layout of s_timer.            ##
+##############################################################################################
+
+import ctypes
+import os
+import resource
+import socket
+import struct
+import threading
+import time
+
+from netns import open_namespace, setns
+from pki_libcrypto import libcrypto_path, load_libcrypto
+from process_stats import ProcessUsage
+from stimer_records import RECORDS_MAGIC, RECORDS_VERSION, RECORDS_HEADER, ROUND_RECORD, PHASE_COLUMNS, MODES, round_records_from_buffer
+
+# Environment variable to override the path of libssl
+LIBSSL_ENV = "PQTLS_LIBSSL"
+
+# Constants of the OpenSSL headers
+TLS1_3_VERSION = 0x0304
+SSL_CTRL_EXTRA_CHAIN_CERT = 14
+SSL_CTRL_MODE = 33
+SSL_CTRL_SET_GROUPS_LIST = 92
+SSL_CTRL_SET_MIN_PROTO_VERSION = 123
+SSL_CTRL_SET_MAX_PROTO_VERSION = 124
+SSL_MODE_AUTO_RETRY = 0x4
+SSL_OP_NO_COMPRESSION = 1 << 17
+SSL_FILETYPE_PEM = 1
+SSL_VERIFY_PEER = 0x1
+SSL_SENT_SHUTDOWN = 1
+SSL_RECEIVED_SHUTDOWN = 2
+
+# libssl handle, loaded providers configs, client contexts and namespace file descriptors (only set up once per process)
+_libssl = None
+_loaded_configs = set()
+_contexts = {}
+_namespace_fds = {}
+_lock = threading.Lock()
+
+
+class NativeTimerError(Exception):
+    pass
+
+
+def libssl_path():
+    # libssl of the same installation as libcrypto (see libcrypto_path())
+    if LIBSSL_ENV in os.environ:
+        return os.environ[LIBSSL_ENV]
+    crypto_path = libcrypto_path()
+    return os.path.join(os.path.dirname(crypto_path), os.path.basename(crypto_path).replace("libcrypto", "libssl"))
+
+
+def load_libssl():
+    global _libssl
+    if _libssl is not None:
+        return _libssl
+
+    # libcrypto is loaded first, libssl then binds to the same library
+    crypto = load_libcrypto()
+    lib = ctypes.CDLL(libssl_path())
+    p = ctypes.c_void_p
+    signatures = {
+        "TLS_client_method": (p, []),
+        "SSL_CTX_new": (p, [p]),
+        "SSL_CTX_free": (None, [p]),
+        "SSL_CTX_ctrl": (ctypes.c_long, [p, ctypes.c_int, ctypes.c_long, p]),
+        "SSL_CTX_set_quiet_shutdown": (None, [p, ctypes.c_int]),
+        "SSL_CTX_set_options": (ctypes.c_uint64, [p, ctypes.c_uint64]),
+        "SSL_CTX_set_ciphersuites": (ctypes.c_int, [p, ctypes.c_char_p]),
+        "SSL_CTX_load_verify_locations": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_char_p]),
+        "SSL_CTX_use_certificate_file": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_int]),
+        "SSL_CTX_use_PrivateKey_file": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_int]),
+        "SSL_CTX_check_private_key": (ctypes.c_int, [p]),
+        "SSL_CTX_set_verify": (None, [p, ctypes.c_int, p]),
+        "SSL_new": (p, [p]),
+        "SSL_free": (None, [p]),
+        "SSL_set_fd": (ctypes.c_int, [p, ctypes.c_int]),
+        "SSL_connect": (ctypes.c_int, [p]),
+        "SSL_set_shutdown": (None, [p, ctypes.c_int]),
+    }
+    for name, (restype, argtypes) in signatures.items():
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    crypto_signatures = {
+        "ERR_clear_error": (None, []),
+        "BIO_new_file": (p, [ctypes.c_char_p, ctypes.c_char_p]),
+        "PEM_read_bio_X509": (p, [p, p, p, p]),
+        "X509_free": (None, [p]),
+    }
+    for name, (restype, argtypes) in crypto_signatures.items():
+        function = getattr(crypto, name)
+        function.restype = restype
+        function.argtypes = argtypes
+
+    _libssl = lib
+    return _libssl
+
+
+def errors():
+    # Messages of the OpenSSL error queue of the calling thread
+    crypto = load_libcrypto()
+    messages = []
+    buffer = ctypes.create_string_buffer(256)
+    while (code := crypto.ERR_get_error()) != 0:
+        crypto.ERR_error_string_n(code, buffer, len(buffer))
+        messages.append(buffer.value.decode())
+    return "; ".join(messages)
+
+
+def load_config(config_file):
+    # Activates the providers of the OpenSSL config (like CONF_modules_load_file in s_timer), once per config and process
+    with _lock:
+        if config_file in _loaded_configs:
+            return
+        load_libssl()
+        if load_libcrypto().OSSL_LIB_CTX_load_config(None, config_file.encode()) != 1:
+            raise NativeTimerError("OpenSSL config {} could not be loaded ({})".format(config_file, errors()))
+        _loaded_configs.add(config_file)
+    return
+
+
+class ClientContext:
+    # Client SSL_CTX with the same settings as create_ssl_ctx() of s_timer
+
+    def __init__(self, ca_cert, ica_cert, client_cert, client_key, groups, ciphersuites):
+        self.lib = load_libssl()
+        crypto = load_libcrypto()
+        self.ctx = self.lib.SSL_CTX_new(self.lib.TLS_client_method())
+        if not self.ctx:
+            raise NativeTimerError("SSL_CTX could not be created ({})".format(errors()))
+        try:
+            self.lib.SSL_CTX_ctrl(self.ctx, SSL_CTRL_MODE, SSL_MODE_AUTO_RETRY, None)
+            self.lib.SSL_CTX_set_quiet_shutdown(self.ctx, 1)
+            self.check(self.lib.SSL_CTX_ctrl(self.ctx, SSL_CTRL_SET_MIN_PROTO_VERSION, TLS1_3_VERSION, None), "TLS 1.3 could not be set")
+            self.check(self.lib.SSL_CTX_ctrl(self.ctx, SSL_CTRL_SET_MAX_PROTO_VERSION, TLS1_3_VERSION, None), "TLS 1.3 could not be set")
+            self.lib.SSL_CTX_set_options(self.ctx, SSL_OP_NO_COMPRESSION)
+            self.check(self.lib.SSL_CTX_set_ciphersuites(self.ctx, ciphersuites.encode()), "Cipher suites {} could not be set".format(ciphersuites))
+            self.check(self.lib.SSL_CTX_ctrl(self.ctx, SSL_CTRL_SET_GROUPS_LIST, 0, groups.encode()), "Groups {} could not be set".format(groups))
+            self.check(self.lib.SSL_CTX_load_verify_locations(self.ctx, ca_cert.encode(), None), "CA certificate could not be loaded")
+
+            # The intermediate CA certificate is sent with the client certificate, the context takes ownership of it
+            bio = crypto.BIO_new_file(ica_cert.encode(), b"r")
+            intermediate_cert = crypto.PEM_read_bio_X509(bio, None, None, None) if bio else None
+            if bio:
+                crypto.BIO_free(bio)
+            self.check(1 if intermediate_cert else 0, "Intermediate CA certificate could not be loaded")
+            if self.lib.SSL_CTX_ctrl(self.ctx, SSL_CTRL_EXTRA_CHAIN_CERT, 0, intermediate_cert) <= 0:
+                crypto.X509_free(intermediate_cert)
+                self.check(0, "Intermediate CA certificate could not be added to the chain")
+
+            self.check(self.lib.SSL_CTX_use_certificate_file(self.ctx, client_cert.encode(), SSL_FILETYPE_PEM), "Client certificate could not be loaded")
+            self.check(self.lib.SSL_CTX_use_PrivateKey_file(self.ctx, client_key.encode(), SSL_FILETYPE_PEM), "Client key could not be loaded")
+            self.check(self.lib.SSL_CTX_check_private_key(self.ctx), "Client key does not match the certificate")
+            self.lib.SSL_CTX_set_verify(self.ctx, SSL_VERIFY_PEER, None)
+        except NativeTimerError:
+            self.close()
+            raise
+
+    def check(self, result, message):
+        if result <= 0:
+            details = errors()
+            raise NativeTimerError("{} ({})".format(message, details) if details else message)
+        return
+
+    def handshake(self, address, timeout):
+        # Timed TCP connect and TLS handshake, returns success and the start and end time in ns (CLOCK_MONOTONIC_RAW like s_timer)
+        # Note: The socket is created and set up before the start, the connection is closed after the end (RST, no TLS shutdown)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        # SSL_connect needs a blocking socket, its reads and writes time out through SO_RCVTIMEO/SO_SNDTIMEO
+        timeval = struct.pack("ll", int(timeout), int(timeout % 1 * 1000000))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+        ssl = None
+        success = False
+        start_ns = time.clock_gettime_ns(time.CLOCK_MONOTONIC_RAW)
+        try:
+            sock.connect(address)
+            ssl = self.lib.SSL_new(self.ctx)
+            self.lib.SSL_set_fd(ssl, sock.fileno())
+            success = self.lib.SSL_connect(ssl) == 1
+        except OSError:
+            pass
+        end_ns = time.clock_gettime_ns(time.CLOCK_MONOTONIC_RAW)
+
+        if ssl:
+            self.lib.SSL_set_shutdown(ssl, SSL_SENT_SHUTDOWN | SSL_RECEIVED_SHUTDOWN)
+            self.lib.SSL_free(ssl)
+        if not success:
+            load_libcrypto().ERR_clear_error()
+        sock.close()
+        return success, start_ns, end_ns
+
+    def close(self):
+        if self.ctx:
+            self.lib.SSL_CTX_free(self.ctx)
+            self.ctx = None
+        return
+
+
+def get_context(config_file, pki_path, groups, ciphersuites):
+    # Client context of a PKI, built on the first request and shared by all pairs (SSL_CTX is thread-safe)
+    load_config(config_file)
+    key = (pki_path, groups, ciphersuites)
+    with _lock:
+        if key not in _contexts:
+            _contexts[key] = ClientContext(pki_path+"/ca/ca.crt", pki_path+"/ica/ica.crt", pki_path+"/client/client.crt", pki_path+"/client/client.key", groups, ciphersuites)
+        return _contexts[key]
+
+
+def close_contexts():
+    with _lock:
+        for context in _contexts.values():
+            context.close()
+        _contexts.clear()
+    return
+
+
+def namespace_fd(namespace):
+    with _lock:
+        if namespace not in _namespace_fds:
+            _namespace_fds[namespace] = open_namespace(namespace)
+        return _namespace_fds[namespace]
+
+
+def iter_rounds(context, namespace, address, rounds, timeout, cpus=None):
+    # Rounds as tuples in the order of ROUND_RECORD (full handshakes, no phases), a failed round has status 0 and duration 0.0
+    # Note: The calling thread enters the namespace (and is pinned to the CPUs) until the iterator is exhausted or closed,
+    #       therefore it has to be consumed by one thread
+    own_ns_fd = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    own_cpus = os.sched_getaffinity(0)
+    try:
+        setns(namespace_fd(namespace))
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        for round_number in range(rounds):
+            success, start_ns, end_ns = context.handshake(address, timeout)
+            duration_ms = (end_ns - start_ns) / 1000000 if success else 0.0
+            yield (round_number, start_ns, end_ns, duration_ms, int(success), MODES.index("full"), 0, 0) + (0,) * len(PHASE_COLUMNS) + (0,)
+    finally:
+        if cpus is not None:
+            os.sched_setaffinity(0, own_cpus)
+        setns(own_ns_fd)
+        os.close(own_ns_fd)
+
+
+def measure_batch(context, namespace, address, rounds, timeout, cpus=None):
+    # Runs a batch and returns its records (NumPy array like load_round_records()) and the resource usage of the measuring thread
+    start = resource.getrusage(resource.RUSAGE_THREAD)
+    data = bytearray(RECORDS_HEADER.pack(RECORDS_MAGIC, RECORDS_VERSION, ROUND_RECORD.size))
+    for values in iter_rounds(context, namespace, address, rounds, timeout, cpus):
+        data += ROUND_RECORD.pack(*values)
+    end = resource.getrusage(resource.RUSAGE_THREAD)
+    usage = ProcessUsage(end.ru_utime - start.ru_utime, end.ru_stime - start.ru_stime, end.ru_nvcsw - start.ru_nvcsw, end.ru_nivcsw - start.ru_nivcsw, end.ru_maxrss)
+    return round_records_from_buffer(bytes(data)), usage
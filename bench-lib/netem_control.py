@@ -0,0 +1,352 @@
+##############################################################################################
+##      Title:          Netem Control                                                       ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Network emulation (netem qdisc) and static neighbor entries of the  ##
+##                      namespace pairs through rtnetlink. One netlink socket is opened     ##
+##                      per namespace, so reconfiguring a pair does not spawn processes.    ##
+##                      Applied parameters are read back and both veth ends of a pair are   ##
+##                      reconfigured atomically (rolled back if one end fails). Without     ##
+##                      root privileges, the tc/ip commands are run with sudo instead.      ##
+##                      The TCP settings of a pair (initcwnd/initrwnd metrics of the routes ##
+##                      to the peer and the congestion control of each namespace) are set   ##
+##                      the same way.                                                       ##
+##############################################################################################
+
+import os
+import socket
+import struct
+import subprocess
+import threading
+
+from netns import open_namespace, open_in_namespace, socket_in_namespace
+
+# Constants of the Linux headers (linux/netlink.h, linux/rtnetlink.h, linux/pkt_sched.h, linux/neighbour.h)
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+RTM_NEWNEIGH = 28
+RTM_NEWQDISC = 36
+RTM_GETQDISC = 38
+TC_H_ROOT = 0xFFFFFFFF
+TCA_KIND = 1
+TCA_OPTIONS = 2
+TCA_NETEM_RATE = 6
+TCA_NETEM_LATENCY64 = 10
+TCA_NETEM_RATE64 = 8
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_PERMANENT = 0x80
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+RTA_DST = 1
+RTA_OIF = 4
+RTA_METRICS = 8
+RTAX_INITCWND = 11
+RTAX_INITRWND = 14
+
+# Netlink structures: message header, tcmsg, ndmsg, rtmsg, tc_netem_qopt and tc_netem_rate
+NLMSGHDR = struct.Struct("=IHHII")
+TCMSG = struct.Struct("=BxxxiIII")
+NDMSG = struct.Struct("=BxxxiHBB")
+RTMSG = struct.Struct("=BBBBBBBBI")
+NETEM_QOPT = struct.Struct("=IIIIII")
+NETEM_RATE = struct.Struct("=IiIi")
+NLATTR = struct.Struct("=HH")
+
+# Queue limit in packets (default of tc)
+NETEM_LIMIT = 1000
+
+# Prefix length of the routes to the peer of a pair (see namespace-setup.sh)
+PEER_PREFIX_LENGTH = 24
+
+# Congestion control of the namespace (sysctl net.ipv4.tcp_congestion_control)
+CONGESTION_CONTROL_SYSCTL = "/proc/sys/net/ipv4/tcp_congestion_control"
+
+# The kernel stores netem delays in psched ticks of 64 ns in the legacy latency field
+PSCHED_SHIFT = 6
+
+U32_MAX = 0xFFFFFFFF
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def attribute(attr_type, payload):
+    return NLATTR.pack(NLATTR.size + len(payload), attr_type) + payload + b"\0" * (align(len(payload)) - len(payload))
+
+
+def parse_attributes(data):
+    attributes = {}
+    offset = 0
+    while offset + NLATTR.size <= len(data):
+        length, attr_type = NLATTR.unpack_from(data, offset)
+        if length < NLATTR.size:
+            break
+        attributes[attr_type & 0x3FFF] = data[offset + NLATTR.size:offset + length]
+        offset += align(length)
+    return attributes
+
+
+def netem_options(rate, delay, loss):
+    # Rate in Mbit/s, delay in ms and packet loss rate in percent (as used by the benchmark runners)
+    latency = int(round(delay * 1000000))
+    rate_bytes = int(round(rate * 1000000 / 8))
+    loss_probability = min(U32_MAX, int(round(loss / 100 * U32_MAX)))
+
+    options = NETEM_QOPT.pack(min(U32_MAX, latency >> PSCHED_SHIFT), NETEM_LIMIT, loss_probability, 0, 0, 0)
+    options += attribute(TCA_NETEM_LATENCY64, struct.pack("=q", latency))
+    options += attribute(TCA_NETEM_RATE, NETEM_RATE.pack(min(U32_MAX, rate_bytes), 0, 0, 0))
+    if rate_bytes >= U32_MAX:
+        options += attribute(TCA_NETEM_RATE64, struct.pack("=Q", rate_bytes))
+    return options, (rate_bytes, latency, loss_probability)
+
+
+def parse_netem_options(options):
+    # Returns the applied parameters in the units of netem_options() (bytes/s, ns, loss probability as u32)
+    latency_ticks, limit, loss_probability, gap, duplicate, jitter = NETEM_QOPT.unpack_from(options)
+    attributes = parse_attributes(options[align(NETEM_QOPT.size):])
+    latency = struct.unpack("=q", attributes[TCA_NETEM_LATENCY64])[0] if TCA_NETEM_LATENCY64 in attributes else latency_ticks << PSCHED_SHIFT
+    rate_bytes = NETEM_RATE.unpack(attributes[TCA_NETEM_RATE])[0] if TCA_NETEM_RATE in attributes else 0
+    if TCA_NETEM_RATE64 in attributes:
+        rate_bytes = struct.unpack("=Q", attributes[TCA_NETEM_RATE64])[0]
+    return rate_bytes, latency, loss_probability
+
+
+def peer_network(ip):
+    # Network of the routes to the peer, e.g. 192.168.102.0 for 192.168.102.1
+    return ip.rsplit(".", 1)[0] + ".0"
+
+
+class NetemError(Exception):
+    pass
+
+
+class NetlinkNamespace:
+    # rtnetlink socket and netem qdisc of one veth device inside a named network namespace
+
+    def __init__(self, namespace, device):
+        self.namespace = namespace
+        self.device = device
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.ns_fd = open_namespace(namespace)
+        self.sock, self.ifindex = socket_in_namespace(self.ns_fd, socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE, device)
+        self.sock.bind((0, 0))
+
+    def request(self, msg_type, flags, payload):
+        # Sends one request and returns the payloads of all replies (until the ACK or the end of the dump)
+        with self.lock:
+            self.sequence += 1
+            self.sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, self.sequence, 0) + payload)
+
+            replies = []
+            while True:
+                data = self.sock.recv(65536)
+                offset = 0
+                while offset + NLMSGHDR.size <= len(data):
+                    length, reply_type, reply_flags, sequence, pid = NLMSGHDR.unpack_from(data, offset)
+                    body = data[offset + NLMSGHDR.size:offset + length]
+                    offset += align(length)
+                    if sequence != self.sequence:
+                        continue
+                    if reply_type == NLMSG_ERROR:
+                        error = struct.unpack_from("=i", body)[0]
+                        if error != 0:
+                            raise NetemError("{} {}: {}".format(self.namespace, self.device, os.strerror(-error)))
+                        return replies
+                    if reply_type == NLMSG_DONE:
+                        return replies
+                    replies.append((reply_type, body))
+
+    def set_netem(self, rate, delay, loss, create=False):
+        options, applied = netem_options(rate, delay, loss)
+        flags = NLM_F_REQUEST | NLM_F_ACK
+        if create:
+            flags |= NLM_F_CREATE | NLM_F_EXCL
+        payload = TCMSG.pack(socket.AF_UNSPEC, self.ifindex, 0, TC_H_ROOT, 0)
+        payload += attribute(TCA_KIND, b"netem\0") + attribute(TCA_OPTIONS, options)
+        self.request(RTM_NEWQDISC, flags, payload)
+        return applied
+
+    def read_netem(self):
+        # Applied parameters of the root netem qdisc of the device, None if there is none
+        for reply_type, body in self.request(RTM_GETQDISC, NLM_F_REQUEST | NLM_F_DUMP, TCMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+            family, ifindex, handle, parent, info = TCMSG.unpack_from(body)
+            if ifindex != self.ifindex or parent != TC_H_ROOT:
+                continue
+            attributes = parse_attributes(body[TCMSG.size:])
+            if attributes.get(TCA_KIND, b"").rstrip(b"\0") != b"netem":
+                return None
+            return parse_netem_options(attributes[TCA_OPTIONS])
+        return None
+
+    def set_route(self, network, initcwnd, initrwnd):
+        # Replaces the route to the peer network, a window of 0 leaves the kernel default (no metric)
+        metrics = b""
+        if initcwnd > 0:
+            metrics += attribute(RTAX_INITCWND, struct.pack("=I", initcwnd))
+        if initrwnd > 0:
+            metrics += attribute(RTAX_INITRWND, struct.pack("=I", initrwnd))
+        payload = RTMSG.pack(socket.AF_INET, PEER_PREFIX_LENGTH, 0, 0, RT_TABLE_MAIN, RTPROT_BOOT, RT_SCOPE_LINK, RTN_UNICAST, 0)
+        payload += attribute(RTA_DST, socket.inet_aton(network)) + attribute(RTA_OIF, struct.pack("=i", self.ifindex))
+        if metrics:
+            payload += attribute(RTA_METRICS, metrics)
+        self.request(RTM_NEWROUTE, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE, payload)
+        return (initcwnd, initrwnd)
+
+    def read_route(self, network):
+        # initcwnd and initrwnd of the route to the peer network (0 if not set), None if there is no such route
+        for reply_type, body in self.request(RTM_GETROUTE, NLM_F_REQUEST | NLM_F_DUMP, RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)):
+            family, dst_len, src_len, tos, table, protocol, scope, route_type, flags = RTMSG.unpack_from(body)
+            attributes = parse_attributes(body[RTMSG.size:])
+            if dst_len != PEER_PREFIX_LENGTH or attributes.get(RTA_DST) != socket.inet_aton(network):
+                continue
+            metrics = parse_attributes(attributes.get(RTA_METRICS, b""))
+            return tuple(struct.unpack("=I", metrics[metric])[0] if metric in metrics else 0 for metric in (RTAX_INITCWND, RTAX_INITRWND))
+        return None
+
+    def set_congestion_control(self, algorithm):
+        # The sysctl file is opened inside the namespace, the kernel rejects algorithms which are not available
+        fd = open_in_namespace(self.ns_fd, CONGESTION_CONTROL_SYSCTL, os.O_WRONLY)
+        try:
+            os.write(fd, algorithm.encode())
+        except OSError as e:
+            raise NetemError("{}: congestion control {} could not be set ({})".format(self.namespace, algorithm, e.strerror))
+        finally:
+            os.close(fd)
+        return algorithm
+
+    def read_congestion_control(self):
+        fd = open_in_namespace(self.ns_fd, CONGESTION_CONTROL_SYSCTL, os.O_RDONLY)
+        try:
+            return os.read(fd, 64).decode().strip()
+        finally:
+            os.close(fd)
+
+    def add_neighbor(self, ip, mac):
+        payload = NDMSG.pack(socket.AF_INET, self.ifindex, NUD_PERMANENT, 0, 0)
+        payload += attribute(NDA_DST, socket.inet_aton(ip)) + attribute(NDA_LLADDR, bytes.fromhex(mac.replace(":", "")))
+        self.request(RTM_NEWNEIGH, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE, payload)
+        return
+
+    def close(self):
+        self.sock.close()
+        os.close(self.ns_fd)
+        return
+
+
+class NetlinkNetem:
+    # Network emulation of both ends of a namespace pair through rtnetlink
+
+    def __init__(self, pair):
+        self.pair = pair
+        self.server = NetlinkNamespace(pair.server_ns, pair.server_dev)
+        self.client = NetlinkNamespace(pair.client_ns, pair.client_dev)
+
+    def setup(self, rate, delay, loss):
+        # Initial netem qdisc and static neighbor entries of both ends
+        for end in (self.server, self.client):
+            expected = end.set_netem(rate, delay, loss, create=True)
+            self.confirm(end, expected)
+        self.server.add_neighbor(self.pair.client_ip, self.pair.client_mac)
+        self.client.add_neighbor(self.pair.server_ip, self.pair.server_mac)
+        return
+
+    def configure(self, rate, delay, loss):
+        # Change both ends, if the second end fails the first one is set back to its previous parameters
+        previous = self.server.read_netem()
+        expected = self.server.set_netem(rate, delay, loss)
+        try:
+            self.confirm(self.server, expected)
+            expected = self.client.set_netem(rate, delay, loss)
+            self.confirm(self.client, expected)
+        except (NetemError, OSError):
+            if previous is not None:
+                self.restore(self.server, previous)
+            raise
+        return
+
+    def configure_tcp(self, initcwnd, initrwnd, congestion_control):
+        # The server's first flight is limited by its initcwnd and by the initial window the client advertises (initrwnd),
+        # therefore the metrics are set on the routes of both ends
+        for end, network in ((self.server, peer_network(self.pair.client_ip)), (self.client, peer_network(self.pair.server_ip))):
+            expected = end.set_route(network, initcwnd, initrwnd)
+            applied = end.read_route(network)
+            if applied != expected:
+                raise NetemError("{} {}: route metrics {} applied instead of {}".format(end.namespace, end.device, applied, expected))
+            end.set_congestion_control(congestion_control)
+            applied = end.read_congestion_control()
+            if applied != congestion_control:
+                raise NetemError("{}: congestion control {} applied instead of {}".format(end.namespace, applied, congestion_control))
+        return
+
+    def confirm(self, end, expected):
+        applied = end.read_netem()
+        if applied != expected:
+            raise NetemError("{} {}: netem parameters {} applied instead of {}".format(end.namespace, end.device, applied, expected))
+        return
+
+    def restore(self, end, parameters):
+        rate_bytes, latency, loss_probability = parameters
+        end.set_netem(rate_bytes * 8 / 1000000, latency / 1000000, loss_probability / U32_MAX * 100)
+        return
+
+    def close(self):
+        self.server.close()
+        self.client.close()
+        return
+
+
+class SubprocessNetem:
+    # Fallback without root privileges: the same settings with "sudo ip netns exec ... tc/ip"
+
+    def __init__(self, pair):
+        self.pair = pair
+
+    def setup(self, rate, delay, loss):
+        for namespace, device in ((self.pair.server_ns, self.pair.server_dev), (self.pair.client_ns, self.pair.client_dev)):
+            self.run(namespace, ['tc', 'qdisc', 'add', 'dev', device, 'root', 'netem', 'rate', str(rate)+'mbit', 'delay', str(delay)+'ms', 'loss', str(loss)+'%'])
+        # Hard-Code MAC Addresses to prevent ARP resolutions which may cause the processes to hang, especially with high packet loss rates
+        self.run(self.pair.server_ns, ['ip', 'neighbor', 'replace', self.pair.client_ip, 'lladdr', self.pair.client_mac, 'nud', 'permanent', 'dev', self.pair.server_dev])
+        self.run(self.pair.client_ns, ['ip', 'neighbor', 'replace', self.pair.server_ip, 'lladdr', self.pair.server_mac, 'nud', 'permanent', 'dev', self.pair.client_dev])
+        return
+
+    def configure(self, rate, delay, loss):
+        for namespace, device in ((self.pair.server_ns, self.pair.server_dev), (self.pair.client_ns, self.pair.client_dev)):
+            self.run(namespace, ['tc', 'qdisc', 'change', 'dev', device, 'root', 'netem', 'rate', str(rate)+'mbit', 'delay', str(delay)+'ms', 'loss', str(loss)+'%'])
+        return
+
+    def configure_tcp(self, initcwnd, initrwnd, congestion_control):
+        for namespace, device, network in ((self.pair.server_ns, self.pair.server_dev, peer_network(self.pair.client_ip)), (self.pair.client_ns, self.pair.client_dev, peer_network(self.pair.server_ip))):
+            metrics = (['initcwnd', str(initcwnd)] if initcwnd > 0 else []) + (['initrwnd', str(initrwnd)] if initrwnd > 0 else [])
+            self.run(namespace, ['ip', 'route', 'replace', '{}/{}'.format(network, PEER_PREFIX_LENGTH), 'dev', device] + metrics)
+            self.run(namespace, ['sysctl', '-q', '-w', 'net.ipv4.tcp_congestion_control=' + congestion_control])
+        return
+
+    def run(self, namespace, command):
+        process = subprocess.run(['sudo', 'ip', 'netns', 'exec', namespace] + command, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise NetemError("{}: {}".format(namespace, process.stderr.strip()))
+        return
+
+    def close(self):
+        return
+
+
+def create_netem(pair):
+    # Netlink needs CAP_SYS_ADMIN (setns) and CAP_NET_ADMIN, i.e. the runner has to be started as root
+    if os.geteuid() == 0:
+        return NetlinkNetem(pair)
+    return SubprocessNetem(pair)
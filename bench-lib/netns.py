@@ -0,0 +1,63 @@
+##############################################################################################
+##      Title:          Network Namespaces                                                  ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Creates sockets inside the named network namespaces of "ip netns"   ##
+##                      without spawning processes. A socket stays bound to the namespace   ##
+##                      it was created in, so only its creation runs inside the namespace.  ##
+##                      The same holds for the files of /proc/sys/net (namespace sysctls).  ##
+##############################################################################################
+
+import ctypes
+import os
+import socket
+
+# Directory with the named network namespaces of "ip netns"
+NETNS_DIR = "/var/run/netns"
+
+# Namespace type of setns() (sched.h)
+CLONE_NEWNET = 0x40000000
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def open_namespace(namespace):
+    return os.open(os.path.join(NETNS_DIR, namespace), os.O_RDONLY)
+
+
+def setns(fd):
+    if _libc.setns(fd, CLONE_NEWNET) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return
+
+
+def socket_in_namespace(ns_fd, family, sock_type, proto=0, device=None):
+    # Returns the socket and, if a device name is given, the index of the device inside the namespace
+    # Note: setns() only switches the calling thread, which is switched back before returning
+    own_ns_fd = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    try:
+        setns(ns_fd)
+        try:
+            sock = socket.socket(family, sock_type, proto)
+            ifindex = socket.if_nametoindex(device) if device is not None else None
+        finally:
+            setns(own_ns_fd)
+    finally:
+        os.close(own_ns_fd)
+    return sock, ifindex
+
+
+def open_in_namespace(ns_fd, path, flags):
+    # Opens a file of /proc/sys/net inside the namespace, the file descriptor keeps referring to that namespace
+    own_ns_fd = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    try:
+        setns(ns_fd)
+        try:
+            fd = os.open(path, flags)
+        finally:
+            setns(own_ns_fd)
+    finally:
+        os.close(own_ns_fd)
+    return fd
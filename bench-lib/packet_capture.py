@@ -0,0 +1,319 @@
+##############################################################################################
+##      Title:          Packet Capture                                                      ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    In-process capture of the TLS traffic of a namespace pair. Both     ##
+##                      veth ends are read from mmap'd AF_PACKET TPACKET_V3 rings with a    ##
+##                      classic BPF filter on the TLS port and written to one pcapng file   ##
+##                      per test (one interface per end). The TLS key log is embedded as    ##
+##                      Decryption Secrets Block and batch markers as Custom Blocks.        ##
+##                      Without root privileges, tshark is used instead.                    ##
+##############################################################################################
+
+import ctypes
+import json
+import mmap
+import os
+import select
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from netns import open_namespace, socket_in_namespace
+
+# Constants of the Linux headers (linux/if_packet.h, linux/if_ether.h, asm/socket.h)
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+PACKET_OUTGOING = 4
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+
+# Ring layout: blocks are handed to user space when full or after RETIRE_TIMEOUT ms
+BLOCK_SIZE = 1 << 20
+BLOCK_COUNT = 64
+FRAME_SIZE = 1 << 11
+RETIRE_TIMEOUT = 10
+
+# Maximum number of bytes captured per packet
+SNAP_LENGTH = 262144
+
+# Poll interval in ms of the ring reader threads
+POLL_INTERVAL = 100
+
+# Ring structures: tpacket_req3, tpacket_block_desc (with tpacket_hdr_v1), tpacket3_hdr and sockaddr_ll
+TPACKET_REQ3 = struct.Struct("=IIIIIII")
+BLOCK_DESC = struct.Struct("=IIIIII")
+TPACKET3_HDR = struct.Struct("=IIIIIIHH")
+TPACKET3_HDR_LEN = 48
+SLL_PKTTYPE_OFFSET = 10
+
+# pcapng block types, option codes and constants
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_DSB = 0x0000000A
+PCAPNG_CB = 0x00000BAD
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_TLS_KEY_LOG = 0x544C534B
+OPT_ENDOFOPT = 0
+IF_NAME = 2
+IF_TSRESOL = 9
+EPB_FLAGS = 2
+EPB_INBOUND = 1
+EPB_OUTBOUND = 2
+LINKTYPE_ETHERNET = 1
+
+# Private Enterprise Number of Custom Blocks, no number is registered for the markers of this project
+# Note: Markers are recognized by their JSON payload {"marker": ...}
+MARKER_PEN = 0
+
+
+def bpf_tcp_port(port):
+    # Classic BPF program of "tcp port <port>" for IPv4 and IPv6 over Ethernet (as compiled by tcpdump -dd)
+    return [
+        (0x28, 0, 0, 0x0000000c),
+        (0x15, 0, 6, 0x000086dd),
+        (0x30, 0, 0, 0x00000014),
+        (0x15, 0, 15, 0x00000006),
+        (0x28, 0, 0, 0x00000036),
+        (0x15, 12, 0, port),
+        (0x28, 0, 0, 0x00000038),
+        (0x15, 10, 11, port),
+        (0x15, 0, 10, 0x00000800),
+        (0x30, 0, 0, 0x00000017),
+        (0x15, 0, 8, 0x00000006),
+        (0x28, 0, 0, 0x00000014),
+        (0x45, 6, 0, 0x00001fff),
+        (0xb1, 0, 0, 0x0000000e),
+        (0x48, 0, 0, 0x0000000e),
+        (0x15, 2, 0, port),
+        (0x48, 0, 0, 0x00000010),
+        (0x15, 0, 1, port),
+        (0x06, 0, 0, SNAP_LENGTH),
+        (0x06, 0, 0, 0x00000000),
+    ]
+
+
+def attach_filter(sock, program):
+    # struct sock_fprog points to the array of struct sock_filter, the kernel copies the program
+    filter_buffer = ctypes.create_string_buffer(b"".join(struct.pack("=HBBI", *instruction) for instruction in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack("@HP", len(program), ctypes.addressof(filter_buffer)))
+    return
+
+
+def pcapng_block(block_type, body):
+    body += b"\0" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("=II", block_type, length) + body + struct.pack("=I", length)
+
+
+def pcapng_option(code, value):
+    return struct.pack("=HH", code, len(value)) + value + b"\0" * (-len(value) % 4)
+
+
+class PcapngWriter:
+    # Packets and markers are written to "<file>.part" while capturing, the final file gets the key log in front of them
+    # (Wireshark only uses secrets which precede the packets)
+
+    def __init__(self, file_name, interfaces):
+        self.file_name = file_name
+        self.interfaces = interfaces
+        self.lock = threading.Lock()
+        self.part_file = open(file_name + ".part", "wb", buffering=1 << 20)
+
+    def write_packet(self, interface_id, timestamp_ns, data, original_length, outgoing):
+        options = pcapng_option(EPB_FLAGS, struct.pack("=I", EPB_OUTBOUND if outgoing else EPB_INBOUND)) + pcapng_option(OPT_ENDOFOPT, b"")
+        body = struct.pack("=IIIII", interface_id, timestamp_ns >> 32, timestamp_ns & 0xFFFFFFFF, len(data), original_length)
+        body += data + b"\0" * (-len(data) % 4) + options
+        with self.lock:
+            self.part_file.write(pcapng_block(PCAPNG_EPB, body))
+        return
+
+    def write_marker(self, marker):
+        # Timestamp in ns (CLOCK_REALTIME, like the packet timestamps) and JSON payload
+        payload = json.dumps(dict(marker, time_ns=time.time_ns())).encode("utf-8")
+        body = struct.pack("=I", MARKER_PEN) + payload + b"\0" * (-len(payload) % 4) + pcapng_option(OPT_ENDOFOPT, b"")
+        with self.lock:
+            self.part_file.write(pcapng_block(PCAPNG_CB, body))
+        return
+
+    def close(self, key_log_file=None):
+        self.part_file.close()
+        with open(self.file_name, "wb") as pcapng_file:
+            shb = struct.pack("=IHHq", PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1) + pcapng_option(OPT_ENDOFOPT, b"")
+            pcapng_file.write(pcapng_block(PCAPNG_SHB, shb))
+            for interface in self.interfaces:
+                idb = struct.pack("=HHI", LINKTYPE_ETHERNET, 0, SNAP_LENGTH)
+                idb += pcapng_option(IF_NAME, interface.encode()) + pcapng_option(IF_TSRESOL, bytes([9])) + pcapng_option(OPT_ENDOFOPT, b"")
+                pcapng_file.write(pcapng_block(PCAPNG_IDB, idb))
+            if key_log_file is not None and os.path.isfile(key_log_file):
+                with open(key_log_file, "rb") as secrets_file:
+                    secrets = secrets_file.read()
+                if secrets:
+                    pcapng_file.write(pcapng_block(PCAPNG_DSB, struct.pack("=II", PCAPNG_TLS_KEY_LOG, len(secrets)) + secrets))
+            with open(self.file_name + ".part", "rb") as part_file:
+                shutil.copyfileobj(part_file, pcapng_file, 1 << 20)
+        os.remove(self.file_name + ".part")
+        return
+
+
+class RingCapture:
+    # TPACKET_V3 ring on one device inside a namespace, read by a background thread
+
+    def __init__(self, namespace, device, port, writer, interface_id):
+        self.writer = writer
+        self.interface_id = interface_id
+        self.stopping = threading.Event()
+        self.running = threading.Event()
+        self.error = None
+
+        ns_fd = open_namespace(namespace)
+        try:
+            # Protocol 0 receives nothing until bind(), so no unfiltered packet ends up in the ring
+            self.sock, ifindex = socket_in_namespace(ns_fd, socket.AF_PACKET, socket.SOCK_RAW, 0, device)
+        finally:
+            os.close(ns_fd)
+
+        attach_filter(self.sock, bpf_tcp_port(port))
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(BLOCK_SIZE, BLOCK_COUNT, FRAME_SIZE, BLOCK_SIZE * BLOCK_COUNT // FRAME_SIZE, RETIRE_TIMEOUT, 0, 0))
+        self.ring = mmap.mmap(self.sock.fileno(), BLOCK_SIZE * BLOCK_COUNT, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock.bind((device, ETH_P_ALL))
+
+        self.reader = threading.Thread(target=self._run, name="capture-{}".format(device), daemon=True)
+        self.reader.start()
+
+    def wait_until_running(self, timeout):
+        # The ring is attached once bind() returned, the reader thread signals when it polls the ring
+        return self.running.wait(timeout)
+
+    def stop(self):
+        self.stopping.set()
+        self.reader.join()
+        self.ring.close()
+        self.sock.close()
+        if self.error is not None:
+            raise self.error
+        return
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        block = 0
+        self.running.set()
+        try:
+            while True:
+                stopping = self.stopping.is_set()
+                if stopping:
+                    # Let the kernel retire the last partially filled block
+                    time.sleep(2 * RETIRE_TIMEOUT / 1000)
+                while self._read_block(block):
+                    block = (block + 1) % BLOCK_COUNT
+                if stopping:
+                    return
+                poller.poll(POLL_INTERVAL)
+        except Exception as e:
+            self.error = e
+
+    def _read_block(self, block):
+        offset = block * BLOCK_SIZE
+        version, offset_to_priv, block_status, num_pkts, offset_to_first_pkt, blk_len = BLOCK_DESC.unpack_from(self.ring, offset)
+        if not block_status & TP_STATUS_USER:
+            return False
+
+        packet_offset = offset + offset_to_first_pkt
+        for i in range(num_pkts):
+            next_offset, sec, nsec, snaplen, length, status, mac, net = TPACKET3_HDR.unpack_from(self.ring, packet_offset)
+            outgoing = self.ring[packet_offset + TPACKET3_HDR_LEN + SLL_PKTTYPE_OFFSET] == PACKET_OUTGOING
+            data = self.ring[packet_offset + mac:packet_offset + mac + snaplen]
+            self.writer.write_packet(self.interface_id, sec * 1000000000 + nsec, data, length, outgoing)
+            packet_offset += next_offset
+
+        # Hand the block back to the kernel
+        struct.pack_into("=I", self.ring, offset + 8, TP_STATUS_KERNEL)
+        return True
+
+
+class PairCapture:
+    # Capture of both veth ends of a namespace pair into one pcapng file
+
+    def __init__(self, pair, port, file_name):
+        self.writer = PcapngWriter(file_name, [pair.server_dev, pair.client_dev])
+        self.captures = []
+        try:
+            self.captures.append(RingCapture(pair.server_ns, pair.server_dev, port, self.writer, 0))
+            self.captures.append(RingCapture(pair.client_ns, pair.client_dev, port, self.writer, 1))
+        except OSError:
+            for capture in self.captures:
+                capture.stop()
+            raise
+
+    def wait_until_running(self, timeout):
+        return all(capture.wait_until_running(timeout) for capture in self.captures)
+
+    def mark(self, marker):
+        self.writer.write_marker(marker)
+        return
+
+    def stop(self, key_log_file=None):
+        for capture in self.captures:
+            capture.stop()
+        self.writer.close(key_log_file)
+        return
+
+
+class TsharkCapture:
+    # Fallback without root privileges: one tshark process per veth end, started with sudo
+    # Note: Markers are not supported, the key log stays a separate file
+
+    def __init__(self, pair, port, file_name):
+        self.processes = []
+        base_name = file_name[:-len(".pcapng")] if file_name.endswith(".pcapng") else file_name
+        for side, namespace, device in (("server", pair.server_ns, pair.server_dev), ("client", pair.client_ns, pair.client_dev)):
+            side_file_name = "{}_{}.pcapng".format(base_name, side)
+            # Give "others" write permissions to recording file, otherwise tshark cannot record traffic (if the file is in a user's home-dir)
+            open(side_file_name, "a").close()
+            os.chmod(side_file_name, 0o666)
+            self.processes.append(subprocess.Popen(['sudo', 'ip', 'netns', 'exec', namespace, 'tshark', '-q', '-i', device, '-f', 'tcp port {}'.format(port), '-w', side_file_name], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True))
+
+    def wait_until_running(self, timeout):
+        # tshark reports "Capturing on '<device>'" on stderr once the capture is running
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            while True:
+                ready, _, _ = select.select([process.stderr], [], [], max(0, deadline - time.monotonic()))
+                if not ready:
+                    return False
+                line = process.stderr.readline()
+                if not line:
+                    return False
+                if line.startswith("Capturing on"):
+                    break
+        return True
+
+    def mark(self, marker):
+        return
+
+    def stop(self, key_log_file=None):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        return
+
+
+def create_capture(pair, port, file_name):
+    # AF_PACKET sockets and setns() need root privileges
+    if os.geteuid() == 0:
+        return PairCapture(pair, port, file_name)
+    print('\033[1;33mWARNING:\tNot running as root, traffic is recorded with tshark.\033[0m', file=sys.stderr)
+    return TsharkCapture(pair, port, file_name)
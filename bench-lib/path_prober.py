@@ -0,0 +1,210 @@
+##############################################################################################
+##      Title:          Path Prober                                                         ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Samples the RTT and loss of the network path to the server in the   ##
+##                      background for the whole measurement, with TCP connects (SYN to     ##
+##                      SYN-ACK) or ICMP echo requests from the asyncio event loop of the   ##
+##                      runner. Every sample is written to the results store with its time, ##
+##                      and the handshake rows are annotated with the path conditions that  ##
+##                      were measured around the start of their round.                      ##
+##############################################################################################
+
+import asyncio
+import bisect
+import os
+import socket
+import statistics
+import struct
+import time
+
+# Probe methods: "tcp" (time of a TCP connect to the server port, refused connects count as answered) and "icmp"
+# (echo requests, through an unprivileged ICMP socket if net.ipv4.ping_group_range allows it, otherwise a raw socket)
+PROBE_METHODS = ["tcp", "icmp"]
+
+# Seconds between the start of two probes
+DEFAULT_INTERVAL = 0.2
+# Seconds before and after the start of a round whose samples make up its path conditions
+DEFAULT_WINDOW = 2.0
+# A probe without answer within this many seconds is lost
+# Note: Below the initial retransmission timeout of a SYN (1s), so a TCP probe never counts a retransmitted SYN
+PROBE_TIMEOUT = 0.9
+
+# ICMP echo request and reply (type, code, checksum, identifier, sequence number)
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = struct.Struct("!BBHHH")
+ICMP_PAYLOAD = b"pqtls-path-probe"
+
+# Columns of the probe samples, the RTT is -1.0 for lost probes (key, type, CSV header)
+PROBE_COLUMNS = [
+    ("time", "float", "Time [s]"),
+    ("method", "str", "Probe Method"),
+    ("rtt", "float", "RTT [ms]"),
+    ("lost", "bool", "Lost"),
+]
+
+# Path conditions around a round: median RTT of the answered probes (-1.0 if none), share of lost probes (-1.0 without
+# probes) and number of probes in the window (key, type, CSV header)
+PATH_COLUMNS = [
+    ("path_rtt", "float", "Path RTT [ms]"),
+    ("path_loss", "float", "Path Loss [%]"),
+    ("path_samples", "int", "Path Samples"),
+]
+
+
+class ProberError(Exception):
+    pass
+
+
+def icmp_checksum(data):
+    # Internet checksum (RFC 1071), only needed for raw sockets (the kernel fills it in for ICMP datagram sockets)
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!{}H".format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def path_conditions(samples):
+    # Conditions (in the order of PATH_COLUMNS) of a list of RTTs in ms, None for lost probes
+    if not samples:
+        return (-1.0, -1.0, 0)
+    answered = [rtt for rtt in samples if rtt is not None]
+    return (float(statistics.median(answered)) if answered else -1.0, 100.0 * (len(samples) - len(answered)) / len(samples), len(samples))
+
+
+class PathProber:
+
+    def __init__(self, host, port, method, interval=DEFAULT_INTERVAL, window=DEFAULT_WINDOW, sink=None):
+        # The TCP probes connect to the port (any server port, the connection is closed without a handshake)
+        self.host = host
+        self.port = port
+        self.method = method
+        self.interval = interval
+        self.window = window
+        self.sink = sink
+        # Wall clock start (s) and RTT (ms, None if lost) of the samples, in the order they were taken
+        self.times = []
+        self.rtts = []
+        self._address = None
+        self._family = None
+        self._icmp_socket = None
+        self._icmp_raw = False
+        self._sequence = 0
+        self._task = None
+
+    async def start(self):
+        # Resolve the server and open the ICMP socket, then probe until stop()
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise ProberError('"{}" could not be resolved ({})'.format(self.host, e))
+        self._family, _, _, _, self._address = infos[0]
+
+        if self.method == "icmp":
+            if self._family != socket.AF_INET:
+                raise ProberError("ICMP probes are only supported for IPv4")
+            try:
+                self._icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            except PermissionError:
+                try:
+                    self._icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+                except PermissionError:
+                    raise ProberError("ICMP sockets are not permitted (root or net.ipv4.ping_group_range needed), use TCP probes")
+                self._icmp_raw = True
+            self._icmp_socket.setblocking(False)
+
+        self._task = asyncio.create_task(self._run())
+        return
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._icmp_socket is not None:
+            self._icmp_socket.close()
+            self._icmp_socket = None
+        return
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = time.time()
+            start_ns = time.monotonic_ns()
+            if self.method == "tcp":
+                rtt = await self._probe_tcp(loop)
+            else:
+                rtt = await self._probe_icmp(loop)
+            self.times.append(start)
+            self.rtts.append(rtt)
+            if self.sink is not None:
+                self.sink.write((start, self.method, rtt if rtt is not None else -1.0, rtt is None))
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic_ns() - start_ns) / 1000000000))
+
+    async def _probe_tcp(self, loop):
+        # RTT of the TCP connect in ms (SYN to SYN-ACK, or RST if the port is closed), None if lost
+        probe = socket.socket(self._family, socket.SOCK_STREAM)
+        probe.setblocking(False)
+        start_ns = time.monotonic_ns()
+        try:
+            await asyncio.wait_for(loop.sock_connect(probe, self._address), PROBE_TIMEOUT)
+        except ConnectionRefusedError:
+            pass
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            probe.close()
+        return (time.monotonic_ns() - start_ns) / 1000000
+
+    async def _probe_icmp(self, loop):
+        # RTT of an ICMP echo request in ms, None if lost
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        identifier = os.getpid() & 0xFFFF
+        request = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, self._sequence) + ICMP_PAYLOAD
+        if self._icmp_raw:
+            request = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, icmp_checksum(request), identifier, self._sequence) + ICMP_PAYLOAD
+
+        start_ns = time.monotonic_ns()
+        deadline = start_ns + int(PROBE_TIMEOUT * 1000000000)
+        try:
+            await loop.sock_sendto(self._icmp_socket, request, (self._address[0], 0))
+            while True:
+                remaining = (deadline - time.monotonic_ns()) / 1000000000
+                if remaining <= 0:
+                    return None
+                reply = await asyncio.wait_for(loop.sock_recv(self._icmp_socket, 1024), remaining)
+                # Raw sockets receive the IP header and the replies to all processes, the kernel sets the identifier of datagram sockets
+                if self._icmp_raw:
+                    reply = reply[(reply[0] & 0x0F) * 4:]
+                if len(reply) < ICMP_HEADER.size:
+                    continue
+                reply_type, _, _, reply_identifier, sequence = ICMP_HEADER.unpack_from(reply)
+                if reply_type == ICMP_ECHO_REPLY and sequence == self._sequence and (not self._icmp_raw or reply_identifier == identifier):
+                    return (time.monotonic_ns() - start_ns) / 1000000
+        except (asyncio.TimeoutError, OSError):
+            return None
+
+    def conditions(self, start_time):
+        # Path conditions (PATH_COLUMNS) of the samples within the window around a wall clock time
+        first = bisect.bisect_left(self.times, start_time - self.window)
+        last = bisect.bisect_right(self.times, start_time + self.window)
+        return path_conditions(self.rtts[first:last])
+
+    def summary(self):
+        # Path conditions of all samples
+        return path_conditions(self.rtts)
+
+    async def wait_until(self, wall_time):
+        # Waits until a probe was started after the given wall clock time (the window around a round is complete)
+        while self._task is not None and not self._task.done() and (not self.times or self.times[-1] < wall_time):
+            await asyncio.sleep(self.interval)
+        return
+
+    def annotate(self, rows, time_index):
+        # Rows with the path conditions around their start time (column time_index) appended
+        return [row + self.conditions(row[time_index]) for row in rows]
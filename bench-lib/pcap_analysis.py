@@ -0,0 +1,506 @@
+##############################################################################################
+##      Title:          Capture Analysis                                                    ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Streaming analysis of the traffic recordings (pcapng or pcap) of    ##
+##                      the emulated network runner. Files are read block by block and for  ##
+##                      each TCP connection the bytes and segments per direction, flights,  ##
+##                      retransmissions and the times of the TLS handshake records are      ##
+##                      reported. Connections are mapped to their Test Round with the       ##
+##                      batch markers and optionally joined with the benchmark results.     ##
+##                                                                                          ##
+##      Usage:          python3 pcap_analysis.py -in <file/dir> [...] -out <base path>      ##
+##                                               [-results <results .rec file>]             ##
+##############################################################################################
+
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+
+from namespace_pairs import TLS_PORT
+from results_sink import ResultsSink, iter_records, read_header
+from stimer_records import DEFAULT_GROUPS, DEFAULT_CIPHERSUITES
+
+# pcapng block types and classic pcap magic numbers
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_CB = 0x00000BAD
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+IF_TSRESOL = 9
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+
+# Link type of the veth devices
+LINKTYPE_ETHERNET = 1
+
+# TCP flags
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+# TLS record content types
+TLS_HANDSHAKE = 22
+TLS_APPLICATION_DATA = 23
+
+# Size in bytes of a TLS record header
+TLS_RECORD_HEADER = 5
+
+# Pattern of the recording file names (algname_Rate-<rate>_Delay-<delay>_Loss-<loss>[_InitCwnd-<initcwnd>][_InitRwnd-<initrwnd>][_CC-<congestion control>][_Group-<group>][_Suite-<ciphersuite>][_Mode-<mode>]_<timestamp>.pcapng)
+# Note: The colons of group and cipher suite lists are replaced with "+" in the file names
+RECORDING_NAME = re.compile(r"^(?P<algorithm>.+)_Rate-(?P<rate>[0-9.]+)_Delay-(?P<delay>[0-9.]+)_Loss-(?P<loss>[0-9.]+)(_InitCwnd-(?P<initcwnd>[0-9]+))?(_InitRwnd-(?P<initrwnd>[0-9]+))?(_CC-(?P<congestion_control>[a-z0-9_]+))?(_Group-(?P<group>[A-Za-z0-9_+-]+?))?(_Suite-(?P<ciphersuite>[A-Za-z0-9_+]+?))?(_Mode-(?P<mode>[a-z-]+))?_[0-9]{4}-[0-9]{2}-[0-9]{2}_")
+
+# Columns of the analysis results (key, type, CSV header), times are in ms relative to the SYN of the connection
+ANALYSIS_COLUMNS = [
+    ("algorithm", "str", "Signature Algorithm"),
+    ("round", "int", "Test Round"),
+    ("rate", "float", "Rate Limit"),
+    ("delay", "float", "Delay"),
+    ("loss", "float", "Packet Loss"),
+    ("initcwnd", "int", "Initial Congestion Window"),
+    ("initrwnd", "int", "Initial Receive Window"),
+    ("congestion_control", "str", "Congestion Control"),
+    ("group", "text", "Key Exchange Group"),
+    ("ciphersuite", "text", "Cipher Suite"),
+    ("mode", "str", "Handshake Mode"),
+    ("timed_out", "bool", "Timed Out"),
+    ("syn_time", "int", "SYN Time [ns]"),
+    ("client_bytes", "int", "Client Bytes"),
+    ("server_bytes", "int", "Server Bytes"),
+    ("client_segments", "int", "Client Segments"),
+    ("server_segments", "int", "Server Segments"),
+    ("client_flights", "int", "Client Flights"),
+    ("server_flights", "int", "Server Flights"),
+    ("client_retransmissions", "int", "Client Retransmissions"),
+    ("server_retransmissions", "int", "Server Retransmissions"),
+    ("client_hello", "float", "ClientHello [ms]"),
+    ("server_hello", "float", "ServerHello [ms]"),
+    ("server_flight_end", "float", "Server Handshake Flight End [ms]"),
+    ("client_finished", "float", "Client Finished [ms]"),
+    ("connection_end", "float", "Connection End [ms]"),
+]
+
+# Additional columns if the analysis is joined with the benchmark results
+JOINED_COLUMNS = [
+    ("success", "bool", "Success"),
+    ("duration", "float", "Handshake Duration [ms]"),
+]
+
+
+def iter_capture(path, packets=True):
+    # Yields ("packet", interface id, timestamp in ns, frame) and ("marker", dict) in file order
+    # Note: Without packets, only the markers are read (pcap files have none)
+    with open(path, "rb") as capture_file:
+        magic = capture_file.read(4)
+        capture_file.seek(0)
+        if struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+            yield from iter_pcapng(capture_file, packets)
+        elif packets:
+            yield from iter_pcap(capture_file)
+
+
+def iter_pcapng(capture_file, packets=True):
+    endian = "<"
+    resolutions = []
+    while header := capture_file.read(8):
+        if len(header) < 8:
+            return
+        block_type, length = struct.unpack(endian + "II", header)
+        if block_type == PCAPNG_SHB:
+            # The byte order of a section is given by its SHB
+            body = capture_file.read(4)
+            endian = "<" if struct.unpack("<I", body)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            length = struct.unpack(endian + "I", header[4:])[0]
+            capture_file.seek(length - 12, os.SEEK_CUR)
+            resolutions = []
+            continue
+
+        if not packets and block_type in (PCAPNG_EPB, PCAPNG_SPB):
+            capture_file.seek(length - 8, os.SEEK_CUR)
+            continue
+
+        body = capture_file.read(length - 12)
+        capture_file.read(4)
+        if len(body) < length - 12:
+            return
+
+        if block_type == PCAPNG_IDB:
+            resolutions.append(idb_resolution(body[8:], endian))
+        elif block_type == PCAPNG_EPB:
+            interface_id, ts_high, ts_low, captured_length, original_length = struct.unpack_from(endian + "IIIII", body)
+            yield "packet", interface_id, to_ns((ts_high << 32) | ts_low, resolutions[interface_id]), body[20:20 + captured_length]
+        elif block_type == PCAPNG_SPB:
+            yield "packet", 0, None, body[4:]
+        elif block_type == PCAPNG_CB:
+            payload = body[4:].split(b"\0", 1)[0]
+            try:
+                marker = json.loads(payload)
+            except ValueError:
+                continue
+            if isinstance(marker, dict) and "marker" in marker:
+                yield "marker", marker
+
+
+def idb_resolution(options, endian):
+    # Timestamp resolution of an interface (if_tsresol), default is microseconds
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, offset)
+        if code == 0:
+            break
+        if code == IF_TSRESOL:
+            return options[offset + 4]
+        offset += 4 + length + (-length % 4)
+    return 6
+
+
+def to_ns(timestamp, resolution):
+    if resolution & 0x80:
+        return timestamp * 1000000000 // (1 << (resolution & 0x7F))
+    return timestamp * 10 ** 9 // 10 ** resolution
+
+
+def iter_pcap(capture_file):
+    header = capture_file.read(24)
+    magic = struct.unpack("<I", header[:4])[0]
+    endian = "<" if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else ">"
+    magic = struct.unpack(endian + "I", header[:4])[0]
+    if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        raise ValueError("Unknown capture file format")
+    fraction = 1 if magic == PCAP_MAGIC_NS else 1000
+    while record_header := capture_file.read(16):
+        if len(record_header) < 16:
+            return
+        seconds, fractions, captured_length, original_length = struct.unpack(endian + "IIII", record_header)
+        frame = capture_file.read(captured_length)
+        yield "packet", 0, seconds * 1000000000 + fractions * fraction, frame
+
+
+def parse_tcp(frame):
+    # Returns (src, sport, dst, dport, seq, flags, payload) of TCP over IPv4/IPv6 in Ethernet, otherwise None
+    if len(frame) < 14:
+        return None
+    ethertype = struct.unpack_from("!H", frame, 12)[0]
+    if ethertype == 0x0800:
+        ihl = (frame[14] & 0x0F) * 4
+        if frame[23] != 6:
+            return None
+        total_length = struct.unpack_from("!H", frame, 16)[0]
+        src, dst = frame[26:30], frame[30:34]
+        tcp = 14 + ihl
+        end = 14 + total_length
+    elif ethertype == 0x86DD:
+        if frame[20] != 6:
+            return None
+        src, dst = frame[22:38], frame[38:54]
+        tcp = 54
+        end = tcp + struct.unpack_from("!H", frame, 18)[0]
+    else:
+        return None
+    if len(frame) < tcp + 20:
+        return None
+    sport, dport, seq, ack, offset_flags = struct.unpack_from("!HHIIH", frame, tcp)
+    data_offset = (offset_flags >> 12) * 4
+    return src, sport, dst, dport, seq, offset_flags & 0x3F, frame[tcp + data_offset:min(end, len(frame))]
+
+
+class Direction:
+    # One direction of a TCP connection: sequence space, in-order byte stream and TLS records
+
+    def __init__(self):
+        self.isn = None
+        self.max_end = 0
+        self.bytes = 0
+        self.segments = 0
+        self.flights = 0
+        self.retransmissions = 0
+        self.stream = bytearray()
+        self.pending = {}
+        self.next_offset = 0
+        self.records = []
+
+    def add_segment(self, seq, flags, payload, timestamp):
+        if flags & TCP_SYN:
+            self.isn = seq
+            return
+        if self.isn is None or not payload:
+            return
+
+        self.segments += 1
+        self.bytes += len(payload)
+        # Relative sequence numbers (handshakes are far below the 4 GB wrap-around)
+        start = (seq - self.isn - 1) & 0xFFFFFFFF
+        end = start + len(payload)
+        if start < self.max_end:
+            self.retransmissions += 1
+        self.max_end = max(self.max_end, end)
+
+        # Reassemble the in-order stream, out-of-order segments wait until the gap is filled
+        self.pending[start] = payload
+        while True:
+            ready = [offset for offset in self.pending if offset <= self.next_offset]
+            if not ready:
+                break
+            for offset in ready:
+                data = self.pending.pop(offset)
+                if offset + len(data) > self.next_offset:
+                    self.stream += data[self.next_offset - offset:]
+                    self.next_offset = offset + len(data)
+        self.parse_records(timestamp)
+        return
+
+    def parse_records(self, timestamp):
+        # TLS records completed by the segment get its timestamp, only the headers are kept
+        while len(self.stream) >= TLS_RECORD_HEADER:
+            content_type, version, length = struct.unpack_from("!BHH", self.stream)
+            if len(self.stream) < TLS_RECORD_HEADER + length:
+                break
+            self.records.append((timestamp, content_type))
+            del self.stream[:TLS_RECORD_HEADER + length]
+        return
+
+
+class Connection:
+
+    def __init__(self, syn_time, batch):
+        self.syn_time = syn_time
+        self.batch = batch
+        self.client = Direction()
+        self.server = Direction()
+        self.last_data_from = None
+        self.last_time = syn_time
+        self.fins = 0
+        self.closed = False
+
+    def add_packet(self, from_server, seq, flags, payload, timestamp):
+        direction = self.server if from_server else self.client
+        # A new flight starts with data after data (or SYN/FIN) of the other side, the sender had to wait for it
+        if payload and self.last_data_from != from_server:
+            direction.flights += 1
+        # Pure ACKs do not end a flight
+        if payload or flags & (TCP_SYN | TCP_FIN):
+            self.last_data_from = from_server
+        direction.add_segment(seq, flags, payload, timestamp)
+        self.last_time = timestamp
+        if flags & TCP_FIN:
+            self.fins += 1
+        if flags & TCP_RST or self.fins >= 2:
+            self.closed = True
+        return
+
+    def metrics(self):
+        def relative(timestamp):
+            return (timestamp - self.syn_time) / 1000000 if timestamp is not None else -1.0
+
+        client_hello = next((t for t, content_type in self.client.records if content_type == TLS_HANDSHAKE), None)
+        server_hello = next((t for t, content_type in self.server.records if content_type == TLS_HANDSHAKE), None)
+        # Client's encrypted handshake (Certificate, CertificateVerify, Finished) is the first encrypted client record
+        client_encrypted = [t for t, content_type in self.client.records if content_type == TLS_APPLICATION_DATA]
+        server_flight_end = None
+        client_finished = None
+        if client_encrypted:
+            server_flight_end = max((t for t, content_type in self.server.records if t <= client_encrypted[0]), default=None)
+            # Last record of the client flight, before the server sends again (session tickets)
+            next_server = min((t for t, content_type in self.server.records if t > client_encrypted[0]), default=None)
+            client_finished = max(t for t in client_encrypted if next_server is None or t <= next_server)
+
+        return {
+            "client_bytes": self.client.bytes, "server_bytes": self.server.bytes,
+            "client_segments": self.client.segments, "server_segments": self.server.segments,
+            "client_flights": self.client.flights, "server_flights": self.server.flights,
+            "client_retransmissions": self.client.retransmissions, "server_retransmissions": self.server.retransmissions,
+            "client_hello": relative(client_hello), "server_hello": relative(server_hello),
+            "server_flight_end": relative(server_flight_end), "client_finished": relative(client_finished),
+            "connection_end": relative(self.last_time),
+        }
+
+
+class Batch:
+    # Rounds of one s_timer run of a cell, the n-th connection of the batch is round first_round + n
+    # Note: In the resumption modes s_timer first sets up the session with a full handshake which is not measured, this
+    # connection is skipped
+
+    def __init__(self, cell, first_round):
+        self.cell = cell
+        self.first_round = first_round
+        self.connections = 0 if cell["mode"] == "full" else -1
+        self.timed_out = False
+        # Rounds finished before the timeout, their results were kept
+        self.completed = 0
+
+
+def analyze_capture(path, interface=0, port=TLS_PORT):
+    # Yields one dict per TCP connection to the TLS port in order of the SYN
+    cell = cell_from_file_name(path)
+    batch = Batch(cell, 1)
+    connections = {}
+    finished = []
+
+    def finish(key):
+        # Adds the row of a connection to the finished ones (the unmeasured connection of a batch has no row)
+        connection = connections.pop(key)
+        if connection.round_index < 0:
+            return
+        round_number = connection.batch.first_round + connection.round_index
+        timed_out = connection.batch.timed_out and connection.round_index >= connection.batch.completed
+        finished.append(dict(connection.batch.cell, round=round_number, timed_out=timed_out, syn_time=connection.syn_time, **connection.metrics()))
+        return
+
+    for item in iter_capture(path):
+        if item[0] == "marker":
+            marker = item[1]
+            if marker["marker"] == "test":
+                cell = cell_from_marker(marker)
+            elif marker["marker"] == "batch-start":
+                batch = Batch(cell, marker["first_round"])
+            elif marker["marker"] == "batch-timeout":
+                batch.timed_out = True
+                batch.completed = marker.get("completed", 0)
+            continue
+
+        kind, interface_id, timestamp, frame = item
+        if interface_id != interface:
+            continue
+        segment = parse_tcp(frame)
+        if segment is None:
+            continue
+        src, sport, dst, dport, seq, flags, payload = segment
+        if port not in (sport, dport):
+            continue
+
+        from_server = sport == port
+        key = (dst, dport, src, sport) if from_server else (src, sport, dst, dport)
+        connection = connections.get(key)
+        if connection is None or (connection.closed and flags & TCP_SYN and not from_server):
+            if connection is not None:
+                finish(key)
+            if not (flags & TCP_SYN) or from_server:
+                # Connection started before the capture, it cannot be assigned to a round
+                continue
+            connection = Connection(timestamp, batch)
+            connection.round_index = batch.connections
+            batch.connections += 1
+            connections[key] = connection
+        connection.add_packet(from_server, seq, flags, payload, timestamp)
+
+        # Closed connections are reported once a later connection started, so late ACKs/FINs are still counted
+        for closed_key in [k for k, c in connections.items() if c.closed and c is not connection]:
+            finish(closed_key)
+        if finished:
+            finished.sort(key=lambda row: row["syn_time"])
+            yield from finished
+            finished = []
+
+    for key in sorted(connections, key=lambda k: connections[k].syn_time):
+        finish(key)
+    yield from finished
+    return
+
+
+def cell_from_marker(marker):
+    # Cell of a "test" marker, keys missing in recordings of older runners have the default values
+    cell = {key: marker[key] for key in ("algorithm", "rate", "delay", "loss")}
+    cell["initcwnd"] = marker.get("initcwnd", 0)
+    cell["initrwnd"] = marker.get("initrwnd", 0)
+    cell["congestion_control"] = marker.get("congestion_control", "cubic")
+    cell["group"] = marker.get("group", DEFAULT_GROUPS)
+    cell["ciphersuite"] = marker.get("ciphersuite", DEFAULT_CIPHERSUITES)
+    cell["mode"] = marker.get("mode", "full")
+    return cell
+
+
+def capture_cells(path):
+    # Cells the rows of analyze_capture() can have: the cell of the file name (used until the first "test" marker) and
+    # the cells of the "test" markers (only the markers are read)
+    return [cell_from_file_name(path)] + [cell_from_marker(item[1]) for item in iter_capture(path, packets=False) if item[1]["marker"] == "test"]
+
+
+def cell_key(cell):
+    # Key of a cell (or of an analysis row) in the results of load_results()
+    return (cell["algorithm"], cell["rate"], cell["delay"], cell["loss"], cell["initcwnd"], cell["initrwnd"], cell["congestion_control"], cell["group"], cell["ciphersuite"], cell["mode"])
+
+
+def cell_from_file_name(path):
+    # Used if the recording has no "test" marker (e.g. recorded with tshark)
+    match = RECORDING_NAME.match(os.path.basename(path))
+    if match is None:
+        return {"algorithm": "", "rate": 0.0, "delay": 0.0, "loss": 0.0, "initcwnd": 0, "initrwnd": 0, "congestion_control": "cubic", "group": DEFAULT_GROUPS, "ciphersuite": DEFAULT_CIPHERSUITES, "mode": "full"}
+    return {"algorithm": match["algorithm"], "rate": float(match["rate"]), "delay": float(match["delay"]), "loss": float(match["loss"]),
+            "initcwnd": int(match["initcwnd"] or 0), "initrwnd": int(match["initrwnd"] or 0), "congestion_control": match["congestion_control"] or "cubic",
+            "group": match["group"].replace("+", ":") if match["group"] else DEFAULT_GROUPS,
+            "ciphersuite": match["ciphersuite"].replace("+", ":") if match["ciphersuite"] else DEFAULT_CIPHERSUITES,
+            "mode": match["mode"] or "full"}
+
+
+def load_results(rec_path, cells):
+    # Success and duration of the rounds of the given cells (algorithm, rate, delay, loss, initcwnd, initrwnd, congestion control, group,
+    # ciphersuite, mode) from a results record file
+    # Note: Results files without a mode column only contain full handshakes, without TCP, group and cipher suite columns the defaults were used
+    keys = [column[0] for column in read_header(rec_path)]
+    mode_index = keys.index("mode") if "mode" in keys else None
+    tcp_index = keys.index("initcwnd") if "initcwnd" in keys else None
+    group_index = keys.index("group") if "group" in keys else None
+    results = {}
+    for row in iter_records(rec_path):
+        algorithm, round_number, rate, delay, loss, success, duration = row[:7]
+        tcp = tuple(row[tcp_index:tcp_index + 3]) if tcp_index is not None else (0, 0, "cubic")
+        kex = (row[group_index], row[group_index + 1]) if group_index is not None else (DEFAULT_GROUPS, DEFAULT_CIPHERSUITES)
+        cell = (algorithm, float(rate), float(delay), float(loss)) + tcp + kex + (row[mode_index] if mode_index is not None else "full",)
+        if cell in cells:
+            results[cell + (round_number,)] = (success, duration)
+    return results
+
+
+def capture_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith((".pcapng", ".pcap")):
+                    yield os.path.join(path, file_name)
+        else:
+            yield path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Capture Analysis',
+        description='Per-handshake size, flight and retransmission metrics from the traffic recordings of the emulated network runner.')
+    parser.add_argument('-in', dest='inputs', help='capture files or directories with capture files (e.g. traffic-recordings)', metavar='<path>', nargs='+', required=True)
+    parser.add_argument('-out', help='base path of the analysis results (.rec and .csv are appended)', metavar='<file path>', required=True)
+    parser.add_argument('-results', help='results record file (.rec) of the benchmark run, to join success and handshake duration of each round', metavar='<file path>', required=False)
+    parser.add_argument('-interface', help='interface of the capture to analyze (0 is the server end of the pair), default is 0', metavar='INT', type=int, default='0', required=False)
+
+    args = parser.parse_args()
+
+    files = list(capture_files(args.inputs))
+    if not files:
+        print('\033[1;31mERROR:\t\tNo capture files found. Aborting.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+
+    if args.results is not None and not (os.path.isfile(args.results) and os.path.isfile(args.results + ".json")):
+        print('\033[1;31mERROR:\t\tRecord file "{}" or its header "{}.json" does not exist. Aborting.\033[0m'.format(args.results, args.results), file=sys.stderr)
+        sys.exit(-1)
+
+    # The results of the cells of all captures are read in one pass over the record file
+    if args.results is not None:
+        results = load_results(args.results, {cell_key(cell) for path in files for cell in capture_cells(path)})
+
+    columns = ANALYSIS_COLUMNS + (JOINED_COLUMNS if args.results is not None else [])
+    sink = ResultsSink(args.out, columns)
+
+    for path in files:
+        print('\033[1;34mINFO:\t\tAnalyzing "{}".\033[0m'.format(path), file=sys.stdout)
+        for row in analyze_capture(path, args.interface):
+            values = [row[column[0]] for column in ANALYSIS_COLUMNS]
+            if args.results is not None:
+                values += list(results.get(cell_key(row) + (row["round"],), (False, 0.0)))
+            sink.write(values)
+
+    sink.close()
+    print('\033[1;32mSUCCESS:\tAnalysis was stored in "{}.rec" and "{}.csv". Finished.\033[0m'.format(args.out, args.out), file=sys.stdout)
+    sys.exit(0)
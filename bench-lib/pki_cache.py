@@ -0,0 +1,160 @@
+##############################################################################################
+##      Title:          PKI Cache                                                           ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Content-addressed cache of generated PKIs. An entry is keyed by     ##
+##                      the signature algorithm, the RCA/ICA config templates and the       ##
+##                      OpenSSL/provider version, is generated once and then handed out     ##
+##                      as a read-only directory to all runs and runners. Missing PKIs of   ##
+##                      several algorithms are built in parallel on a process pool.         ##
+##############################################################################################
+
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+from pki_setup import PKISetupError, pki_setup, write_config
+from pki_libcrypto import pki_setup_libcrypto
+
+# Environment variable to override the cache directory
+PKI_CACHE_ENV = "PQTLS_PKI_CACHE"
+
+# Default cache directory
+DEFAULT_PKI_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pqtls-pki")
+
+# Version of the cache layout, increase if pki_setup() produces different PKIs
+CACHE_LAYOUT_VERSION = "2"
+
+# PKI set up backends: openssl CLI calls or in-process through libcrypto
+PKI_BACKENDS = {
+    "cli": pki_setup,
+    "libcrypto": pki_setup_libcrypto,
+}
+
+# Number of PKIs built in parallel, each chain (CA -> ICA -> server/client) is built sequentially by one worker
+PKI_WORKERS = os.cpu_count()
+
+# OpenSSL version and provider information (only queried once per process)
+_openssl_fingerprint = None
+
+
+def default_cache_dir():
+    return os.environ.get(PKI_CACHE_ENV, DEFAULT_PKI_CACHE)
+
+
+def openssl_fingerprint():
+    # Version, build options and loaded providers (incl. oqsprovider version) of the OpenSSL on the PATH
+    global _openssl_fingerprint
+    if _openssl_fingerprint is None:
+        version_process = subprocess.run(['openssl', 'version', '-a'], capture_output=True, text=True)
+        provider_process = subprocess.run(['openssl', 'list', '-providers'], capture_output=True, text=True)
+        if version_process.returncode != 0 or provider_process.returncode != 0:
+            print(version_process.stderr)
+            print(provider_process.stderr)
+            print('\033[1;31mERROR:\t\tCould not determine OpenSSL version for the PKI cache. Aborting.\033[0m', file=sys.stderr)
+            sys.exit(-1)
+        _openssl_fingerprint = version_process.stdout + provider_process.stdout
+    return _openssl_fingerprint
+
+
+def cache_key(alg, rca_config_template, ica_config_template, backend):
+    key = hashlib.sha256()
+    for part in (CACHE_LAYOUT_VERSION, alg, backend, openssl_fingerprint()):
+        key.update(part.encode("utf-8") + b"\0")
+    for template_file in (rca_config_template, ica_config_template):
+        with open(template_file, "rb") as template_config:
+            key.update(hashlib.sha256(template_config.read()).digest())
+    return key.hexdigest()
+
+
+def get_pki(alg, algname, rca_config_template, ica_config_template, cache_dir=None, backend="cli"):
+    # Returns the path of the (read-only) PKI of the algorithm, which is generated on the first request
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    entry_path = os.path.join(cache_dir, "{}-{}".format(algname, cache_key(alg, rca_config_template, ica_config_template, backend)[:16]))
+    pki_path = os.path.join(entry_path, "pki-{}".format(algname))
+
+    if os.path.isdir(entry_path):
+        print('\033[1;34mINFO:\t\tUsing cached "{}" PKI.\033[0m'.format(alg), file=sys.stdout)
+        return pki_path
+
+    print('\033[1;34mINFO:\t\tSetting up "{}" PKI.\033[0m'.format(alg), file=sys.stdout)
+
+    # Build in a private directory, so an interrupted or concurrent set up never leaves a partial entry behind
+    build_path = "{}.build-{}".format(entry_path, os.getpid())
+    if os.path.exists(build_path):
+        shutil.rmtree(build_path)
+    os.mkdir(build_path)
+    try:
+        PKI_BACKENDS[backend](alg, algname, build_path, rca_config_template, ica_config_template)
+    except PKISetupError:
+        shutil.rmtree(build_path)
+        raise
+
+    try:
+        os.rename(build_path, entry_path)
+    except OSError:
+        # Another process stored the same PKI in the meantime, use that one
+        shutil.rmtree(build_path)
+        return pki_path
+
+    # The CA/ICA configs contain absolute paths, point them to the final location
+    write_config(rca_config_template, os.path.join(pki_path, "oqs-openssl-ca.cnf"), os.path.join(pki_path, "ca"))
+    write_config(ica_config_template, os.path.join(pki_path, "oqs-openssl-ica.cnf"), os.path.join(pki_path, "ica"))
+
+    make_read_only(entry_path)
+    return pki_path
+
+
+def build_pkis(algs, rca_config_template, ica_config_template, cache_dir=None, backend="cli", workers=PKI_WORKERS):
+    # Gets the PKIs of all algorithms (tuples of alg and algname) before the measurements start
+    # Returns the PKI paths and the failed set ups per algorithm, a failure does not stop the other set ups
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    # Query OpenSSL once here, the forked workers inherit the result
+    openssl_fingerprint()
+
+    pki_paths = {}
+    errors = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(get_pki, alg, algname, rca_config_template, ica_config_template, cache_dir, backend): alg for alg, algname in algs}
+        for future in concurrent.futures.as_completed(futures):
+            alg = futures[future]
+            try:
+                pki_paths[alg] = future.result()
+            except PKISetupError as e:
+                errors[alg] = e
+    return pki_paths, errors
+
+
+def print_pki_errors(errors):
+    for alg, error in errors.items():
+        for message in error.messages:
+            if message:
+                print(message, file=sys.stderr)
+        print('\033[1;33mWARNING:\tError during {} setup of "{}" PKI, algorithm removed from list.\033[0m'.format(error.step, alg), file=sys.stderr)
+    return
+
+
+def make_read_only(path):
+    for dir_path, dir_names, file_names in os.walk(path, topdown=False):
+        for file_name in file_names:
+            os.chmod(os.path.join(dir_path, file_name), 0o444)
+        os.chmod(dir_path, 0o555)
+    return
+
+
+def copy_pki(pki_path, dest_path):
+    # Writable copy of a cached PKI (file contents only, the read-only modes are not copied)
+    shutil.copytree(pki_path, dest_path, copy_function=shutil.copyfile)
+    # copytree() copies the modes of directories, make them writable again
+    for dir_path, dir_names, file_names in os.walk(dest_path):
+        os.chmod(dir_path, 0o755)
+    return
@@ -0,0 +1,457 @@
+##############################################################################################
+##      Title:          In-Process PKI Setup                                                ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Sets up the same PKI as pki_setup() (Root CA, Intermediate CA,      ##
+##                      server and client certificates), but through ctypes bindings to     ##
+##                      the EVP and X509 API of libcrypto instead of openssl CLI calls.     ##
+##                      libcrypto and the providers are loaded once per process, keys and   ##
+##                      certificates are built in memory and only the final keys,           ##
+##                      certificates and configs are written to disk.                       ##
+##                                                                                          ##
+##      Usage:          Compare the certificates with those of the openssl CLI:             ##
+##                      python3 bench-lib/pki_libcrypto.py -algs <algorithm> [...]          ##
+##############################################################################################
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+
+from pki_setup import PKISetupError, pki_setup, write_config
+
+# Environment variable to override the path of libcrypto
+LIBCRYPTO_ENV = "PQTLS_LIBCRYPTO"
+
+# Subject of all certificates, the CN is added per certificate
+SUBJECT_FIELDS = [
+    ("C", "CH"),
+    ("ST", "Zug"),
+    ("L", "Rotkreuz"),
+    ("O", "Lucerne University of Applied Sciences and Arts"),
+    ("OU", "Applied Cyber Security Research Lab"),
+]
+
+# Validity in days of the certificates
+CA_DAYS = 7300
+ICA_DAYS = 3650
+EE_DAYS = 365
+
+# First serial number of certificates issued by the CA and ICA (like the serial files of the CLI set up)
+FIRST_SERIAL = 0x1000
+# Random bits of the serial number of the self-signed Root CA (like "openssl req -x509")
+ROOT_SERIAL_BITS = 159
+
+# Constants of the OpenSSL headers
+MBSTRING_UTF8 = 0x1000
+BIO_CTRL_INFO = 3
+X509_VERSION_3 = 2
+NID_SUBJECT_KEY_IDENTIFIER = 82
+
+# Size in bytes reserved for an X509V3_CTX (opaque in the public headers, 64 bytes on 64-bit platforms)
+X509V3_CTX_SIZE = 256
+
+# libcrypto handle (only loaded once per process)
+_libcrypto = None
+
+
+def libcrypto_path():
+    # Use the libcrypto of the openssl binary on the PATH, it is installed next to the provider modules directory
+    if LIBCRYPTO_ENV in os.environ:
+        return os.environ[LIBCRYPTO_ENV]
+    process = subprocess.run(['openssl', 'version', '-m'], capture_output=True, text=True)
+    if process.returncode == 0 and '"' in process.stdout:
+        lib_dir = os.path.dirname(process.stdout.split('"')[1])
+        for lib_name in ("libcrypto.so.3", "libcrypto.so"):
+            if os.path.isfile(os.path.join(lib_dir, lib_name)):
+                return os.path.join(lib_dir, lib_name)
+    return ctypes.util.find_library("crypto") or "libcrypto.so.3"
+
+
+def load_libcrypto():
+    global _libcrypto
+    if _libcrypto is not None:
+        return _libcrypto
+
+    lib = ctypes.CDLL(libcrypto_path())
+    p = ctypes.c_void_p
+    signatures = {
+        "OSSL_LIB_CTX_load_config": (ctypes.c_int, [p, ctypes.c_char_p]),
+        "ERR_get_error": (ctypes.c_ulong, []),
+        "ERR_error_string_n": (None, [ctypes.c_ulong, ctypes.c_char_p, ctypes.c_size_t]),
+        "EVP_PKEY_CTX_new_from_name": (p, [p, ctypes.c_char_p, ctypes.c_char_p]),
+        "EVP_PKEY_CTX_free": (None, [p]),
+        "EVP_PKEY_keygen_init": (ctypes.c_int, [p]),
+        "EVP_PKEY_CTX_set_group_name": (ctypes.c_int, [p, ctypes.c_char_p]),
+        "EVP_PKEY_CTX_set_rsa_keygen_bits": (ctypes.c_int, [p, ctypes.c_int]),
+        "EVP_PKEY_generate": (ctypes.c_int, [p, ctypes.POINTER(p)]),
+        "EVP_PKEY_free": (None, [p]),
+        "EVP_PKEY_get_default_digest_name": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_size_t]),
+        "EVP_sha256": (p, []),
+        "X509_new": (p, []),
+        "X509_free": (None, [p]),
+        "X509_set_version": (ctypes.c_int, [p, ctypes.c_long]),
+        "X509_get_serialNumber": (p, [p]),
+        "BN_bin2bn": (p, [ctypes.c_char_p, ctypes.c_int, p]),
+        "BN_to_ASN1_INTEGER": (p, [p, p]),
+        "BN_free": (None, [p]),
+        "X509_getm_notBefore": (p, [p]),
+        "X509_getm_notAfter": (p, [p]),
+        "X509_gmtime_adj": (p, [p, ctypes.c_long]),
+        "X509_NAME_new": (p, []),
+        "X509_NAME_free": (None, [p]),
+        "X509_NAME_add_entry_by_txt": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_int]),
+        "X509_set_subject_name": (ctypes.c_int, [p, p]),
+        "X509_set_issuer_name": (ctypes.c_int, [p, p]),
+        "X509_get_subject_name": (p, [p]),
+        "X509_set_pubkey": (ctypes.c_int, [p, p]),
+        "X509_sign": (ctypes.c_int, [p, p, p]),
+        "NCONF_new": (p, [p]),
+        "NCONF_load": (ctypes.c_int, [p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_long)]),
+        "NCONF_free": (None, [p]),
+        "NCONF_get_string": (ctypes.c_char_p, [p, ctypes.c_char_p, ctypes.c_char_p]),
+        "NCONF_get_section": (p, [p, ctypes.c_char_p]),
+        "OPENSSL_sk_num": (ctypes.c_int, [p]),
+        "OPENSSL_sk_value": (p, [p, ctypes.c_int]),
+        "OBJ_txt2nid": (ctypes.c_int, [ctypes.c_char_p]),
+        "X509_get_ext_count": (ctypes.c_int, [p]),
+        "X509_get_ext_by_NID": (ctypes.c_int, [p, ctypes.c_int, ctypes.c_int]),
+        "X509_add_ext": (ctypes.c_int, [p, p, ctypes.c_int]),
+        "X509_EXTENSION_free": (None, [p]),
+        "X509V3_EXT_nconf": (p, [p, p, ctypes.c_char_p, ctypes.c_char_p]),
+        "X509V3_set_ctx": (None, [p, p, p, p, p, ctypes.c_int]),
+        "X509V3_set_nconf": (None, [p, p]),
+        "X509V3_set_issuer_pkey": (ctypes.c_int, [p, p]),
+        "X509V3_EXT_add_nconf": (ctypes.c_int, [p, p, ctypes.c_char_p, p]),
+        "BIO_s_mem": (p, []),
+        "BIO_new": (p, [p]),
+        "BIO_free": (ctypes.c_int, [p]),
+        "BIO_ctrl": (ctypes.c_long, [p, ctypes.c_int, ctypes.c_long, p]),
+        "PEM_write_bio_X509": (ctypes.c_int, [p, p]),
+        "PEM_write_bio_PrivateKey": (ctypes.c_int, [p, p, p, p, ctypes.c_int, p, p]),
+        "BIO_new_mem_buf": (p, [ctypes.c_char_p, ctypes.c_int]),
+        "PEM_read_bio_X509": (p, [p, p, p, p]),
+        "i2d_X509": (ctypes.c_int, [p, p]),
+        "X509_get0_serialNumber": (p, [p]),
+        "i2d_ASN1_INTEGER": (ctypes.c_int, [p, p]),
+        "X509_get0_signature": (None, [ctypes.POINTER(p), ctypes.POINTER(p), p]),
+        "ASN1_STRING_length": (ctypes.c_int, [p]),
+    }
+    for name, (restype, argtypes) in signatures.items():
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+
+    _libcrypto = lib
+    return _libcrypto
+
+
+class ConfValue(ctypes.Structure):
+    # CONF_VALUE of the OpenSSL headers (entry of a config section)
+    _fields_ = [("section", ctypes.c_char_p), ("name", ctypes.c_char_p), ("value", ctypes.c_char_p)]
+
+
+class LibcryptoPKI:
+
+    def __init__(self, rca_config_template):
+        self.lib = load_libcrypto()
+        self.loaded_configs = set()
+        # Activate the providers (default and oqsprovider) like the CLI does with -config
+        self.load_config(rca_config_template)
+
+    def load_config(self, config_file):
+        if config_file in self.loaded_configs:
+            return
+        if self.lib.OSSL_LIB_CTX_load_config(None, config_file.encode()) != 1:
+            raise PKISetupError("provider", self.errors())
+        self.loaded_configs.add(config_file)
+        return
+
+    def errors(self):
+        # Drain the OpenSSL error queue
+        messages = []
+        buffer = ctypes.create_string_buffer(256)
+        while error := self.lib.ERR_get_error():
+            self.lib.ERR_error_string_n(error, buffer, len(buffer))
+            messages.append(buffer.value.decode())
+        return ["\n".join(messages)]
+
+    def check(self, result, step):
+        if not result:
+            raise PKISetupError(step, self.errors())
+        return result
+
+    def generate_key(self, alg, step):
+        # ECDSA needs the curve and RSA the key size as parameter, EdDSA and PQC only the algorithm name
+        if alg.startswith("ECDSA"):
+            name = b"EC"
+        elif alg.startswith("RSA"):
+            name = b"RSA"
+        else:
+            name = alg.encode()
+
+        ctx = self.check(self.lib.EVP_PKEY_CTX_new_from_name(None, name, None), step)
+        try:
+            self.check(self.lib.EVP_PKEY_keygen_init(ctx) == 1, step)
+            if alg.startswith("ECDSA"):
+                self.check(self.lib.EVP_PKEY_CTX_set_group_name(ctx, alg[5:].encode()) == 1, step)
+            elif alg.startswith("RSA:"):
+                self.check(self.lib.EVP_PKEY_CTX_set_rsa_keygen_bits(ctx, int(alg[4:])) == 1, step)
+            pkey = ctypes.c_void_p()
+            self.check(self.lib.EVP_PKEY_generate(ctx, ctypes.byref(pkey)) == 1, step)
+        finally:
+            self.lib.EVP_PKEY_CTX_free(ctx)
+        return pkey.value
+
+    def policy_fields(self, conf, fields, step):
+        # Subject of a certificate issued with "openssl ca": the fields in the order of the policy of the CA section,
+        # fields without policy are dropped (preserve = no)
+        ca_section = self.check(self.lib.NCONF_get_string(conf, b"ca", b"default_ca"), step)
+        policy = self.check(self.lib.NCONF_get_string(conf, ca_section, b"policy"), step)
+        entries = self.check(self.lib.NCONF_get_section(conf, policy), step)
+        subject = []
+        for i in range(self.lib.OPENSSL_sk_num(entries)):
+            nid = self.lib.OBJ_txt2nid(ctypes.cast(self.lib.OPENSSL_sk_value(entries, i), ctypes.POINTER(ConfValue)).contents.name)
+            subject += [(field, value) for field, value in fields if self.lib.OBJ_txt2nid(field.encode()) == nid]
+        return subject
+
+    def subject_name(self, fields, step):
+        name = self.check(self.lib.X509_NAME_new(), step)
+        for field, value in fields:
+            if self.lib.X509_NAME_add_entry_by_txt(name, field.encode(), MBSTRING_UTF8, value.encode(), -1, -1, 0) != 1:
+                self.lib.X509_NAME_free(name)
+                raise PKISetupError(step, self.errors())
+        return name
+
+    def signing_digest(self, pkey):
+        # Same rule as the CLI: no digest if the algorithm requires none (EdDSA, PQC), otherwise SHA-256
+        default_md = ctypes.create_string_buffer(80)
+        if self.lib.EVP_PKEY_get_default_digest_name(pkey, default_md, len(default_md)) == 2 and default_md.value == b"UNDEF":
+            return None
+        return self.lib.EVP_sha256()
+
+    def set_serial(self, cert, serial, step):
+        # Serial numbers of any size (the random serial of the Root CA does not fit into 64 bits)
+        serial_bytes = serial.to_bytes(max(1, (serial.bit_length() + 7) // 8), "big")
+        bn = self.check(self.lib.BN_bin2bn(serial_bytes, len(serial_bytes), None), step)
+        try:
+            self.check(self.lib.BN_to_ASN1_INTEGER(bn, self.lib.X509_get_serialNumber(cert)), step)
+        finally:
+            self.lib.BN_free(bn)
+        return
+
+    def issue_certificate(self, step, pkey, common_name, serial, days, config_file, extensions, issuer_cert=None, issuer_key=None):
+        # Without issuer, the certificate is self-signed
+        cert = self.check(self.lib.X509_new(), step)
+        conf = None
+        try:
+            conf = self.check(self.lib.NCONF_new(None), step)
+            error_line = ctypes.c_long()
+            self.check(self.lib.NCONF_load(conf, config_file.encode(), ctypes.byref(error_line)) == 1, step)
+
+            self.check(self.lib.X509_set_version(cert, X509_VERSION_3) == 1, step)
+            self.set_serial(cert, serial, step)
+            self.check(self.lib.X509_gmtime_adj(self.lib.X509_getm_notBefore(cert), 0), step)
+            self.check(self.lib.X509_gmtime_adj(self.lib.X509_getm_notAfter(cert), days * 24 * 3600), step)
+
+            # The subject of a self-signed certificate is taken as is (like "openssl req -x509")
+            fields = SUBJECT_FIELDS + [("CN", common_name)]
+            if issuer_cert is not None:
+                fields = self.policy_fields(conf, fields, step)
+            name = self.subject_name(fields, step)
+            try:
+                self.check(self.lib.X509_set_subject_name(cert, name) == 1, step)
+            finally:
+                self.lib.X509_NAME_free(name)
+            if issuer_cert is None:
+                issuer_cert = cert
+                issuer_key = pkey
+            self.check(self.lib.X509_set_issuer_name(cert, self.lib.X509_get_subject_name(issuer_cert)) == 1, step)
+            self.check(self.lib.X509_set_pubkey(cert, pkey) == 1, step)
+
+            # Add the extensions of the config section, like "openssl ca -extensions <section>"
+            ext_ctx = ctypes.create_string_buffer(X509V3_CTX_SIZE)
+            self.lib.X509V3_set_ctx(ext_ctx, issuer_cert, cert, None, None, 0)
+            self.lib.X509V3_set_nconf(ext_ctx, conf)
+            self.check(self.lib.X509V3_set_issuer_pkey(ext_ctx, issuer_key) == 1, step)
+            self.check(self.lib.X509V3_EXT_add_nconf(conf, ext_ctx, extensions.encode(), cert) == 1, step)
+            # Like the CLI of OpenSSL 3, a certificate with extensions gets a subject key identifier if the section has none
+            if self.lib.X509_get_ext_count(cert) > 0 and self.lib.X509_get_ext_by_NID(cert, NID_SUBJECT_KEY_IDENTIFIER, -1) < 0:
+                extension = self.check(self.lib.X509V3_EXT_nconf(conf, ext_ctx, b"subjectKeyIdentifier", b"hash"), step)
+                try:
+                    self.check(self.lib.X509_add_ext(cert, extension, -1) == 1, step)
+                finally:
+                    self.lib.X509_EXTENSION_free(extension)
+
+            self.check(self.lib.X509_sign(cert, issuer_key, self.signing_digest(issuer_key)) > 0, step)
+        except PKISetupError:
+            self.lib.X509_free(cert)
+            raise
+        finally:
+            if conf is not None:
+                self.lib.NCONF_free(conf)
+        return cert
+
+    def write_pem(self, path, write_function, *args):
+        # PEM encoding into a memory BIO, the file is written in one go
+        bio = self.check(self.lib.BIO_new(self.lib.BIO_s_mem()), path)
+        try:
+            self.check(write_function(bio, *args) == 1, path)
+            data = ctypes.c_void_p()
+            length = self.lib.BIO_ctrl(bio, BIO_CTRL_INFO, 0, ctypes.byref(data))
+            with open(path, "wb") as pem_file:
+                pem_file.write(ctypes.string_at(data, length))
+        finally:
+            self.lib.BIO_free(bio)
+        return
+
+    def write_key(self, path, pkey):
+        self.write_pem(path, self.lib.PEM_write_bio_PrivateKey, pkey, None, None, 0, None, None)
+        return
+
+    def write_cert(self, path, cert):
+        self.write_pem(path, self.lib.PEM_write_bio_X509, cert)
+        return
+
+    def certificate_sizes(self, path):
+        # Encoded size of a certificate file, of its serial number and of its signature
+        with open(path, "rb") as pem_file:
+            data = pem_file.read()
+        bio = self.check(self.lib.BIO_new_mem_buf(data, len(data)), path)
+        try:
+            cert = self.check(self.lib.PEM_read_bio_X509(bio, None, None, None), path)
+        finally:
+            self.lib.BIO_free(bio)
+        try:
+            signature = ctypes.c_void_p()
+            self.lib.X509_get0_signature(ctypes.byref(signature), None, cert)
+            return self.lib.i2d_X509(cert, None), self.lib.i2d_ASN1_INTEGER(self.lib.X509_get0_serialNumber(cert), None), self.lib.ASN1_STRING_length(signature)
+        finally:
+            self.lib.X509_free(cert)
+
+
+# One instance per process, so libcrypto and the providers are only loaded once
+_pki = None
+
+
+def pki_setup_libcrypto(alg, algname, out_dir, rca_config_template, ica_config_template):
+    global _pki
+    if _pki is None:
+        _pki = LibcryptoPKI(rca_config_template)
+
+    # Same directory layout as pki_setup(), but without CSRs, serial and index files
+    pki_path = os.path.join(out_dir, "pki-{}".format(algname))
+    ca_path = os.path.join(pki_path, "ca")
+    ica_path = os.path.join(pki_path, "ica")
+    server_path = os.path.join(pki_path, "server")
+    client_path = os.path.join(pki_path, "client")
+    for path in (pki_path, ca_path, ica_path, server_path, client_path):
+        os.mkdir(path)
+
+    ca_config = pki_path+"/oqs-openssl-ca.cnf"
+    ica_config = pki_path+"/oqs-openssl-ica.cnf"
+    write_config(rca_config_template, ca_config, ca_path)
+    write_config(ica_config_template, ica_config, ica_path)
+
+    # Note: ECDSA certificates carry the curve name in the CN
+    cn_alg = alg[5:] if alg.startswith("ECDSA") else alg
+
+    keys = []
+    certs = []
+    try:
+        # Root CA, self-signed
+        ca_key = _pki.generate_key(alg, "CA")
+        keys.append(ca_key)
+        ca_cert = _pki.issue_certificate("CA", ca_key, cn_alg+" - Test Root CA", secrets.randbits(ROOT_SERIAL_BITS), CA_DAYS, ca_config, "v3_ca")
+        certs.append(ca_cert)
+
+        # Intermediate CA, signed by the Root CA
+        ica_key = _pki.generate_key(alg, "ICA")
+        keys.append(ica_key)
+        ica_cert = _pki.issue_certificate("ICA", ica_key, cn_alg+" - Test Intermediate CA", FIRST_SERIAL, ICA_DAYS, ca_config, "v3_intermediate_ca", ca_cert, ca_key)
+        certs.append(ica_cert)
+
+        # Server and client certificate, signed by the Intermediate CA
+        server_key = _pki.generate_key(alg, "server certificate")
+        keys.append(server_key)
+        server_cert = _pki.issue_certificate("server certificate", server_key, cn_alg+" - Server Certificate", FIRST_SERIAL, EE_DAYS, ica_config, "server_cert", ica_cert, ica_key)
+        certs.append(server_cert)
+
+        client_key = _pki.generate_key(alg, "client certificate")
+        keys.append(client_key)
+        client_cert = _pki.issue_certificate("client certificate", client_key, cn_alg+" - Client Certificate", FIRST_SERIAL + 1, EE_DAYS, ica_config, "server_cert", ica_cert, ica_key)
+        certs.append(client_cert)
+
+        # Only the final artifacts are written
+        _pki.write_key(ca_path+"/ca.key", ca_key)
+        _pki.write_cert(ca_path+"/ca.crt", ca_cert)
+        _pki.write_key(ica_path+"/ica.key", ica_key)
+        _pki.write_cert(ica_path+"/ica.crt", ica_cert)
+        _pki.write_key(server_path+"/server.key", server_key)
+        _pki.write_cert(server_path+"/server.crt", server_cert)
+        _pki.write_key(client_path+"/client.key", client_key)
+        _pki.write_cert(client_path+"/client.crt", client_cert)
+    finally:
+        for cert in certs:
+            _pki.lib.X509_free(cert)
+        for key in keys:
+            _pki.lib.EVP_PKEY_free(key)
+    return
+
+
+def compare_backends(alg, rca_config_template, ica_config_template):
+    # Sets up the PKI of the algorithm with both backends and returns the certificates whose sizes differ
+    # Note: The random serial number of the Root CA and the signatures (e.g. ECDSA) do not always have the same encoded
+    # size, they are left out of the comparison
+    global _pki
+    if _pki is None:
+        _pki = LibcryptoPKI(rca_config_template)
+    algname = alg.replace(":", "") if alg.startswith("RSA") else alg
+    differences = []
+    with tempfile.TemporaryDirectory(prefix="pqtls-pki-") as temp_dir:
+        os.mkdir(os.path.join(temp_dir, "cli"))
+        os.mkdir(os.path.join(temp_dir, "libcrypto"))
+        pki_setup(alg, algname, os.path.join(temp_dir, "cli"), rca_config_template, ica_config_template)
+        pki_setup_libcrypto(alg, algname, os.path.join(temp_dir, "libcrypto"), rca_config_template, ica_config_template)
+        for cert in ("ca/ca.crt", "ica/ica.crt", "server/server.crt", "client/client.crt"):
+            cli_size, cli_serial, cli_signature = _pki.certificate_sizes(os.path.join(temp_dir, "cli", "pki-"+algname, cert))
+            size, serial, signature = _pki.certificate_sizes(os.path.join(temp_dir, "libcrypto", "pki-"+algname, cert))
+            if cli_size - cli_serial - cli_signature != size - serial - signature:
+                differences.append((cert, cli_size, size))
+    return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='In-Process PKI Setup',
+        description='Check that the libcrypto backend sets up certificates of the same size as the openssl CLI.')
+    parser.add_argument('-algs', help='signature algorithms to be checked (e.g. ED25519 RSA:3072)', metavar='<algorithm>', nargs='+', required=True)
+    parser.add_argument('-rca-config', help='path to the OpenSSL RCA config template, default is ./emulated-nw-assessmnt/oqs-openssl-rca.cnf', metavar='<file path>', default='./emulated-nw-assessmnt/oqs-openssl-rca.cnf', required=False)
+    parser.add_argument('-ica-config', help='path to the OpenSSL ICA config template, default is ./emulated-nw-assessmnt/oqs-openssl-ica.cnf', metavar='<file path>', default='./emulated-nw-assessmnt/oqs-openssl-ica.cnf', required=False)
+
+    args = parser.parse_args()
+
+    failed = False
+    for alg in args.algs:
+        try:
+            differences = compare_backends(alg, args.rca_config, args.ica_config)
+        except PKISetupError as e:
+            print('\033[1;31mERROR:\t\t{} ({}).\033[0m'.format(e, alg), file=sys.stderr)
+            failed = True
+            continue
+        for cert, cli_size, size in differences:
+            print('\033[1;31mERROR:\t\t{} of {} has {} bytes with the openssl CLI, but {} bytes with libcrypto.\033[0m'.format(cert, alg, cli_size, size), file=sys.stderr)
+        if differences:
+            failed = True
+        else:
+            print('\033[1;32mSUCCESS:\tCertificates of {} have the same size with both backends.\033[0m'.format(alg), file=sys.stdout)
+
+    if failed:
+        print('\033[1;31mERROR:\t\tThe backends set up different certificates. Aborting.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    sys.exit(0)
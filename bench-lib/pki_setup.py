@@ -0,0 +1,161 @@
+##############################################################################################
+##      Title:          PKI Setup                                                           ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Sets up the PKI (Root CA, Intermediate CA, server and client        ##
+##                      certificates) of a signature algorithm with the openssl CLI.        ##
+##                      Shared by the emulated network runner and the real network          ##
+##                      CA set up. Failing steps raise a PKISetupError, so callers can      ##
+##                      collect the errors of several PKIs built in parallel.               ##
+##############################################################################################
+
+import os
+import subprocess
+
+
+class PKISetupError(Exception):
+
+    def __init__(self, step, messages):
+        # Step of the chain (CA, ICA, server or client certificate) and the stderr output of the failed openssl calls
+        super().__init__(step, messages)
+        self.step = step
+        self.messages = messages
+
+    def __str__(self):
+        return "Error during {} setup.".format(self.step)
+
+
+def pki_setup(alg, algname, out_dir, rca_config_template, ica_config_template):
+    
+    # Prepare parent directory for algorithm specific PKI
+    pki_path = os.path.join(out_dir, "pki-{}".format(algname))
+    os.mkdir(pki_path)
+    ca_config = pki_path+"/oqs-openssl-ca.cnf"
+    ica_config = pki_path+"/oqs-openssl-ica.cnf"             
+    
+    # Create sub-directory for CA, prepare file paths, create and init serial-number file
+    ca_path = os.path.join(pki_path, "ca")
+    os.mkdir(ca_path)
+    ca_cert = ca_path+"/ca.crt"
+    ca_key = ca_path+"/ca.key"
+    serial_file = open(ca_path+"/serial", "a")
+    serial_file.write("1000")
+    serial_file.close()
+    index_file = open(ca_path+"/index.txt", "a")
+    index_file.close()
+    # Copy CA config, but set real CA path
+    write_config(rca_config_template, ca_config, ca_path)
+    
+    # Create sub-directory for ICA, prepare file paths, create and init serial-number file
+    ica_path = os.path.join(pki_path, "ica")
+    os.mkdir(ica_path)
+    ica_cert = ica_path+"/ica.crt"
+    ica_csr = ica_path+"/ica.csr"
+    ica_key = ica_path+"/ica.key"
+    file = open(ica_path+"/serial", "a")
+    file.write("1000")
+    file.close()
+    index_file = open(ica_path+"/index.txt", "a")
+    index_file.close()
+    # Copy ICA config, but set real ICA path
+    write_config(ica_config_template, ica_config, ica_path)
+    
+    
+    # Create sub-directory for server certificate, prepare file paths
+    server_path = os.path.join(pki_path, "server")
+    os.mkdir(server_path)
+    server_cert = server_path+"/server.crt"
+    server_csr = server_path+"/server.csr"
+    server_key = server_path+"/server.key"
+    
+    # Create sub-directory for client certificate, prepare file paths
+    client_path = os.path.join(pki_path, "client")
+    os.mkdir(client_path)
+    client_cert = client_path+"/client.crt"
+    client_csr = client_path+"/client.csr"
+    client_key = client_path+"/client.key"
+    
+    ####################################################################
+    # Create CA key and certificate
+    # Note: if/else is needed, because ECDSA needs additional arguments than EdDSA, RSA and PQC
+    if alg.startswith("ECDSA"):
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Root CA"
+        ec_param = 'ec_paramgen_curve:'+alg[5:]
+        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', 'ec', '-pkeyopt', ec_param, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output = True, text = True)
+    else:
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Root CA"
+        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', alg, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output=True, text = True)
+    
+    
+    if ca_cert_process.returncode != 0:
+        raise PKISetupError("CA", [ca_cert_process.stderr])
+    
+    
+    ####################################################################
+    # Create Intermediate-CA key, CSR and certificate
+    if alg.startswith("ECDSA"):
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Intermediate CA"
+        ica_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', ica_key,], capture_output=True, text = True)
+    else:
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Intermediate CA"
+        ica_key_process = subprocess.run(['openssl', 'genpkey'] + genpkey_algorithm(alg) + ['-out', ica_key, '-config', ica_config], capture_output=True, text = True)
+    
+    ica_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', ica_key, '-out', ica_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
+    ica_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'v3_intermediate_ca', '-md', 'sha256', '-batch', '-in', ica_csr, '-out', ica_cert, '-days', '3650', '-config', ca_config], capture_output=True, text = True)
+    
+    
+    if ica_key_process.returncode != 0 or ica_csr_process.returncode != 0 or ica_cert_process.returncode != 0:
+        raise PKISetupError("ICA", [ica_key_process.stderr, ica_csr_process.stderr, ica_cert_process.stderr])
+        
+    
+    ####################################################################
+    # Create Server key, CSR and certificate
+    if alg.startswith("ECDSA"):
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Server Certificate"
+        server_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', server_key,], capture_output=True, text = True)
+    else:
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Server Certificate"
+        server_key_process = subprocess.run(['openssl', 'genpkey'] + genpkey_algorithm(alg) + ['-out', server_key, '-config', ica_config], capture_output=True, text = True)
+    
+    server_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', server_key, '-out', server_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
+    server_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', server_csr, '-out', server_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
+    
+    
+    if server_key_process.returncode != 0 or server_csr_process.returncode != 0 or server_cert_process.returncode != 0:
+        raise PKISetupError("server certificate", [server_key_process.stderr, server_csr_process.stderr, server_cert_process.stderr])
+    
+    
+    ####################################################################
+    # Create Client key, CSR and certificate
+    if alg.startswith("ECDSA"):
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Client Certificate"
+        client_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', client_key,], capture_output=True, text = True)
+    else:
+        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Client Certificate"
+        client_key_process = subprocess.run(['openssl', 'genpkey'] + genpkey_algorithm(alg) + ['-out', client_key, '-config', ica_config], capture_output=True, text = True)
+    
+    client_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', client_key, '-out', client_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
+    client_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', client_csr, '-out', client_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
+    
+    
+    if client_key_process.returncode != 0 or client_csr_process.returncode != 0 or client_cert_process.returncode != 0:
+        raise PKISetupError("client certificate", [client_key_process.stderr, client_csr_process.stderr, client_cert_process.stderr])
+    
+    return
+
+
+def genpkey_algorithm(alg):
+    # "openssl req -newkey" accepts "RSA:<bits>", "openssl genpkey" needs the key size as option
+    if alg.startswith("RSA:"):
+        return ['-algorithm', 'RSA', '-pkeyopt', 'rsa_keygen_bits:'+alg[4:]]
+    return ['-algorithm', alg]
+
+
+def write_config(template_file, config_file, path):
+    # Copy config template, but set real CA/ICA path
+    with open(template_file, "rt") as template_config:
+        with open(config_file, "wt") as new_config:
+            for line in template_config:
+                new_config.write(line.replace('{path}', path))
+    return
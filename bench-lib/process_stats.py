@@ -0,0 +1,83 @@
+##############################################################################################
+##      Title:          Process Statistics                                                  ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    CPU time, context switches and peak RSS of the benchmark processes. ##
+##                      The long-lived s_server is sampled from /proc/<pid> while it runs.  ##
+##                      s_timer reports its own resource usage (--rusage) when it exits,    ##
+##                      as its /proc entry is gone by the time the runner could read it.    ##
+##############################################################################################
+
+import os
+
+# Clock ticks per second, the unit of the CPU times in /proc/<pid>/stat
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class ProcessUsage:
+
+    def __init__(self, user_s=0.0, system_s=0.0, voluntary_switches=0, involuntary_switches=0, peak_rss_kb=0):
+        self.user_s = user_s
+        self.system_s = system_s
+        self.voluntary_switches = voluntary_switches
+        self.involuntary_switches = involuntary_switches
+        self.peak_rss_kb = peak_rss_kb
+
+    def add(self, other):
+        # CPU times and context switches add up, the peak RSS is the maximum of both
+        self.user_s += other.user_s
+        self.system_s += other.system_s
+        self.voluntary_switches += other.voluntary_switches
+        self.involuntary_switches += other.involuntary_switches
+        self.peak_rss_kb = max(self.peak_rss_kb, other.peak_rss_kb)
+        return self
+
+    def since(self, start):
+        # Usage after the start sample (the peak RSS is not reset by the kernel, it is kept as is)
+        return ProcessUsage(self.user_s - start.user_s, self.system_s - start.system_s, self.voluntary_switches - start.voluntary_switches,
+                            self.involuntary_switches - start.involuntary_switches, self.peak_rss_kb)
+
+    def values(self, handshakes):
+        # Values in the order of usage_columns()
+        cpu_per_handshake = (self.user_s + self.system_s) * 1000 / handshakes if handshakes > 0 else 0.0
+        return (self.user_s, self.system_s, cpu_per_handshake, self.voluntary_switches, self.involuntary_switches, self.peak_rss_kb)
+
+
+def usage_columns(key, name):
+    # Result columns (key, type, CSV header) of the usage of one process, e.g. usage_columns("server", "Server")
+    return [
+        (key + "_user_s", "float", name + " User CPU [s]"),
+        (key + "_system_s", "float", name + " System CPU [s]"),
+        (key + "_cpu_per_handshake", "float", name + " CPU per Handshake [ms]"),
+        (key + "_voluntary_switches", "int", name + " Voluntary Context Switches"),
+        (key + "_involuntary_switches", "int", name + " Involuntary Context Switches"),
+        (key + "_peak_rss", "int", name + " Peak RSS [kB]"),
+    ]
+
+
+def read_proc_usage(pid):
+    # Usage of a running process from /proc, None if it does not exist (anymore)
+    try:
+        with open("/proc/{}/stat".format(pid), "r") as stat_file:
+            stat = stat_file.read()
+        with open("/proc/{}/status".format(pid), "r") as status_file:
+            status = dict(line.split(":", 1) for line in status_file if ":" in line)
+    except OSError:
+        return None
+
+    # The command name in parentheses may contain spaces, the fields after it start with the state (field 3)
+    fields = stat[stat.rindex(")") + 2:].split()
+    return ProcessUsage(int(fields[11]) / CLOCK_TICKS, int(fields[12]) / CLOCK_TICKS,
+                        int(status.get("voluntary_ctxt_switches", 0)), int(status.get("nonvoluntary_ctxt_switches", 0)),
+                        int(status.get("VmHWM", "0 kB").split()[0]))
+
+
+def parse_rusage(lines):
+    # Resource usage line of s_timer ("rusage:key=value,..."), None if it is missing
+    for line in lines:
+        if line.startswith("rusage:"):
+            values = dict(item.split("=", 1) for item in line[len("rusage:"):].split(","))
+            return ProcessUsage(float(values["user_s"]), float(values["system_s"]), int(values["voluntary_switches"]),
+                                int(values["involuntary_switches"]), int(values["peak_rss_kb"]))
+    return None
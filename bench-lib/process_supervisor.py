@@ -0,0 +1,143 @@
+##############################################################################################
+##      Title:          Process Supervisor                                                  ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Runs the s_server and s_timer processes of the benchmark runners    ##
+##                      from one asyncio event loop. The stdout and stderr of every child   ##
+##                      are drained continuously (a child can never block on a full pipe), ##
+##                      each process gets a deadline and all children still running are     ##
+##                      stopped when the supervisor is closed.                              ##
+##############################################################################################
+
+import asyncio
+import collections
+import signal
+
+# Maximum duration in seconds to wait for a terminated process to exit before it is killed
+SHUTDOWN_TIMEOUT = 5
+
+# Number of output lines kept of processes whose output is not collected (for error messages)
+TAIL_LINES = 20
+
+# Size in bytes of the chunks read from the pipes
+READ_SIZE = 65536
+
+# Maximum duration in seconds to read the rest of the output of an exited process
+# Note: A pipe can be kept open by a descendant the process left behind, its output is not waited for
+DRAIN_TIMEOUT = 1
+
+
+class ProcessResult:
+
+    def __init__(self, returncode, stdout, stderr, timed_out):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+class SupervisedProcess:
+    # A child process with one drain task per pipe
+
+    def __init__(self, process, name, keep_output):
+        self.process = process
+        self.name = name
+        self.keep_output = keep_output
+        self.output = {"stdout": bytearray(), "stderr": bytearray()}
+        self.tails = {"stdout": collections.deque(maxlen=TAIL_LINES), "stderr": collections.deque(maxlen=TAIL_LINES)}
+        self.drains = [asyncio.create_task(self._drain("stdout", process.stdout)), asyncio.create_task(self._drain("stderr", process.stderr))]
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def running(self):
+        return self.process.returncode is None
+
+    async def _drain(self, stream_name, stream):
+        # Collected output is kept completely, otherwise only the last lines
+        while chunk := await stream.read(READ_SIZE):
+            if self.keep_output:
+                self.output[stream_name] += chunk
+            else:
+                self.tails[stream_name].extend(chunk.decode("utf-8", "replace").splitlines())
+        return
+
+    def tail(self, stream_name="stderr"):
+        if self.keep_output:
+            return "\n".join(self.output[stream_name].decode("utf-8", "replace").splitlines()[-TAIL_LINES:])
+        return "\n".join(self.tails[stream_name])
+
+    async def wait(self, timeout=None):
+        # Returns False if the process did not exit before the deadline (the process keeps running)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        # The pipes are read until EOF, so the output is complete once the process exited
+        done, pending = await asyncio.wait(self.drains, timeout=DRAIN_TIMEOUT)
+        for drain in pending:
+            drain.cancel()
+        return True
+
+    async def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        if self.running():
+            self.signal(signal.SIGTERM)
+            if not await self.wait(timeout):
+                self.signal(signal.SIGKILL)
+        await self.wait()
+        return
+
+    def signal(self, signum):
+        try:
+            self.process.send_signal(signum)
+        except ProcessLookupError:
+            # Exited in the meantime
+            pass
+        return
+
+    def result(self, timed_out=False):
+        return ProcessResult(self.returncode, bytes(self.output["stdout"]), bytes(self.output["stderr"]), timed_out)
+
+
+class ProcessSupervisor:
+    # Starts and tracks the child processes, has to be used from the event loop of the runner
+
+    def __init__(self):
+        self.processes = set()
+
+    async def start(self, command, name=None, keep_output=True):
+        process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        supervised = SupervisedProcess(process, name or command[0], keep_output)
+        self.processes.add(supervised)
+        return supervised
+
+    async def run(self, command, timeout=None, name=None):
+        # Runs the command to completion, it is stopped if the deadline is reached (timed_out of the result is set)
+        process = await self.start(command, name)
+        try:
+            timed_out = not await process.wait(timeout)
+            if timed_out:
+                await process.stop()
+        finally:
+            if process.running():
+                # Cancelled (e.g. the run is aborted), do not leave the child behind
+                await process.stop()
+            self.processes.discard(process)
+        return process.result(timed_out)
+
+    async def stop(self, process):
+        await process.stop()
+        self.processes.discard(process)
+        return
+
+    async def close(self):
+        # Stop all children still running
+        await asyncio.gather(*(process.stop() for process in self.processes))
+        self.processes.clear()
+        return
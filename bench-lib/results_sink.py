@@ -0,0 +1,257 @@
+##############################################################################################
+##      Title:          Results Sink                                                        ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Buffered background writer for benchmark results. Rows are          ##
+##                      stored as fixed-size binary records with typed columns (loadable    ##
+##                      with numpy.fromfile/numpy.memmap) and optionally as CSV.            ##
+##                                                                                          ##
+##      Usage:          Export a record file to CSV:                                        ##
+##                      python3 results_sink.py -rec <file.rec> -csv <file.csv>             ##
+##############################################################################################
+
+import argparse
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+
+# Maximum length in bytes of string columns (e.g. algorithm names)
+STR_LENGTH = 32
+# Maximum length in bytes of text columns (e.g. colon-separated lists of key exchange groups or cipher suites)
+TEXT_LENGTH = 256
+
+# Column types: struct format character and NumPy dtype string (little endian)
+COLUMN_TYPES = {
+    "str": ("{}s".format(STR_LENGTH), "S{}".format(STR_LENGTH)),
+    "text": ("{}s".format(TEXT_LENGTH), "S{}".format(TEXT_LENGTH)),
+    "int": ("q", "<i8"),
+    "float": ("d", "<f8"),
+    "bool": ("?", "|b1"),
+}
+
+# Interval in seconds after which buffered rows are flushed to disk, if no new rows arrive
+FLUSH_INTERVAL = 1.0
+
+# Size in bytes of the file buffers
+BUFFER_SIZE = 1024 * 1024
+
+# Control messages for the writer thread
+_ROW = 0
+_FLUSH = 1
+_CLOSE = 2
+
+
+def record_struct(columns):
+    # Columns are tuples of (key, type, CSV header), all records are packed without padding
+    return struct.Struct("<" + "".join(COLUMN_TYPES[column[1]][0] for column in columns))
+
+
+def numpy_dtype_descr(columns):
+    return [(column[0], COLUMN_TYPES[column[1]][1]) for column in columns]
+
+
+class ResultsSink:
+
+    def __init__(self, base_path, columns, formats=("rec", "csv")):
+        self.base_path = base_path
+        self.columns = columns
+        self.formats = formats
+        self.record = record_struct(columns)
+        self.queue = queue.Queue()
+        self.error = None
+        self.rec_file = None
+        self.csv_file = None
+
+        if "rec" in formats:
+            # Describe the record layout next to the record file, so it can be loaded without this module
+            with open(base_path + ".rec.json", "w") as header_file:
+                json.dump({"columns": [{"key": column[0], "type": column[1], "header": column[2]} for column in columns],
+                           "dtype": numpy_dtype_descr(columns),
+                           "record_size": self.record.size}, header_file, indent=4)
+            self.rec_file = open(base_path + ".rec", "ab", buffering=BUFFER_SIZE)
+
+        if "csv" in formats:
+            new_file = not os.path.exists(base_path + ".csv")
+            self.csv_file = open(base_path + ".csv", "a", buffering=BUFFER_SIZE)
+            if new_file:
+                self.csv_file.write(",".join(column[2] for column in columns) + "\n")
+
+        self.writer = threading.Thread(target=self._run, name="results-sink", daemon=True)
+        self.writer.start()
+
+    def write(self, row):
+        # Rows are tuples with one value per column, the call only enqueues the row
+        self._check_error()
+        self.queue.put((_ROW, row))
+        return
+
+    def write_many(self, rows):
+        self._check_error()
+        for row in rows:
+            self.queue.put((_ROW, row))
+        return
+
+    def flush(self):
+        # Blocks until all rows written so far are on disk
+        done = threading.Event()
+        self.queue.put((_FLUSH, done))
+        done.wait()
+        self._check_error()
+        return
+
+    def file_sizes(self):
+        # Sizes in bytes of the results files per format, only consistent directly after flush()
+        return {extension: os.path.getsize(self.base_path + "." + extension) for extension in self.formats}
+
+    def close(self):
+        if not self.writer.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put((_CLOSE, done))
+        done.wait()
+        self.writer.join()
+        self._check_error()
+        return
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        dirty = False
+        while True:
+            try:
+                kind, payload = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                if dirty:
+                    self._flush_files(False)
+                    dirty = False
+                continue
+
+            try:
+                if kind == _ROW:
+                    self._write_row(payload)
+                    dirty = True
+                elif kind == _FLUSH:
+                    self._flush_files(True)
+                    dirty = False
+                elif kind == _CLOSE:
+                    self._flush_files(True)
+                    self._close_files()
+            except Exception as e:
+                # Keep the first error, it is raised in the calling thread on the next call
+                if self.error is None:
+                    self.error = e
+
+            if kind != _ROW:
+                payload.set()
+                if kind == _CLOSE:
+                    return
+
+    def _write_row(self, row):
+        if self.rec_file is not None:
+            self.rec_file.write(self.record.pack(*[to_typed(value, column[1]) for value, column in zip(row, self.columns)]))
+        if self.csv_file is not None:
+            self.csv_file.write(",".join(to_csv(value, column[1]) for value, column in zip(row, self.columns)) + "\n")
+
+    def _flush_files(self, sync):
+        for results_file in (self.rec_file, self.csv_file):
+            if results_file is not None:
+                results_file.flush()
+                if sync:
+                    os.fsync(results_file.fileno())
+
+    def _close_files(self):
+        for results_file in (self.rec_file, self.csv_file):
+            if results_file is not None:
+                results_file.close()
+
+
+def to_typed(value, column_type):
+    if column_type in ("str", "text"):
+        # Longer values are not truncated, the record would no longer match the CSV file and the capture markers
+        encoded = str(value).encode("utf-8")
+        length = STR_LENGTH if column_type == "str" else TEXT_LENGTH
+        if len(encoded) > length:
+            raise ValueError('"{}" is longer than {} bytes'.format(value, length))
+        return encoded
+    if column_type == "int":
+        return int(value)
+    if column_type == "float":
+        return float(value)
+    if column_type == "bool":
+        # s_timer reports success as "0"/"1"
+        return bool(int(value)) if isinstance(value, str) else bool(value)
+    raise ValueError("Unknown column type {}".format(column_type))
+
+
+def to_csv(value, column_type):
+    if column_type == "bool" and not isinstance(value, str):
+        return str(int(value))
+    return str(value)
+
+
+def read_header(rec_path):
+    with open(rec_path + ".json", "r") as header_file:
+        header = json.load(header_file)
+    columns = [(column["key"], column["type"], column["header"]) for column in header["columns"]]
+    return columns
+
+
+def iter_records(rec_path):
+    # Pure Python reader, used where NumPy is not available
+    columns = read_header(rec_path)
+    record = record_struct(columns)
+    with open(rec_path, "rb") as rec_file:
+        while chunk := rec_file.read(record.size * 4096):
+            # A partially written last record (e.g. after a crash) is ignored
+            usable = len(chunk) - len(chunk) % record.size
+            for values in record.iter_unpack(chunk[:usable]):
+                yield tuple(value.rstrip(b"\0").decode("utf-8") if column[1] in ("str", "text") else value for value, column in zip(values, columns))
+
+
+def load_records(rec_path, mmap=True):
+    # Returns a NumPy structured array with one field per column
+    import numpy as np
+
+    with open(rec_path + ".json", "r") as header_file:
+        dtype = np.dtype([tuple(field) for field in json.load(header_file)["dtype"]])
+
+    count = os.path.getsize(rec_path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    if mmap:
+        return np.memmap(rec_path, dtype=dtype, mode="r", shape=(count,))
+    return np.fromfile(rec_path, dtype=dtype, count=count)
+
+
+def export_csv(rec_path, csv_path):
+    columns = read_header(rec_path)
+    with open(csv_path, "w", buffering=BUFFER_SIZE) as csv_file:
+        csv_file.write(",".join(column[2] for column in columns) + "\n")
+        for values in iter_records(rec_path):
+            csv_file.write(",".join(to_csv(value, column[1]) for value, column in zip(values, columns)) + "\n")
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Results Sink',
+        description='Export a binary results record file to CSV.')
+    parser.add_argument('-rec', help='path to the record file (.rec) to be exported', metavar='<file path>', required=True)
+    parser.add_argument('-csv', help='path to the CSV file to be written', metavar='<file path>', required=True)
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.rec) or not os.path.isfile(args.rec + ".json"):
+        print('\033[1;31mERROR:\t\tRecord file "{}" or its header "{}.json" does not exist. Aborting.\033[0m'.format(args.rec, args.rec), file=sys.stderr)
+        sys.exit(-1)
+
+    export_csv(args.rec, args.csv)
+
+    print('\033[1;32mSUCCESS:\tResults were exported to "{}". Finished.\033[0m'.format(args.csv), file=sys.stdout)
+    sys.exit(0)
@@ -0,0 +1,199 @@
+##############################################################################################
+##      Title:          s_timer Records                                                     ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Reads the binary round records of s_timer (--records/--records-fd). ##
+##                      s_timer writes one fixed-size record per round as soon as the round ##
+##                      finished, so the rounds of a killed run are kept. Record files are  ##
+##                      mapped with numpy.memmap, a pure Python reader is the fallback.     ##
+##                      With --phases, the records contain the timestamps of the handshake  ##
+##                      phases, which split a handshake into transport and crypto parts.    ##
+##                      In load mode (--concurrency), s_timer prints a throughput summary   ##
+##                      and a latency histogram, which are parsed here as well.             ##
+##############################################################################################
+
+import os
+import struct
+import time
+
+# File header: magic, version and record size (see struct records_header in s_timer.c)
+RECORDS_MAGIC = b"STIMREC\0"
+RECORDS_VERSION = 4
+RECORDS_HEADER = struct.Struct("<8sII")
+
+# Handshake phases in the order of enum phase in s_timer.c, as result columns (key, type, CSV header)
+PHASE_COLUMNS = [
+    ("tcp_connect", "float", "TCP Connect [ms]"),
+    ("client_hello", "float", "ClientHello Sent [ms]"),
+    ("server_hello", "float", "ServerHello Received [ms]"),
+    ("server_certificate", "float", "Server Certificate Received [ms]"),
+    ("server_cert_verify", "float", "Server CertificateVerify Received [ms]"),
+    ("server_finished", "float", "Server Finished Received [ms]"),
+    ("client_certificate", "float", "Client Certificate Sent [ms]"),
+    ("client_cert_verify", "float", "Client CertificateVerify Sent [ms]"),
+    ("client_finished", "float", "Client Finished Sent [ms]"),
+    ("handshake_done", "float", "Handshake Done [ms]"),
+]
+
+# Handshake modes of s_timer (--mode), in the order of enum handshake_mode in s_timer.c
+MODES = ["full", "resume", "early-data"]
+
+# Default key exchange groups (--groups) and cipher suites (--ciphersuites) of s_timer, see DEFAULT_GROUPS in s_timer.c
+DEFAULT_GROUPS = "x25519_kyber768"
+DEFAULT_CIPHERSUITES = "TLS_AES_256_GCM_SHA384"
+
+# Key exchange group and cipher suite of a test, as result columns (key, type, CSV header)
+KEX_COLUMNS = [
+    ("group", "text", "Key Exchange Group"),
+    ("ciphersuite", "text", "Cipher Suite"),
+]
+
+# Handshake mode of each round, as result columns (key, type, CSV header)
+MODE_COLUMNS = [
+    ("mode", "str", "Handshake Mode"),
+    ("resumed", "bool", "Session Resumed"),
+    ("early_data", "bool", "Early Data Accepted"),
+]
+
+# One record per round (see struct round_record in s_timer.c)
+ROUND_RECORD = struct.Struct("<QQQdIHBB{}QQ".format(len(PHASE_COLUMNS)))
+ROUND_DTYPE = [
+    ("round", "<u8"),
+    ("start_ns", "<u8"),
+    ("end_ns", "<u8"),
+    ("duration_ms", "<f8"),
+    ("status", "<u4"),
+    ("mode", "<u2"),
+    ("resumed", "u1"),
+    ("early_data", "u1"),
+    ("phase_ns", "<u8", (len(PHASE_COLUMNS),)),
+    ("scheduled_ns", "<u8"),
+]
+
+# Load mode parameters and the latency of each handshake, as result columns (key, type, CSV header)
+LOAD_COLUMNS = [
+    ("concurrency", "int", "Concurrency"),
+    ("arrival_rate", "float", "Arrival Rate [1/s]"),
+    ("latency", "float", "Latency [ms]"),
+]
+
+# Summary printed by s_timer in load mode (key in the output, type, CSV header)
+LOAD_SUMMARY_COLUMNS = [
+    ("duration_s", "float", "Duration [s]"),
+    ("handshakes", "int", "Handshakes"),
+    ("failures", "int", "Failures"),
+    ("dropped", "int", "Dropped Arrivals"),
+    ("throughput", "float", "Throughput [1/s]"),
+    ("p50_ms", "float", "Latency p50 [ms]"),
+    ("p90_ms", "float", "Latency p90 [ms]"),
+    ("p99_ms", "float", "Latency p99 [ms]"),
+    ("max_ms", "float", "Latency max [ms]"),
+]
+
+# Buckets of the latency histogram of s_timer in load mode
+HISTOGRAM_COLUMNS = [
+    ("bucket_ms", "float", "Latency Bucket Upper Bound [ms]"),
+    ("count", "int", "Handshakes"),
+]
+
+
+class RecordsError(Exception):
+    pass
+
+
+def check_header(data):
+    if len(data) < RECORDS_HEADER.size:
+        # s_timer did not get to write the header (e.g. failed at start up)
+        raise RecordsError("Records header missing")
+    magic, version, record_size = RECORDS_HEADER.unpack_from(data)
+    if magic != RECORDS_MAGIC or version != RECORDS_VERSION or record_size != ROUND_RECORD.size:
+        raise RecordsError("Unsupported records format (version {}, record size {})".format(version, record_size))
+    return
+
+
+def load_round_records(path, mmap=True):
+    # Returns a NumPy structured array of all complete records, a partially written last record is ignored
+    import numpy as np
+
+    with open(path, "rb") as records_file:
+        check_header(records_file.read(RECORDS_HEADER.size))
+
+    count = (os.path.getsize(path) - RECORDS_HEADER.size) // ROUND_RECORD.size
+    if count == 0:
+        return np.zeros(0, dtype=ROUND_DTYPE)
+    if mmap:
+        return np.memmap(path, dtype=ROUND_DTYPE, mode="r", offset=RECORDS_HEADER.size, shape=(count,))
+    return np.fromfile(path, dtype=ROUND_DTYPE, count=count, offset=RECORDS_HEADER.size)
+
+
+def round_records_from_buffer(data):
+    # Records read from a pipe (--records-fd), without copying the buffer
+    import numpy as np
+
+    check_header(data)
+    count = (len(data) - RECORDS_HEADER.size) // ROUND_RECORD.size
+    return np.frombuffer(data, dtype=ROUND_DTYPE, count=count, offset=RECORDS_HEADER.size)
+
+
+def phase_offsets(records):
+    # Phases relative to the start of each round in ms, -1.0 if a phase was not reached (or not measured)
+    import numpy as np
+
+    phases = records["phase_ns"]
+    offsets = (phases.astype(np.int64) - records["start_ns"].astype(np.int64)[:, None]) / 1000000
+    return np.where(phases > 0, offsets, -1.0)
+
+
+def mode_values(records):
+    # Mode columns of each round
+    return [(MODES[mode], resumed == 1, early_data == 1) for mode, resumed, early_data in zip(records["mode"].tolist(), records["resumed"].tolist(), records["early_data"].tolist())]
+
+
+def latencies(records):
+    # Latency of each handshake in ms, in an open loop (--arrival-rate) from the scheduled arrival on
+    import numpy as np
+
+    start = np.where(records["scheduled_ns"] > 0, records["scheduled_ns"], records["start_ns"])
+    return (records["end_ns"].astype(np.int64) - start.astype(np.int64)) / 1000000
+
+
+def clock_offset_ns():
+    # Offset of the wall clock to CLOCK_MONOTONIC_RAW (the clock of the record timestamps) in ns
+    return time.time_ns() - time.clock_gettime_ns(time.CLOCK_MONOTONIC_RAW)
+
+
+def start_times(records, offset_ns):
+    # Wall clock time of the start of each round in seconds since the epoch (offset_ns taken by clock_offset_ns())
+    import numpy as np
+
+    return (records["start_ns"].astype(np.int64) + offset_ns) / 1000000000
+
+
+def parse_load_output(lines):
+    # Summary ("load:key=value,...") and histogram ("histogram:upper_ms:count,...") lines of s_timer in load mode
+    # Returns the summary values in the order of LOAD_SUMMARY_COLUMNS and the histogram as (upper_ms, count) pairs
+    summary = None
+    histogram = []
+    for line in lines:
+        if line.startswith("load:"):
+            values = dict(item.split("=", 1) for item in line[len("load:"):].split(","))
+            summary = tuple(float(values[key]) if column_type == "float" else int(values[key]) for key, column_type, header in LOAD_SUMMARY_COLUMNS)
+        elif line.startswith("histogram:"):
+            for item in line[len("histogram:"):].split(","):
+                upper, count = item.rsplit(":", 1)
+                histogram.append((float(upper), int(count)))
+    if summary is None:
+        raise RecordsError("Load summary missing in the output of s_timer")
+    return summary, histogram
+
+
+def iter_round_records(path):
+    # Pure Python reader, used where NumPy is not available
+    with open(path, "rb") as records_file:
+        check_header(records_file.read(RECORDS_HEADER.size))
+        while chunk := records_file.read(ROUND_RECORD.size * 4096):
+            usable = len(chunk) - len(chunk) % ROUND_RECORD.size
+            yield from ROUND_RECORD.iter_unpack(chunk[:usable])
+            if usable < len(chunk):
+                return
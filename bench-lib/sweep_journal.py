@@ -0,0 +1,126 @@
+##############################################################################################
+##      Title:          Sweep Journal                                                       ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Append-only checkpoint journal (JSON lines) of a benchmark sweep.   ##
+##                      Every committed batch records the rounds done per cell and the      ##
+##                      sizes of the results (and usage) files, so an interrupted sweep     ##
+##                      can be resumed without losing or duplicating rows.                  ##
+##############################################################################################
+
+import json
+import os
+import threading
+
+# File name of the journal inside the output directory
+JOURNAL_FILE_NAME = "sweep-journal.jsonl"
+
+
+class SweepJournal:
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, JOURNAL_FILE_NAME)
+        self.lock = threading.Lock()
+        self.results_file_name = None
+        self.parameters = {}
+        self.file_sizes = {}
+        self.usage_sizes = {}
+        self.rounds_done = {}
+        self.cells_done = set()
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        # Replay the journal, a partially written last line (crash during write) is ignored
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+
+                if entry["type"] == "run":
+                    self.results_file_name = entry["results"]
+                    self.parameters = entry["parameters"]
+                    self.file_sizes = entry["sizes"]
+                    self.usage_sizes = entry.get("usage_sizes", {})
+                elif entry["type"] == "batch":
+                    self.rounds_done[cell_key(entry["cell"])] = entry["rounds"]
+                    self.file_sizes = entry["sizes"]
+                    self.usage_sizes = entry.get("usage_sizes", self.usage_sizes)
+                elif entry["type"] == "cell":
+                    self.rounds_done[cell_key(entry["cell"])] = entry["rounds"]
+                    self.cells_done.add(cell_key(entry["cell"]))
+                    self.usage_sizes = entry.get("usage_sizes", self.usage_sizes)
+        return
+
+    def start_run(self, results_file_name, parameters, results_sink, usage_sink):
+        results_sink.flush()
+        usage_sink.flush()
+        self.results_file_name = results_file_name
+        self.parameters = parameters
+        self.file_sizes = results_sink.file_sizes()
+        self.usage_sizes = usage_sink.file_sizes()
+        self._append({"type": "run", "results": results_file_name, "parameters": parameters, "sizes": self.file_sizes, "usage_sizes": self.usage_sizes})
+        return
+
+    def commit_batch(self, cell, rounds, results_sink, rows, usage_sink=None, usage_row=None):
+        # Rows, flush and journal entry are serialized, so the recorded file sizes always end on a committed batch
+        with self.lock:
+            results_sink.write_many(rows)
+            results_sink.flush()
+            self.file_sizes = results_sink.file_sizes()
+            self.rounds_done[cell_key(cell)] = rounds
+            entry = {"type": "batch", "cell": list(cell), "rounds": rounds, "sizes": self.file_sizes}
+            self._write_usage(entry, usage_sink, usage_row)
+            self._append(entry)
+        return
+
+    def finish_cell(self, cell, rounds, usage_sink=None, usage_row=None):
+        # The usage row of the cell is committed with the entry that finishes it, a resumed cell is never counted twice
+        with self.lock:
+            self.rounds_done[cell_key(cell)] = rounds
+            self.cells_done.add(cell_key(cell))
+            entry = {"type": "cell", "cell": list(cell), "rounds": rounds}
+            self._write_usage(entry, usage_sink, usage_row)
+            self._append(entry)
+        return
+
+    def is_done(self, cell):
+        return cell_key(cell) in self.cells_done
+
+    def rounds_of(self, cell):
+        return self.rounds_done.get(cell_key(cell), 0)
+
+    def truncate_results(self):
+        # Drop rows written after the last committed batch (e.g. the batch running at the time of the crash)
+        for file_name_suffix, file_sizes in (("", self.file_sizes), ("_usage", self.usage_sizes)):
+            for extension, size in file_sizes.items():
+                file_name = self.results_file_name + file_name_suffix + "." + extension
+                if os.path.isfile(file_name) and os.path.getsize(file_name) > size:
+                    os.truncate(file_name, size)
+        return
+
+    def _write_usage(self, entry, usage_sink, usage_row):
+        # Called with the lock held, the recorded usage file sizes always end on a committed usage row
+        if usage_sink is None:
+            return
+        usage_sink.write(usage_row)
+        usage_sink.flush()
+        self.usage_sizes = usage_sink.file_sizes()
+        entry["usage_sizes"] = self.usage_sizes
+        return
+
+    def _append(self, entry):
+        with open(self.path, "a") as journal_file:
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        return
+
+
+def cell_key(cell):
+    # Cells are tuples of their dimension values, the key is independent of float/int formatting
+    return json.dumps([str(value) for value in cell])
@@ -0,0 +1,151 @@
+##############################################################################################
+##      Title:          TLS Server Manager                                                  ##
+##                                                                                          ##
+##      Author:         Joshua Drexel, HSLU, Switzerland                                    ##
+##                                                                                          ##
+##      Description:    Keeps one OpenSSL s_server process alive inside the server          ##
+##                      namespace of a namespace pair for the duration of a benchmark       ##
+##                      cell. Readiness is checked by probing the listening port instead    ##
+##                      of sleeping. The process runs under the process supervisor, which   ##
+##                      drains its output, so the calls are coroutines of the runner loop.  ##
+##                      The CPU time, context switches and peak RSS of the server are       ##
+##                      accumulated over all its (re)starts while it serves the cell.       ##
+##############################################################################################
+
+import asyncio
+import sys
+import time
+
+from namespace_pairs import TLS_PORT
+from process_stats import ProcessUsage, read_proc_usage
+
+# Interval in seconds between two readiness probes of the server port
+PROBE_INTERVAL = 0.01
+
+# Maximum duration in seconds to wait for a started server to listen on its port
+STARTUP_TIMEOUT = 10
+
+# TCP state "LISTEN" as used in /proc/<pid>/net/tcp
+TCP_LISTEN = "0A"
+
+
+class TLSServerManager:
+
+    def __init__(self, pair, server_args, supervisor):
+        self.pair = pair
+        self.server_args = server_args
+        self.supervisor = supervisor
+        self.port = TLS_PORT
+        self.process = None
+        self.restarts = 0
+        # Usage of the stopped server processes and the sample of the running one when it got ready
+        self.stopped_usage = ProcessUsage()
+        self.start_usage = ProcessUsage()
+
+    async def start(self):
+        # Start s_server process in the server namespace of the pair (pinned to the server cores of the pair)
+        # Note: The output is drained continuously, only its last lines are kept for error messages
+        self.process = await self.supervisor.start(self.pair.server_command(['openssl', 's_server', '-accept', str(self.port)] + self.server_args), "s_server " + self.pair.server_ns, keep_output=False)
+
+        ready = await self.wait_until_ready()
+        # The set up of the server (loading keys and provider) is not counted
+        self.start_usage = self.sample_usage()
+        return ready
+
+    async def stop(self):
+        if self.process is None:
+            return
+
+        # The /proc entries are gone once the server exited
+        # Note: The usage of a server which died on its own is lost
+        if self.process.running():
+            self.stopped_usage.add(self.sample_usage().since(self.start_usage))
+        await self.supervisor.stop(self.process)
+        self.process = None
+        return
+
+    async def restart(self):
+        await self.stop()
+        self.restarts = self.restarts + 1
+        return await self.start()
+
+    async def ensure_running(self):
+        # Restart the server only if it died in the meantime
+        if self.process is None or not self.process.running():
+            print('\033[1;33mWARNING:\tTLS server in namespace {} is not running anymore. Restarting it.\033[0m'.format(self.pair.server_ns), file=sys.stderr)
+            return await self.restart()
+        return True
+
+    async def wait_until_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+
+        while time.monotonic() < deadline:
+            if not self.process.running():
+                # Server exited during start up
+                return False
+            if self.is_listening():
+                return True
+            await asyncio.sleep(PROBE_INTERVAL)
+
+        return False
+
+    def usage(self):
+        # Usage of the server since the start of the cell, including the running process
+        usage = ProcessUsage().add(self.stopped_usage)
+        if self.process is not None and self.process.running():
+            usage.add(self.sample_usage().since(self.start_usage))
+        return usage
+
+    def sample_usage(self):
+        # The sudo process and its descendants (ip netns exec, taskset and s_server) are summed up
+        usage = ProcessUsage()
+        if self.process is None:
+            return usage
+        for pid in [self.process.pid] + descendant_pids(self.process.pid):
+            process_usage = read_proc_usage(pid)
+            if process_usage is not None:
+                usage.add(process_usage)
+        return usage
+
+    def error_output(self):
+        # Last lines of the server's stderr, e.g. why it did not start
+        return self.process.tail() if self.process is not None else ""
+
+    def is_listening(self):
+        # The sudo process itself stays in the root namespace, therefore only its descendants are probed.
+        # Note: /proc/<pid>/net shows the network namespace of the given process, so the port can be
+        #       probed without entering the namespace or spawning any additional process.
+        for pid in descendant_pids(self.process.pid):
+            for table in ("tcp", "tcp6"):
+                if port_in_state(pid, table, self.port, TCP_LISTEN):
+                    return True
+        return False
+
+
+def descendant_pids(pid):
+    pids = []
+    try:
+        with open("/proc/{}/task/{}/children".format(pid, pid), "r") as children_file:
+            children = children_file.read().split()
+    except OSError:
+        return pids
+
+    for child in children:
+        pids.append(int(child))
+        pids.extend(descendant_pids(int(child)))
+    return pids
+
+
+def port_in_state(pid, table, port, state):
+    try:
+        with open("/proc/{}/net/{}".format(pid, table), "r") as table_file:
+            # Skip header line
+            next(table_file, None)
+            for line in table_file:
+                fields = line.split()
+                local_port = int(fields[1].rsplit(":", 1)[1], 16)
+                if local_port == port and fields[3] == state:
+                    return True
+    except OSError:
+        return False
+    return False
@@ -11,18 +11,40 @@
 ##                      - Have PATH and LD_LIBRARY_PATH adjusted to point to the OpenSSL    ##
 ##                        version, which has the OQS-Provider activated                     ##
 ##                        (if multiple OpenSSL versions are installed).                     ##
+##                      - Have NumPy installed (the s_timer records are memory-mapped).     ##
 ##############################################################################################
 
 import argparse
+import asyncio
+import atexit
 import os
 import sys
 import subprocess
 import shutil
-import time
+import tempfile
 from datetime import datetime
 
+# Path to directory with the shared benchmark modules
+BENCH_LIB = "./bench-lib"
+sys.path.append(BENCH_LIB)
+from tls_server_manager import TLSServerManager
+from namespace_pairs import MAX_PAIRS, TLS_PORT, create_pairs
+from results_sink import TEXT_LENGTH, ResultsSink, iter_records
+from sweep_journal import SweepJournal
+from adaptive_sampling import ADAPTIVE_SAMPLE_SIZE, has_converged
+from netem_control import NetemError, create_netem
+from packet_capture import create_capture
+from pki_cache import PKI_BACKENDS, default_cache_dir, build_pkis, print_pki_errors
+from process_supervisor import ProcessSupervisor
+from experiment_spec import DEFAULT_HANDSHAKE_MS, ExperimentSpec, SpecError, load_spec, expand_plan, parse_shard, select_shard, estimate_cell_seconds, print_plan
+from process_stats import ProcessUsage, usage_columns, parse_rusage
+from native_timer import NativeTimerError, get_context, close_contexts, measure_batch
+from stimer_records import DEFAULT_GROUPS, DEFAULT_CIPHERSUITES, KEX_COLUMNS, MODES, MODE_COLUMNS, PHASE_COLUMNS, LOAD_COLUMNS, LOAD_SUMMARY_COLUMNS, HISTOGRAM_COLUMNS, RecordsError, load_round_records, phase_offsets, mode_values, latencies, parse_load_output
+
 # Path to s_timer binary
 STIMER_BINARY = "./tls-client/s_timer"
+# Handshake timers: the s_timer binary (one process per batch) or the in-process libssl timer (see native_timer.py)
+TIMERS = ["stimer", "native"]
 # Path to namespace setup script
 NSPACE_SETUP = "./virt-test-env/namespace-setup.sh"
 # Path to namespace cleanup script
@@ -34,13 +56,19 @@ OSSL_RCA_CONFIG = "./emulated-nw-assessmnt/oqs-openssl-rca.cnf"
 # Path to OpenSSL ICA config file
 OSSL_ICA_CONFIG = "./emulated-nw-assessmnt/oqs-openssl-ica.cnf"
 
+# Defaults of the experiment, a spec file (-spec) overrides them (see experiment-specs/)
+
 # Sample size per iteration
 # Note: The number of rounds provided as argument to this script is split up in SAMPLE_SIZE chunks.
-SAMPLE_SIZE = 1
+#       All chunks of a test are sent to the same long-lived TLS server, which is only restarted if it dies or hangs.
+SAMPLE_SIZE = 1000
 
 # Maximum duration in seconds for a single handshake (used for timeout)
 MAX_HS_DUR = 30
 
+# Maximum duration in seconds until the traffic capture of a test is running
+CAPTURE_START_TIMEOUT = 10
+
 # List of the traditional algorithms used for reference
 # Uncomment if an algorithm should be included in the test
 TRADITIONAL_SIG_ALGS = []
@@ -57,7 +85,120 @@ RATE_VALUES = [10000.0]
 DELAY_VALUES = [0.0,5.0,50.0]
 LOSS_VALUES = [0,0.1,1.0]
 
-def run_benchmark_test(retry):
+# Lists of key exchange groups and TLS 1.3 cipher suites, each value is passed to s_server and s_timer as is
+# Note: A value may also be a colon-separated list, the client sends a key share for its first group only
+# Uncomment if a group or cipher suite should be included in the test
+GROUP_VALUES = [DEFAULT_GROUPS]
+#GROUP_VALUES.append("x25519")
+#GROUP_VALUES.append("kyber512")
+#GROUP_VALUES.append("kyber768")
+#GROUP_VALUES.append("kyber1024")
+#GROUP_VALUES.append("p256_kyber512")
+#GROUP_VALUES.append("p384_kyber768")
+#GROUP_VALUES.append("p521_kyber1024")
+CIPHERSUITE_VALUES = [DEFAULT_CIPHERSUITES]
+#CIPHERSUITE_VALUES.append("TLS_AES_128_GCM_SHA256")
+#CIPHERSUITE_VALUES.append("TLS_CHACHA20_POLY1305_SHA256")
+
+# Lists of INT initial congestion windows and initial receive windows (segments) of the routes between the namespaces
+# and of the TCP congestion control algorithms of the namespaces, a window of 0 keeps the kernel default (10 segments)
+# Note: Large certificate chains do not fit into the server's first flight with the default window, a larger one saves round trips
+# Uncomment if a value should be included in the test
+INITCWND_VALUES = [0]
+#INITCWND_VALUES.append(4)
+#INITCWND_VALUES.append(32)
+#INITCWND_VALUES.append(64)
+INITRWND_VALUES = [0]
+#INITRWND_VALUES.append(64)
+CONGESTION_CONTROL_VALUES = ["cubic"]
+#CONGESTION_CONTROL_VALUES.append("reno")
+#CONGESTION_CONTROL_VALUES.append("bbr")
+
+# Columns of the results files (key, type, CSV header)
+RESULTS_COLUMNS = [
+    ("algorithm", "str", "Signature Algorithm"),
+    ("round", "int", "Test Round"),
+    ("rate", "float", "Rate Limit"),
+    ("delay", "float", "Delay"),
+    ("loss", "float", "Packet Loss"),
+    ("success", "bool", "Success"),
+    ("duration", "float", "Handshake Duration [ms]"),
+]
+
+# TCP settings of a test, as result columns (key, type, CSV header)
+TCP_COLUMNS = [
+    ("initcwnd", "int", "Initial Congestion Window"),
+    ("initrwnd", "int", "Initial Receive Window"),
+    ("congestion_control", "str", "Congestion Control"),
+]
+
+# Columns identifying a test in the usage, summary and histogram files (key, type, CSV header)
+TEST_COLUMNS = [RESULTS_COLUMNS[0]] + RESULTS_COLUMNS[2:5] + TCP_COLUMNS + KEX_COLUMNS + MODE_COLUMNS[:1]
+LOAD_TEST_COLUMNS = TEST_COLUMNS + LOAD_COLUMNS[:2]
+
+# CPU time, context switches and peak RSS of s_server and s_timer per test
+USAGE_COLUMNS = [("handshakes", "int", "Handshakes")] + usage_columns("server", "Server") + usage_columns("client", "Client")
+
+async def run_cells(ns_pairs, cells):
+    # All cells are tasks of one event loop, each runs on the next free namespace pair
+    free_pairs = asyncio.Queue()
+    for pair in ns_pairs:
+        free_pairs.put_nowait(pair)
+    
+    tasks = [asyncio.create_task(run_guarded_cell(free_pairs, cell)) for cell in cells]
+    try:
+        for task in asyncio.as_completed(tasks):
+            abort = await task
+            if abort is not None:
+                raise abort
+    finally:
+        # If a cell aborted, the other cells are cancelled and all s_server/s_timer processes still running are stopped
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await supervisor.close()
+    
+    return
+
+async def run_guarded_cell(free_pairs, cell):
+    # sys.exit() of a cell is returned instead of raised, as it would otherwise leave the event loop before the cleanup
+    try:
+        await run_test_cell(free_pairs, *cell)
+    except SystemExit as abort:
+        return abort
+    return None
+
+async def run_test_cell(free_pairs, alg, algname, pki_path, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, done_rounds, concurrency=None, arrival_rate=None):
+    # Take a free namespace pair, waits until one is available
+    pair = await free_pairs.get()
+    
+    try:
+        print('\033[1;34mINFO:\t\tPair {}: "{}" with Rate = {}Mbit/s, Delay = {}ms, Packet Loss Rate = {}%, TCP {} (initcwnd {}, initrwnd {}), {} with {}, {} handshakes.\033[0m'.format(pair.index, alg, rate, delay, loss, congestion_control, initcwnd, initrwnd, group, ciphersuite, mode), file=sys.stdout)
+        # Change network emulation of both ends of the pair to specified rate, delay and loss
+        try:
+            await asyncio.to_thread(pair.netem.configure, rate, delay, loss)
+        except (NetemError, OSError) as e:
+            print('\033[1;31mERROR:\t\tNetwork emulation of pair {} could not be changed ({}). Aborting.\033[0m'.format(pair.index, e), file=sys.stderr)
+            sys.exit(-1)
+        # Change the initial windows of the routes and the congestion control of both namespaces
+        try:
+            await asyncio.to_thread(pair.netem.configure_tcp, initcwnd, initrwnd, congestion_control)
+        except (NetemError, OSError) as e:
+            print('\033[1;31mERROR:\t\tTCP settings of pair {} could not be changed ({}). Aborting.\033[0m'.format(pair.index, e), file=sys.stderr)
+            sys.exit(-1)
+        
+        # Execute the test using s_timer
+        if concurrency is None:
+            await run_benchmark_test(pair, alg, algname, pki_path, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, done_rounds)
+        else:
+            await run_load_test(pair, alg, pki_path, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, concurrency, arrival_rate)
+    finally:
+        # Hand the pair back for the next cell
+        free_pairs.put_nowait(pair)
+    
+    return
+
+async def run_benchmark_test(pair, alg, algname, pki_path, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, done_rounds):
     # Prepare file paths
     ca_cert = pki_path+"/ca/ca.crt"
     ica_cert = pki_path+"/ica/ica.crt"
@@ -66,309 +207,327 @@ def run_benchmark_test(retry):
     client_cert = pki_path+"/client/client.crt"
     client_key = pki_path+"/client/client.key"
     
-    # If record flag is set, prepare Wireshark file for traffic dump
+    # s_timer writes one binary record per round to this file, one file per pair
+    records_file_name = os.path.join(records_dir, "pair{}.bin".format(pair.index))
+    test = (alg, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode)
+    
+    # If record flag is set, capture the traffic of both ends of the pair into one pcapng file per test
     if record_traffic:
-        traffic_recordings_file_name_server = wireshark_folder_path+"/server-"+algname+"_Rate-"+str(rate)+"_Delay-"+str(delay)+"_Loss-"+str(loss)+"_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".pcap"
-        dump_file = open(traffic_recordings_file_name_server, "a")
-        dump_file.close()
+        recording_name = wireshark_folder_path+"/"+algname+"_Rate-"+str(rate)+"_Delay-"+str(delay)+"_Loss-"+str(loss)+("_InitCwnd-"+str(initcwnd) if initcwnd > 0 else "")+("_InitRwnd-"+str(initrwnd) if initrwnd > 0 else "")+("_CC-"+congestion_control if congestion_control != "cubic" else "")+("_Group-"+group.replace(":", "+") if group != DEFAULT_GROUPS else "")+("_Suite-"+ciphersuite.replace(":", "+") if ciphersuite != DEFAULT_CIPHERSUITES else "")+("_Mode-"+mode if mode != "full" else "")+"_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        traffic_recordings_file_name = recording_name+".pcapng"
         
-        traffic_recordings_file_name_client = wireshark_folder_path+"/client-"+algname+"_Rate-"+str(rate)+"_Delay-"+str(delay)+"_Loss-"+str(loss)+"_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".pcap"
-        dump_file = open(traffic_recordings_file_name_client, "a")
-        dump_file.close()
-        
-        # Prepare tls session secrets file for later traffic decryption in Wireshark
-        session_secrets_file_name = wireshark_folder_path+"/"+algname+"_Rate-"+str(rate)+"_Delay-"+str(delay)+"_Loss-"+str(loss)+"_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".secrets"
+        # Prepare tls session secrets file for later traffic decryption in Wireshark (also embedded in the pcapng file)
+        session_secrets_file_name = recording_name+".secrets"
         secrets_file = open(session_secrets_file_name, "a")
         secrets_file.close()
-
         
-        # Give "others" write permissions to recording file, otherwise tshark cannot record traffic (if the file is in a user's home-dir)
-        os.chmod(traffic_recordings_file_name_server, 0o666)
-        os.chmod(traffic_recordings_file_name_client, 0o666)
+        # Start the capture and wait until it is running (instead of waiting a fixed time)
+        # Note: As root, the traffic is read from AF_PACKET rings in this process, otherwise with tshark
+        traffic_capture = create_capture(pair, TLS_PORT, traffic_recordings_file_name)
+        if not await asyncio.to_thread(traffic_capture.wait_until_running, CAPTURE_START_TIMEOUT):
+            print('\033[1;31mERROR:\t\tFailure during start of traffic capture. Aborting.\033[0m', file=sys.stderr)
+            await asyncio.to_thread(traffic_capture.stop)
+            sys.exit(-1)
+        # Test parameters of the recording, used by pcap_analysis.py to join the connections with the results
+        traffic_capture.mark({"marker": "test", "algorithm": alg, "rate": rate, "delay": delay, "loss": loss, "initcwnd": initcwnd, "initrwnd": initrwnd, "congestion_control": congestion_control, "group": group, "ciphersuite": ciphersuite, "mode": mode})
 
 
-        # Start wireshark process in namespace ns1 (server)
-        # Note: Use Popen, as the process needs to run in background
-        wireshark_server = subprocess.Popen(['sudo', 'ip', 'netns', 'exec', 'ns1', 'tshark', '-i', 'veth101', '-w', traffic_recordings_file_name_server], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-        # Wait for wireshark to start
-        time.sleep(2)
-    
-        if wireshark_server is None:
-            print('\033[1;31mERROR:\t\tFailure during start of wireshark for server. Aborting.\033[0m', file=sys.stderr)
-            sys.exit(-1)
-            
-        # Start wireshark process in namespace ns2 (client)
-        # Note: Use Popen, as the process needs to run in background
-        wireshark_client = subprocess.Popen(['sudo', 'ip', 'netns', 'exec', 'ns2', 'tshark', '-i', 'veth102', '-w', traffic_recordings_file_name_client], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-        # Wait for wireshark to start
-        time.sleep(2)
+    # Start one s_server process in the server namespace of the pair, which is kept alive for all chunks of this test
+    # Note: Early data is only accepted by s_server if it is enabled
+    if record_traffic:
+        tls_server = TLSServerManager(pair, ['-cert', server_cert, '-key', server_key, '-tls1_3', '-Verify', '2', '-verify_return_error', '-CAfile', ca_cert, '-chainCAfile', ica_cert, '-ignore_unexpected_eof', '-groups', group, '-ciphersuites', ciphersuite, '-keylogfile', session_secrets_file_name, '-quiet'] + (['-early_data'] if mode == "early-data" else []), supervisor)
+    else:
+        tls_server = TLSServerManager(pair, ['-cert', server_cert, '-key', server_key, '-tls1_3', '-verify', '2', '-verify_return_error', '-CAfile', ca_cert, '-chainCAfile', ica_cert, '-ignore_unexpected_eof', '-groups', group, '-ciphersuites', ciphersuite, '-quiet'] + (['-early_data'] if mode == "early-data" else []), supervisor)
+    
+    # Check if process start was successful
+    # Note: The start is only reported as successful once the server listens on its port
+    if not await tls_server.start():
+        print('\033[1;31mERROR:\t\tFailure during start of TLS server. Aborting.\033[0m', file=sys.stderr)
+        print(tls_server.error_output(), file=sys.stderr)
+        await tls_server.stop()
+        sys.exit(-1)
     
-        if wireshark_client is None:
-            print('\033[1;31mERROR:\t\tFailure during start of wireshark for client. Aborting.\033[0m', file=sys.stderr)
-            sys.exit(-1)
     
-
     #Split in SAMPLE_SIZE-chunks of rounds to fail faster and repeat the execution if TIMEOUT is reached
-    open_rounds = rounds
-    output_iterator = 1
+    # Note: If the sweep is resumed, the rounds already committed to the journal are skipped
+    open_rounds = rounds - done_rounds
+    output_iterator = done_rounds + 1
+    sample_size = SAMPLE_SIZE
+    
+    # In adaptive mode, the test runs in smaller chunks until the percentiles converged, at most max_rounds
+    if adaptive:
+        open_rounds = max_rounds - done_rounds
+        sample_size = min(SAMPLE_SIZE, ADAPTIVE_SAMPLE_SIZE)
+        durations = load_cell_durations(alg, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode) if done_rounds > 0 else []
+    
+    # Resource usage of s_timer (summed over the batches) and the successful handshakes it was spent on
+    # Note: The usage of the server is accounted by the server manager, from its start up on
+    client_usage = ProcessUsage()
+    handshakes = 0
     
     while(open_rounds > 0):
         
-        if(open_rounds - SAMPLE_SIZE >= 0):
-            # Another full SAMPLE_SIZE-rounds chunk to go
-            run_rounds = SAMPLE_SIZE
-            open_rounds = open_rounds - SAMPLE_SIZE
+        if(open_rounds - sample_size >= 0):
+            # Another full sample_size-rounds chunk to go
+            run_rounds = sample_size
+            open_rounds = open_rounds - sample_size
         else:
             # Run a last time with the left-over rounds to go
             run_rounds = open_rounds
             open_rounds = 0
     
-    
-        # Start s_server process in namespace ns1     
-        if record_traffic:
-            tls_server = subprocess.Popen(['sudo', 'ip', 'netns', 'exec', 'ns1', 'openssl', 's_server', '-cert', server_cert, '-key', server_key, '-tls1_3', '-Verify', '2', '-verify_return_error', '-CAfile', ca_cert, '-chainCAfile', ica_cert, '-ignore_unexpected_eof', '-keylogfile', session_secrets_file_name, '-quiet'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        else:
-            tls_server = subprocess.Popen(['sudo', 'ip', 'netns', 'exec', 'ns1', 'openssl', 's_server', '-cert', server_cert, '-key', server_key, '-tls1_3', '-verify', '2', '-verify_return_error', '-CAfile', ca_cert, '-chainCAfile', ica_cert, '-ignore_unexpected_eof', '-quiet'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Wait for server to start
-        time.sleep(0.2)
-        
-        # Check if process start was successful
-        if tls_server is None:
-            print('\033[1;31mERROR:\t\tFailure during start of TLS server. Aborting.\033[0m', file=sys.stderr)
+        # Make sure the TLS server is still alive, it is only restarted if it died
+        if not await tls_server.ensure_running():
+            print('\033[1;31mERROR:\t\tFailure during restart of TLS server. Aborting.\033[0m', file=sys.stderr)
+            print(tls_server.error_output(), file=sys.stderr)
+            await tls_server.stop()
             sys.exit(-1)
         
         
-        
-        # Start s_timer process in namespace ns2        
-        tls_client = subprocess.Popen(['sudo', 'ip', 'netns', 'exec', 'ns2', STIMER_BINARY, '-h', '192.168.101.1:4433', '-r', str(run_rounds), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert, '--config='+OSSL_CONFIG], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Mark the start of the batch in the traffic recording, the handshakes of the batch follow in round order
+        if record_traffic:
+            traffic_capture.mark({"marker": "batch-start", "first_round": output_iterator, "rounds": run_rounds})
         
         # It is assumed that no more than MAX_HS_DUR seconds per handshake are required.
         timeout = MAX_HS_DUR * run_rounds
         
-        try:
-            tls_client.wait(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            print(f'\033[1;31mERROR:\t\tTimeout reached for {alg} with rate of {rate}, {delay}ms delay and {loss}% packet loss. Repeating the test.\033[0m', file=sys.stderr)
+        if timer == "native":
+            # Native timer: the batch runs in a thread of this process, which enters the client namespace of the pair
+            # Note: A handshake which takes longer than MAX_HS_DUR seconds fails, the batch itself does not time out
+            try:
+                context = await asyncio.to_thread(get_context, OSSL_CONFIG, pki_path, group, ciphersuite)
+                records, batch_usage = await asyncio.to_thread(measure_batch, context, pair.client_ns, (pair.server_ip, TLS_PORT), run_rounds, MAX_HS_DUR, pair.client_cpus)
+            except (NativeTimerError, OSError) as e:
+                print('\033[1;31mERROR:\t\tNative timer failed for "{}" ({}). Aborting.\033[0m'.format(alg, e), file=sys.stderr)
+                await tls_server.stop()
+                sys.exit(-1)
+        else:
+            # Run s_timer process in the client namespace of the pair (pinned to the client cores of the pair)
+            # Note: The supervisor reads the output while s_timer runs and stops it at the deadline
+            tls_client = await supervisor.run(pair.client_command([STIMER_BINARY, '-h', pair.server_address(), '-r', str(run_rounds), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert, '--config='+OSSL_CONFIG, '--records='+records_file_name, '--groups='+group, '--ciphersuites='+ciphersuite, '--mode='+mode, '--rusage'] + (['--phases'] if phases else [])), timeout, "s_timer " + pair.client_ns)
+        
+            if tls_client.timed_out:
+                # The rounds finished before the deadline are kept, s_timer wrote their records already
+                try:
+                    records = load_round_records(records_file_name)
+                except (RecordsError, OSError):
+                    records = []
+                if len(records) > 0:
+                    result_rows = records_to_rows(alg, output_iterator, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, records)
+                    output_iterator = output_iterator + len(result_rows)
+                    handshakes = handshakes + int((records["status"] == 1).sum())
+                    await asyncio.to_thread(journal.commit_batch, test, output_iterator - 1, results_sink, result_rows)
+                    if adaptive:
+                        durations.extend(records["duration_ms"][records["status"] == 1].tolist())
             
-            # End all processes
-            tls_server.terminate()
-            tls_client.terminate()
+                print(f'\033[1;31mERROR:\t\tTimeout reached for {alg} with rate of {rate}, {delay}ms delay and {loss}% packet loss after {len(records)} of {run_rounds} rounds. Repeating the remaining rounds.\033[0m', file=sys.stderr)
             
-            # Adding up the failed rounds and start again
-            open_rounds = open_rounds + run_rounds
+                # The client was ended by the supervisor, restart the (possibly hanging) server
+                if record_traffic:
+                    traffic_capture.mark({"marker": "batch-timeout", "first_round": output_iterator - len(records), "completed": len(records)})
+                if not await tls_server.restart():
+                    print('\033[1;31mERROR:\t\tFailure during restart of TLS server. Aborting.\033[0m', file=sys.stderr)
+                    print(tls_server.error_output(), file=sys.stderr)
+                    await tls_server.stop()
+                    sys.exit(-1)
             
-            continue
-    
-    
-        # Save output line by line in array
-        s_time_output = bytes.decode(tls_client.stdout.read(), 'utf-8').splitlines()
+                # Adding up the unfinished rounds and start again
+                open_rounds = open_rounds + run_rounds - len(records)
             
-        # Check that OpenSSL 3.2.0 was used (no older version)
-        # Note: s_timer outputs the OpenSSL version in the first output line
+                continue
+            
+            # Check the s_timer output (OpenSSL version and provider), then read the round records
+            s_time_output = await check_stimer_output(tls_client, tls_server)
+            records = await read_records(records_file_name, tls_server)
+            batch_usage = parse_rusage(s_time_output[2:])
         
-        if s_time_output[0].find('OpenSSL 3.2.0 ') < 0:
-            # Correct version string not found, abort
-            print('\033[1;31mERROR:\t\tWrong OpenSSL version in s_timer. Aborting.\033[0m', file=sys.stderr)
-            sys.exit(-1)
-        else:
-            # Check if provider could be loaded successfully
-            # Note: s_timer output if provider load was successful on the second line
-            if s_time_output[1].find('provider loaded successfully') < 0:
-                # Provider not found
-                print('\033[1;31mERROR:\t\tOQS-Provider in s_timer not loaded. Aborting.\033[0m', file=sys.stderr)
-                sys.exit(-1)
-            else:
-                # Provider loaded successfully, print results
-                for result in s_time_output[2].split(","):
-                    # s_timer outputs results as pairs of measurement:success (float:bool)
-                    # Note: If connection was unsuccessful (success=false), a dummy value of 0.0ms is returned as measurement
-                    measurement, success = result.split(":")
-                    results_file = open(results_file_name, "a")
-                    results_file.write(alg+","+str(output_iterator)+","+str(rate)+","+str(delay)+","+str(loss)+","+success+","+measurement+"\n")
-                    results_file.close()
-                    output_iterator = output_iterator + 1
-                
-                print('\033[1;32mSUCCESS:\tOpen Rounds: {}. Results for {} with {}mbit rate limit, {}ms delay and {}% packet loss written to file.\n\033[0m'.format(open_rounds, alg, rate, delay, loss), file=sys.stdout)
+        if record_traffic:
+            traffic_capture.mark({"marker": "batch-end", "first_round": output_iterator})
+        
+        result_rows = records_to_rows(alg, output_iterator, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, records)
+        output_iterator = output_iterator + len(result_rows)
+        handshakes = handshakes + int((records["status"] == 1).sum())
+        if batch_usage is not None:
+            client_usage.add(batch_usage)
+        # Write the rows and commit the batch to the journal
+        # Note: Committing waits for the results files to be flushed, therefore it runs outside of the event loop
+        await asyncio.to_thread(journal.commit_batch, test, output_iterator - 1, results_sink, result_rows)
         
-        # Terminate TLS server process
-        tls_server.terminate()
+        print('\033[1;32mSUCCESS:\tOpen Rounds: {}. Results for {} with {}mbit rate limit, {}ms delay and {}% packet loss written to file.\n\033[0m'.format(open_rounds, alg, rate, delay, loss), file=sys.stdout)
+        
+        # In adaptive mode, stop the test as soon as the confidence intervals are narrow enough
+        if adaptive:
+            durations.extend(records["duration_ms"][records["status"] == 1].tolist())
+            converged, widths = has_converged(durations, ci_width)
+            if converged and output_iterator - 1 >= min_rounds:
+                print('\033[1;34mINFO:\t\tConverged after {} rounds for {} with {}mbit rate limit, {}ms delay and {}% packet loss (relative CI widths of median and p95: {:.3f}, {:.3f}).\033[0m'.format(output_iterator - 1, alg, rate, delay, loss, widths[0], widths[1]), file=sys.stdout)
+                open_rounds = 0
     
         # End of while loop
     
+    # Terminate TLS server process
+    await tls_server.stop()
+    
+    if os.path.exists(records_file_name):
+        os.remove(records_file_name)
     
+    # Mark the cell as finished in the journal, the usage row is committed with it (a resumed cell gets the usage of its
+    # remaining rounds)
+    usage_row = test + (handshakes,) + tls_server.usage().values(handshakes) + client_usage.values(handshakes)
+    await asyncio.to_thread(journal.finish_cell, test, output_iterator - 1, usage_sink, usage_row)
+    
+    
+    # Stop the traffic capture, the pcapng file gets the session secrets of the test
     if record_traffic:
-        time.sleep(2)
-        wireshark_server.terminate()
-        wireshark_client.terminate()
+        await asyncio.to_thread(traffic_capture.stop, session_secrets_file_name)
     
     return
 
-def pki_setup(alg, algname, out_dir):
-    
-    # Prepare parent directory for algorithm specific PKI
-    pki_path = os.path.join(out_dir, "pki-{}".format(algname))
-    create_dir(pki_path)
-    ca_config = pki_path+"/oqs-openssl-ca.cnf"
-    ica_config = pki_path+"/oqs-openssl-ica.cnf"             
-    
-    # Create sub-directory for CA, prepare file paths, create and init serial-number file
-    ca_path = os.path.join(pki_path, "ca")
-    create_dir(ca_path)
-    ca_cert = ca_path+"/ca.crt"
-    ca_key = ca_path+"/ca.key"
-    serial_file = open(ca_path+"/serial", "a")
-    serial_file.write("1000")
-    serial_file.close()
-    index_file = open(ca_path+"/index.txt", "a")
-    index_file.close()
-    # Copy CA config, but set real CA path
-    with open(OSSL_RCA_CONFIG, "rt") as template_config:
-        with open(ca_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', ca_path))
-    
-    # Create sub-directory for ICA, prepare file paths, create and init serial-number file
-    ica_path = os.path.join(pki_path, "ica")
-    create_dir(ica_path)
-    ica_cert = ica_path+"/ica.crt"
-    ica_csr = ica_path+"/ica.csr"
-    ica_key = ica_path+"/ica.key"
-    file = open(ica_path+"/serial", "a")
-    file.write("1000")
-    file.close()
-    index_file = open(ica_path+"/index.txt", "a")
-    index_file.close()
-    # Copy ICA config, but set real ICA path
-    with open(OSSL_ICA_CONFIG, "rt") as template_config:
-        with open(ica_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', ica_path))
-    
-    
-    # Create sub-directory for server certificate, prepare file paths
-    server_path = os.path.join(pki_path, "server")
-    create_dir(server_path)
-    server_cert = server_path+"/server.crt"
-    server_csr = server_path+"/server.csr"
-    server_key = server_path+"/server.key"
-    
-    # Create sub-directory for client certificate, prepare file paths
-    client_path = os.path.join(pki_path, "client")
-    create_dir(client_path)
-    client_cert = client_path+"/client.crt"
-    client_csr = client_path+"/client.csr"
-    client_key = client_path+"/client.key"
-    
-    ####################################################################
-    # Create CA key and certificate
-    # Note: if/else is needed, because ECDSA needs additional arguments than EdDSA, RSA and PQC
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Root CA"
-        ec_param = 'ec_paramgen_curve:'+alg[5:]
-        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', 'ec', '-pkeyopt', ec_param, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output = True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Root CA"
-        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', alg, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output=True, text = True)
+async def run_load_test(pair, alg, pki_path, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, concurrency, arrival_rate):
+    # Prepare file paths
+    ca_cert = pki_path+"/ca/ca.crt"
+    ica_cert = pki_path+"/ica/ica.crt"
+    server_cert = pki_path+"/server/server.crt"
+    server_key = pki_path+"/server/server.key"
+    client_cert = pki_path+"/client/client.crt"
+    client_key = pki_path+"/client/client.key"
     
+    records_file_name = os.path.join(records_dir, "pair{}.bin".format(pair.index))
+    test = (alg, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode, concurrency, arrival_rate)
     
-    if ca_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(ca_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during CA setup. Aborting.\033[0m', file=sys.stderr)
+    tls_server = TLSServerManager(pair, ['-cert', server_cert, '-key', server_key, '-tls1_3', '-verify', '2', '-verify_return_error', '-CAfile', ca_cert, '-chainCAfile', ica_cert, '-ignore_unexpected_eof', '-groups', group, '-ciphersuites', ciphersuite, '-quiet'] + (['-early_data'] if mode == "early-data" else []), supervisor)
+    if not await tls_server.start():
+        print('\033[1;31mERROR:\t\tFailure during start of TLS server. Aborting.\033[0m', file=sys.stderr)
+        print(tls_server.error_output(), file=sys.stderr)
+        await tls_server.stop()
         sys.exit(-1)
     
+    # s_timer runs the handshakes from "concurrency" worker threads for load_duration seconds, in an open loop if an arrival rate is set
+    # Note: The handshakes still running at the end are given MAX_HS_DUR seconds to finish
+    tls_client = await supervisor.run(pair.client_command([STIMER_BINARY, '-h', pair.server_address(), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert, '--config='+OSSL_CONFIG, '--records='+records_file_name, '--concurrency='+str(concurrency), '--arrival-rate='+str(arrival_rate), '--duration='+str(load_duration), '--groups='+group, '--ciphersuites='+ciphersuite, '--mode='+mode, '--rusage'] + (['--phases'] if phases else [])), load_duration + MAX_HS_DUR, "s_timer " + pair.client_ns)
     
-    ####################################################################
-    # Create Intermediate-CA key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Intermediate CA"
-        ica_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', ica_key,], capture_output=True, text = True)
+    if tls_client.timed_out:
+        # The finished handshakes are kept, but s_timer was stopped before it printed the summary
+        print(f'\033[1;31mERROR:\t\tTimeout reached for {alg} ({mode} handshakes) with concurrency {concurrency} and arrival rate {arrival_rate}/s. The load test has no summary.\033[0m', file=sys.stderr)
+        try:
+            records = load_round_records(records_file_name)
+        except (RecordsError, OSError):
+            records = []
+        summary = None
+        client_usage = ProcessUsage()
     else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Intermediate CA"
-        ica_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', ica_key, '-config', ica_config], capture_output=True, text = True)
+        s_time_output = await check_stimer_output(tls_client, tls_server)
+        try:
+            summary, histogram = parse_load_output(s_time_output[2:])
+        except (RecordsError, ValueError, KeyError) as e:
+            print('\033[1;31mERROR:\t\tLoad summary of s_timer could not be read ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+            await tls_server.stop()
+            sys.exit(-1)
+        records = await read_records(records_file_name, tls_server)
+        client_usage = parse_rusage(s_time_output[2:]) or ProcessUsage()
     
-    ica_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', ica_key, '-out', ica_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    ica_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'v3_intermediate_ca', '-md', 'sha256', '-batch', '-in', ica_csr, '-out', ica_cert, '-days', '3650', '-config', ca_config], capture_output=True, text = True)
+    await tls_server.stop()
+    handshakes = int((records["status"] == 1).sum()) if len(records) > 0 else 0
     
+    # The summary and histogram are written before the handshakes are committed, which finishes the test
+    if summary is not None:
+        load_sink.write(test + summary)
+        histogram_sink.write_many([test + bucket for bucket in histogram if bucket[1] > 0])
+        print('\033[1;32mSUCCESS:\t{} ({} handshakes) with {}mbit rate limit, {}ms delay and {}% packet loss, concurrency {} and arrival rate {}/s: {:.1f} handshakes/s, p99 latency {:.2f}ms.\n\033[0m'.format(alg, mode, rate, delay, loss, concurrency, arrival_rate, summary[4], summary[7]), file=sys.stdout)
     
-    if ica_key_process.returncode != 0 or ica_csr_process.returncode != 0 or ica_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(ica_key_process.stderr)
-        print(ica_csr_process.stderr)
-        print(ica_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during ICA setup. Aborting.\033[0m', file=sys.stderr)
-        sys.exit(-1)
-        
+    # The usage row is committed with the handshakes, which already finishes a load test on -resume
+    usage_row = test + (handshakes,) + tls_server.usage().values(handshakes) + client_usage.values(handshakes)
+    result_rows = records_to_rows(alg, 1, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, records, (concurrency, arrival_rate)) if len(records) > 0 else []
+    await asyncio.to_thread(journal.commit_batch, test, len(result_rows), results_sink, result_rows, usage_sink, usage_row)
+    journal.finish_cell(test, len(result_rows))
     
-    ####################################################################
-    # Create Server key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Server Certificate"
-        server_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', server_key,], capture_output=True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Server Certificate"
-        server_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', server_key, '-config', ica_config], capture_output=True, text = True)
+    if os.path.exists(records_file_name):
+        os.remove(records_file_name)
     
-    server_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', server_key, '-out', server_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    server_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', server_csr, '-out', server_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
-    
-    
-    if server_key_process.returncode != 0 or server_csr_process.returncode != 0 or server_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(server_key_process.stderr)
-        print(server_csr_process.stderr)
-        print(server_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during server certificate setup. Aborting.\033[0m', file=sys.stderr)
+    return
+
+async def check_stimer_output(tls_client, tls_server):
+    # Save output line by line in array
+    s_time_output = bytes.decode(tls_client.stdout, 'utf-8').splitlines()
+    
+    # s_timer prints version and provider state on two lines (the results are in the records file), anything else means it failed
+    if len(s_time_output) < 2:
+        print('\033[1;31mERROR:\t\ts_timer exited with code {} without results. Aborting.\033[0m'.format(tls_client.returncode), file=sys.stderr)
+        print(bytes.decode(tls_client.stderr, 'utf-8', 'replace'), file=sys.stderr)
+        await tls_server.stop()
+        sys.exit(-1)
+        
+    # Check that OpenSSL 3.2.0 was used (no older version)
+    # Note: s_timer outputs the OpenSSL version in the first output line
+    if s_time_output[0].find('OpenSSL 3.2.0 ') < 0:
+        # Correct version string not found, abort
+        print('\033[1;31mERROR:\t\tWrong OpenSSL version in s_timer. Aborting.\033[0m', file=sys.stderr)
+        await tls_server.stop()
         sys.exit(-1)
     
-    
-    ####################################################################
-    # Create Client key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Client Certificate"
-        client_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', client_key,], capture_output=True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Client Certificate"
-        client_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', client_key, '-config', ica_config], capture_output=True, text = True)
-    
-    client_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', client_key, '-out', client_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    client_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', client_csr, '-out', client_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
-    
-    
-    if client_key_process.returncode != 0 or client_csr_process.returncode != 0 or client_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(client_key_process.stderr)
-        print(client_csr_process.stderr)
-        print(client_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during server certificate setup. Aborting.\033[0m', file=sys.stderr)
+    # Check if provider could be loaded successfully
+    # Note: s_timer output if provider load was successful on the second line
+    if s_time_output[1].find('provider loaded successfully') < 0:
+        # Provider not found
+        print('\033[1;31mERROR:\t\tOQS-Provider in s_timer not loaded. Aborting.\033[0m', file=sys.stderr)
+        await tls_server.stop()
         sys.exit(-1)
     
-    return
+    return s_time_output
 
-def namespaces_setup(retry):
+async def read_records(records_file_name, tls_server):
+    try:
+        records = load_round_records(records_file_name)
+    except (RecordsError, OSError) as e:
+        print('\033[1;31mERROR:\t\tRecords of s_timer could not be read ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+        await tls_server.stop()
+        sys.exit(-1)
+    return records
+
+def records_to_rows(alg, first_round, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, records, load=None):
+    # Result rows of the round records of one s_timer run
+    # Note: If a connection was unsuccessful (status 0), s_timer records a dummy value of 0.0ms as duration
+    rows = [(alg, first_round + i, rate, delay, loss, status == 1, duration, initcwnd, initrwnd, congestion_control, group, ciphersuite) for i, (status, duration) in enumerate(zip(records["status"].tolist(), records["duration_ms"].tolist()))]
+    # If not only full handshakes are tested, the mode of each round and whether the session was resumed (and the early data accepted) follow
+    if mode_columns:
+        rows = [row + values for row, values in zip(rows, mode_values(records))]
+    # In load mode, the concurrency, arrival rate and latency of each handshake follow
+    if load is not None:
+        rows = [row + load + (latency,) for row, latency in zip(rows, latencies(records).tolist())]
+    # With -phases, the phase columns (ms after the start of the round) follow
+    if phases:
+        rows = [row + tuple(offsets) for row, offsets in zip(rows, phase_offsets(records).tolist())]
+    return rows
+
+def load_cell_durations(alg, rate, delay, loss, initcwnd, initrwnd, congestion_control, group, ciphersuite, mode):
+    # Durations of the successful rounds of a cell already written before the sweep was resumed
+    durations = []
+    for row in iter_records(results_file_name+".rec"):
+        if row[0] == alg and row[2] == float(rate) and row[3] == float(delay) and row[4] == float(loss) and row[7] == initcwnd and row[8] == initrwnd and row[9] == congestion_control and row[10] == group and row[11] == ciphersuite and (not mode_columns or row[12] == mode) and row[5]:
+            durations.append(row[6])
+    return durations
+
+def namespaces_setup(pairs, retry):
     
-    print('\033[1;34mINFO:\t\tSetting up namespaces.\033[0m', file=sys.stdout)
+    print('\033[1;34mINFO:\t\tSetting up {} namespace pair(s).\033[0m'.format(pairs), file=sys.stdout)
     
-    ns_process = subprocess.run(["bash", NSPACE_SETUP], capture_output=True)
+    ns_process = subprocess.run(["bash", NSPACE_SETUP, str(pairs)], capture_output=True)
     
     if ns_process.returncode != 0 and retry == False:
         print('\033[1;33mWARNING:\tError during namespace setup. Will do cleanup and retry again.\033[0m', file=sys.stdout)
-        namespaces_cleanup()
-        namespaces_setup(True)
+        namespaces_cleanup(pairs)
+        namespaces_setup(pairs, True)
     elif ns_process.returncode != 0 and retry == True:
         print('\033[1;31mERROR:\t\tFailure during namespace setup. Cleanup did not help. Aborting.\033[0m', file=sys.stderr)
         sys.exit(-1)
     
     return
 
-def namespaces_cleanup():
+def namespaces_cleanup(pairs):
     
-    print('\033[1;34mINFO:\t\tCleaning up namespaces.\033[0m', file=sys.stdout)
+    print('\033[1;34mINFO:\t\tCleaning up {} namespace pair(s).\033[0m'.format(pairs), file=sys.stdout)
     
-    ns_process = subprocess.run(["bash", NSPACE_CLEANUP], capture_output=True)
+    ns_process = subprocess.run(["bash", NSPACE_CLEANUP, str(pairs)], capture_output=True)
 
     if ns_process.returncode != 0:
         print('\033[1;31mERROR:\t\tFailure during namespace cleanup. Aborting.\033[0m', file=sys.stderr)
@@ -376,7 +535,7 @@ def namespaces_cleanup():
     
     return
 
-def read_pq_sigalgs(sig_file):
+def read_pq_sigalgs(sig_file, spec_algs):
     
     algs_from_file=[]
     algs_supported=[]
@@ -389,6 +548,16 @@ def read_pq_sigalgs(sig_file):
         if l.endswith(" @ oqsprovider"):
             algs_supported.append(l[2:-14]) 
     
+    # The algorithms of the spec are checked like the ones of the file
+    for algname in spec_algs:
+        if algname in algs_supported:
+            algs_from_file.append(algname)
+        else:
+            print('\033[1;33mWARNING:\tAlgorithm "{}" not supported, removed from list.\033[0m'.format(algname), file=sys.stderr)
+    
+    if sig_file is None:
+        return algs_from_file
+    
     # Get the signature algorithms from the file and check if they are supported, otherwise exclude from list
     with open(sig_file, 'r', encoding='UTF-8') as file:
         while line := file.readline():
@@ -407,6 +576,13 @@ def read_pq_sigalgs(sig_file):
     file.close()
     return algs_from_file
 
+def check_timer(timer, modes, phases, concurrency_values):
+    # The native timer enters the namespaces itself and only measures full handshakes without phases
+    if timer == "native" and (os.geteuid() != 0 or modes != ["full"] or phases or concurrency_values):
+        print('\033[1;31mERROR:\t\tThe native timer needs root privileges and only supports latency tests of full handshakes without -phases.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    return
+
 def create_dir(path):
     if not os.path.exists(path):
         os.mkdir(path)
@@ -448,88 +624,268 @@ if __name__ == '__main__':
         prog='Post-Quantum TLS Handshake Benchmarker',
         description='Benchmarking Post-Quantum TLS Handshake performance using different signature algorithms with OpenSSL s_time.')
     parser.add_argument('-rounds', help='the number of times the test should be performed for, default is 10', metavar='INT', type=int, default='10', required=False)
-    parser.add_argument('-sigs', help='path to file with list of PQ signature algorithms to be included in the tests', metavar='<file path>', required=True)
-    parser.add_argument('-out', help='path to directory where the results should be saved to', metavar='<dir path>', required=True)
+    parser.add_argument('-sigs', help='path to file with list of PQ signature algorithms to be included in the tests, required if the spec does not list the algorithms', metavar='<file path>', required=False)
+    parser.add_argument('-out', help='path to directory where the results should be saved to, required unless -plan is set', metavar='<dir path>', required=False)
     parser.add_argument('-rec', help='if set, the TLS traffic is dumped to a file and the session secrets are exported', action='store_true', required=False)
+    parser.add_argument('-pairs', help='the number of namespace pairs the tests are run on concurrently, default is 1', metavar='INT', type=int, default='1', required=False)
+    parser.add_argument('-resume', '--resume', help='if set, an interrupted sweep in the output directory is resumed using its journal', action='store_true', required=False)
+    parser.add_argument('-adaptive', help='if set, each test runs until the confidence intervals of median and p95 handshake duration are narrower than -ci-width (-rounds is ignored)', action='store_true', required=False)
+    parser.add_argument('-min-rounds', help='the minimum number of rounds per test in adaptive mode, default is 100', metavar='INT', type=int, default='100', required=False)
+    parser.add_argument('-max-rounds', help='the maximum number of rounds per test in adaptive mode, default is 10000', metavar='INT', type=int, default='10000', required=False)
+    parser.add_argument('-ci-width', help='the target width of the 95%% confidence intervals relative to the estimate in adaptive mode, default is 0.1', metavar='FLOAT', type=float, default='0.1', required=False)
+    parser.add_argument('-pki-cache', help='path to the directory where generated PKIs are cached, default is $PQTLS_PKI_CACHE or ~/.cache/pqtls-pki', metavar='<dir path>', default=default_cache_dir(), required=False)
+    parser.add_argument('-pki-backend', help='how missing PKIs are set up: "cli" (openssl commands) or "libcrypto" (in-process), default is cli', choices=list(PKI_BACKENDS), default='cli', required=False)
+    parser.add_argument('-phases', help='if set, the timestamps of the handshake phases (TCP connect, ServerHello, certificates, Finished) are added to the results', action='store_true', required=False)
+    parser.add_argument('-mode', help='the handshake modes to be tested: "full" (certificates in every handshake), "resume" (session ticket of the previous handshake) and "early-data" (resumption with 0-RTT data), default is full', choices=MODES, nargs='+', default=['full'], required=False)
+    parser.add_argument('-concurrency', help='if set, each test is a load test with this number of concurrent connections instead of a latency test (-rounds and -adaptive are ignored), multiple values are tested one after the other', metavar='INT', type=int, nargs='+', required=False)
+    parser.add_argument('-arrival-rate', help='the handshake arrival rates per second of the load tests (open loop), 0 starts a new handshake as soon as a connection is free (closed loop), default is 0', metavar='FLOAT', type=float, nargs='+', default=[0.0], required=False)
+    parser.add_argument('-load-duration', help='the duration in seconds of each load test, default is 10', metavar='INT', type=int, default='10', required=False)
+    parser.add_argument('-spec', help='path to a TOML experiment spec (dimensions, rounds, load tests, cell order and output formats), its values take precedence over the command line', metavar='<file path>', required=False)
+    parser.add_argument('-plan', help='if set, the cell plan is printed with its estimated wall time and no test is run', action='store_true', required=False)
+    parser.add_argument('-timer', help='how the handshakes are timed: "stimer" (s_timer process per batch) or "native" (in-process through libssl, full handshakes only, needs root), default is stimer', choices=TIMERS, default='stimer', required=False)
+    parser.add_argument('-shard', help='if set, only shard I of N of the cell plan is run (every N-th cell from the I-th on), each shard needs its own output directory', metavar='I/N', type=parse_shard, required=False)
     
     args = parser.parse_args()
     
-    rounds = args.rounds
-    sig_file = args.sigs
+    # The command line and the defaults of this script make up the experiment, a spec file overrides them
+    spec = ExperimentSpec({"traditional_algorithms": TRADITIONAL_SIG_ALGS, "algorithms": [], "sigs": args.sigs, "rate": RATE_VALUES, "delay": DELAY_VALUES, "loss": LOSS_VALUES,
+                           "initcwnd": INITCWND_VALUES, "initrwnd": INITRWND_VALUES,
+                           "congestion_control": CONGESTION_CONTROL_VALUES, "groups": GROUP_VALUES, "ciphersuites": CIPHERSUITE_VALUES, "modes": args.mode, "rounds": args.rounds, "sample_size": SAMPLE_SIZE, "max_handshake_duration": MAX_HS_DUR,
+                           "adaptive": args.adaptive, "min_rounds": args.min_rounds, "max_rounds": args.max_rounds, "ci_width": args.ci_width, "concurrency": args.concurrency,
+                           "arrival_rate": args.arrival_rate, "load_duration": args.load_duration, "strategy": "sequential", "seed": 0, "formats": ["rec", "csv"], "phases": args.phases,
+                           "handshake_ms": DEFAULT_HANDSHAKE_MS})
+    if args.spec is not None:
+        try:
+            spec = load_spec(args.spec, spec.values)
+        except SpecError as e:
+            print('\033[1;31mERROR:\t\tExperiment spec "{}" is invalid: {}. Aborting.\033[0m'.format(args.spec, e), file=sys.stderr)
+            sys.exit(-1)
+    
+    SAMPLE_SIZE = spec.sample_size
+    MAX_HS_DUR = spec.max_handshake_duration
+    RATE_VALUES = spec.rate
+    DELAY_VALUES = spec.delay
+    LOSS_VALUES = spec.loss
+    INITCWND_VALUES = spec.initcwnd
+    INITRWND_VALUES = spec.initrwnd
+    CONGESTION_CONTROL_VALUES = spec.congestion_control
+    GROUP_VALUES = spec.groups
+    CIPHERSUITE_VALUES = spec.ciphersuites
+    
+    rounds = spec.rounds
+    sig_file = spec.sigs
     out_dir = args.out
     record_traffic = args.rec
+    pairs = args.pairs
+    resume = args.resume
+    adaptive = spec.adaptive
+    min_rounds = spec.min_rounds
+    max_rounds = spec.max_rounds
+    ci_width = spec.ci_width
+    pki_cache = args.pki_cache
+    pki_backend = args.pki_backend
+    phases = spec.phases
+    modes = spec.modes
+    concurrency_values = spec.concurrency
+    arrival_rate_values = spec.arrival_rate
+    load_duration = spec.load_duration
+    formats = tuple(spec.formats)
+    timer = args.timer
+    
+    # Check if the number of namespace pairs is supported by the namespace setup
+    if pairs < 1 or pairs > MAX_PAIRS:
+        print('\033[1;31mERROR:\t\tNumber of namespace pairs must be between 1 and {}.\033[0m'.format(MAX_PAIRS), file=sys.stderr)
+        sys.exit(-1)
     
     # Make sure that the PQ signature algorithm file exists
-    if not os.path.isfile(sig_file):
+    if sig_file is not None and not os.path.isfile(sig_file):
         print('\033[1;31mERROR:\t\tFile "{}" does not exist. Please provide a file with the post-quantum signature algorithms to be included in the tests.\033[0m'.format(sig_file), file=sys.stderr)
         sys.exit(-1)
     
+    if concurrency_values is not None and (min(concurrency_values) < 1 or min(arrival_rate_values) < 0 or load_duration < 1):
+        print('\033[1;31mERROR:\t\tConcurrency and load duration must be at least 1, arrival rates must not be negative.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    # A resumed adaptive test reads the durations of its committed rounds from the record file
+    if adaptive and "rec" not in formats:
+        print('\033[1;31mERROR:\t\tAdaptive sweeps need the "rec" output format.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    # Group and cipher suite lists are stored in fixed-size text columns of the results files
+    if max(len(value.encode("utf-8")) for value in GROUP_VALUES + CIPHERSUITE_VALUES) > TEXT_LENGTH:
+        print('\033[1;31mERROR:\t\tKey exchange groups and cipher suites must not be longer than {} bytes.\033[0m'.format(TEXT_LENGTH), file=sys.stderr)
+        sys.exit(-1)
+    
+    # Checked before any files, PKIs or namespaces are set up
+    check_timer(timer, modes, phases, concurrency_values)
+    
+    # Read the post-quantum signature algorithms from file and spec and check if activated in oqs-provider
+    pq_sig_algs = read_pq_sigalgs(sig_file, spec.algorithms)
+    
+    # Add the reference algorithms (traditional crypto, provided in global variable or spec) to the list
+    sig_algs = spec.traditional_algorithms + pq_sig_algs
+    if not sig_algs:
+        print('\033[1;31mERROR:\t\tNo signature algorithms to test. Please provide them with -sigs or in the spec.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    # Expand the cell plan, one cell per combination of the dimension values in the order of the spec
+    dimensions = [sig_algs, RATE_VALUES, DELAY_VALUES, LOSS_VALUES, INITCWND_VALUES, INITRWND_VALUES, CONGESTION_CONTROL_VALUES, GROUP_VALUES, CIPHERSUITE_VALUES, modes] + ([concurrency_values, arrival_rate_values] if concurrency_values else [])
+    plan = expand_plan(dimensions, spec.strategy, spec.seed)
+    if args.shard is not None:
+        plan = select_shard(plan, args.shard)
+    
+    # Report the plan with its estimated duration (the RTT is twice the delay) and stop
+    if args.plan:
+        cell_seconds = [estimate_cell_seconds(spec, 2 * cell[2], cell[3], bool(concurrency_values)) for cell in plan]
+        print_plan([column[2] for column in (LOAD_TEST_COLUMNS if concurrency_values else TEST_COLUMNS)], plan, cell_seconds, pairs)
+        sys.exit(0)
+    
     # Check if output directory exists
-    if not os.path.isdir(out_dir):
+    if out_dir is None or not os.path.isdir(out_dir):
         print('\033[1;31mERROR:\t\tDirectory "{}" does not exist. Please provide a directory to store the resulting files in.\033[0m'.format(out_dir), file=sys.stderr) 
         sys.exit(-1)
     
-    # Prepare file for benchmark results
-    results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".csv"
-    results_file = open(results_file_name, "a")
-    results_file.write("Signature Algorithm,Test Round,Rate Limit,Delay,Packet Loss,Success,Handshake Duration [ms]"+"\n")
-    results_file.close()
+    # The journal records each committed batch and finished cell of the sweep
+    journal = SweepJournal(out_dir)
+    parameters = {"rounds": rounds, "adaptive": adaptive, "min_rounds": min_rounds, "max_rounds": max_rounds, "ci_width": ci_width, "phases": phases, "modes": modes, "concurrency": concurrency_values, "arrival_rate": arrival_rate_values, "load_duration": load_duration, "formats": list(formats)}
+    
+    if resume:
+        if not journal.exists():
+            print('\033[1;31mERROR:\t\tNo journal found in "{}". Nothing to resume.\033[0m'.format(out_dir), file=sys.stderr)
+            sys.exit(-1)
+        
+        # Continue with the results files of the interrupted sweep, rows of uncommitted batches are dropped
+        journal.load()
+        results_file_name = journal.results_file_name
+        if journal.parameters != parameters:
+            print('\033[1;33mWARNING:\tResumed sweep was started with different round settings, continuing with the original ones.\033[0m', file=sys.stderr)
+            rounds = journal.parameters["rounds"]
+            adaptive = journal.parameters["adaptive"]
+            min_rounds = journal.parameters["min_rounds"]
+            max_rounds = journal.parameters["max_rounds"]
+            ci_width = journal.parameters["ci_width"]
+            phases = journal.parameters.get("phases", False)
+            modes = journal.parameters.get("modes", ["full"])
+            concurrency_values = journal.parameters.get("concurrency")
+            arrival_rate_values = journal.parameters.get("arrival_rate", [0.0])
+            load_duration = journal.parameters.get("load_duration", 10)
+            formats = tuple(journal.parameters.get("formats", ["rec", "csv"]))
+            check_timer(timer, modes, phases, concurrency_values)
+        journal.truncate_results()
+        mode_columns = modes != ["full"]
+        print('\033[1;34mINFO:\t\tResuming sweep of "{}", {} test(s) already finished.\033[0m'.format(results_file_name, len(journal.cells_done)), file=sys.stdout)
+        results_sink = ResultsSink(results_file_name, RESULTS_COLUMNS + TCP_COLUMNS + KEX_COLUMNS + (MODE_COLUMNS if mode_columns else []) + (LOAD_COLUMNS if concurrency_values else []) + (PHASE_COLUMNS if phases else []), formats)
+        atexit.register(results_sink.close)
+    else:
+        if journal.exists():
+            if ask_for_overwrite(journal.path) != "yes":
+                print('\033[1;31mERROR:\t\tJournal of a previous sweep exists in "{}". Use -resume to continue it. Aborting.\033[0m'.format(out_dir), file=sys.stderr)
+                sys.exit(-1)
+            os.remove(journal.path)
+        
+        # Prepare files for benchmark results (binary records and CSV export)
+        # Note: The sink is also closed (and thereby flushed) if the run is aborted
+        mode_columns = modes != ["full"]
+        results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        results_sink = ResultsSink(results_file_name, RESULTS_COLUMNS + TCP_COLUMNS + KEX_COLUMNS + (MODE_COLUMNS if mode_columns else []) + (LOAD_COLUMNS if concurrency_values else []) + (PHASE_COLUMNS if phases else []), formats)
+        atexit.register(results_sink.close)
+    
+    # CPU time, context switches and peak RSS of s_server and s_timer are written per test
+    # Note: The usage rows are committed in the journal together with the tests they belong to
+    usage_sink = ResultsSink(results_file_name+"_usage", (LOAD_TEST_COLUMNS if concurrency_values else TEST_COLUMNS) + USAGE_COLUMNS, formats)
+    atexit.register(usage_sink.close)
+    if not resume:
+        journal.start_run(results_file_name, parameters, results_sink, usage_sink)
+    
+    # Load tests write a summary (throughput and latency percentiles) and the latency histogram per test
+    # Note: The handshakes of the load tests are in the results files
+    if concurrency_values:
+        load_sink = ResultsSink(results_file_name+"_load", LOAD_TEST_COLUMNS + LOAD_SUMMARY_COLUMNS, formats)
+        atexit.register(load_sink.close)
+        histogram_sink = ResultsSink(results_file_name+"_histogram", LOAD_TEST_COLUMNS + HISTOGRAM_COLUMNS, formats)
+        atexit.register(histogram_sink.close)
+        if record_traffic:
+            print('\033[1;33mWARNING:\tThe traffic of load tests is not recorded.\033[0m', file=sys.stderr)
+            record_traffic = False
     
     # If traffic is to be recorded, prepare folder
     if record_traffic:
         # Prepare folder for wireshark dump files
         wireshark_folder_path = os.path.join(out_dir, "traffic-recordings")
-        create_dir(wireshark_folder_path)
+        if not (resume and os.path.isdir(wireshark_folder_path)):
+            create_dir(wireshark_folder_path)
         
-    # Read the post-quantum signature algorithms from file and check if activated in oqs-provider
-    pq_sig_algs = read_pq_sigalgs(sig_file)
-    
-    # Add the reference algorithms (traditional crypto, provided in global variable) to the list
-    sig_algs = TRADITIONAL_SIG_ALGS + pq_sig_algs
+    # For RSA, replace ":" with "" for the alg name used in the file paths
+    algnames = {alg: alg.replace(":", "") if alg.startswith("RSA") else alg for alg in sig_algs}
+    
+    # Get the PKI (CA, ICA and EE certificates) of all signature algorithms before the measurements start
+    # Note: Only PKIs which are not cached yet are set up (in parallel). Cached PKIs are read-only and shared by all runs,
+    #       a resumed sweep therefore uses the same PKIs.
+    pki_paths, pki_errors = build_pkis([(alg, algnames[alg]) for alg in sig_algs], OSSL_RCA_CONFIG, OSSL_ICA_CONFIG, pki_cache, pki_backend)
+    print_pki_errors(pki_errors)
+    sig_algs = [alg for alg in sig_algs if alg in pki_paths]
+    if not sig_algs:
+        print('\033[1;31mERROR:\t\tNo PKI could be set up. Aborting.\033[0m', file=sys.stderr)
+        sys.exit(-1)
     
     # Setup of namespaces and virtual Ethernet devices
     # Note: Perform a cleanup first, just to make sure to have a clean state
-    namespaces_cleanup()
-    namespaces_setup(False)
-    
-    # Initialize network emulation on ns1 and ns2 with rate limit of 10 Gbit/s, 0 delay and 0 packet loss
-    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns1', 'tc', 'qdisc', 'add', 'dev', 'veth101', 'root', 'netem', 'rate', '10000.0mbit', 'delay', '0ms', 'loss','0%'])    
-    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns2', 'tc', 'qdisc', 'add', 'dev', 'veth102', 'root', 'netem', 'rate', '10000.0mbit', 'delay', '0ms', 'loss','0%'])
-    
-    # Hard-Code MAC Addresses to prevent ARP resolutions which may cause the processes to hang, especially with high packet loss rates
-    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns1', 'ip', 'neighbor', 'add', '192.168.102.1', 'lladdr', '00:00:00:00:00:02', 'nud', 'permanent', 'dev', 'veth101'])
-    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns2', 'ip', 'neighbor', 'add', '192.168.101.1', 'lladdr', '00:00:00:00:00:01', 'nud', 'permanent', 'dev', 'veth102'])
-     
-    # Perform benchmark test for each signature algorithm
-    for alg in sig_algs:
-        print('\033[1;34mINFO:\t\tSetting up "{}" PKI.\033[0m'.format(alg), file=sys.stdout)
-        
-        # For RSA, replace ":" with "" for the alg name used in the file paths
-        if alg.startswith("RSA"):
-            algname = alg.replace(":", "")
-        else:
-            algname = alg
-        
-        # Setting up the PKI (CA, ICA and EE certificates)
-        pki_setup(alg, algname, out_dir)
-        pki_path = os.path.join(out_dir, "pki-{}".format(algname))
+    namespaces_cleanup(pairs)
+    namespaces_setup(pairs, False)
+    
+    # Each pair gets its own disjoint set of CPU cores for server and client
+    ns_pairs = create_pairs(pairs)
+    
+    for pair in ns_pairs:
+        # Initialize network emulation on both ends of the pair with rate limit of 10 Gbit/s, 0 delay and 0 packet loss
+        # Hard-Code MAC Addresses to prevent ARP resolutions which may cause the processes to hang, especially with high packet loss rates
+        # Note: As root, netem and neighbor entries are set through rtnetlink, otherwise with sudo tc/ip
+        try:
+            pair.netem = create_netem(pair)
+            pair.netem.setup(10000.0, 0.0, 0.0)
+        except (NetemError, OSError) as e:
+            print('\033[1;31mERROR:\t\tNetwork emulation of pair {} could not be set up ({}). Aborting.\033[0m'.format(pair.index, e), file=sys.stderr)
+            namespaces_cleanup(pairs)
+            sys.exit(-1)
         
-        print('\033[1;34mINFO:\t\tStarting "{}" benchmark tests.\033[0m'.format(alg), file=sys.stdout)
-        # Run s_timer benchmark test for each rate, delay and loss value
-        for rate in RATE_VALUES:
-            for delay in DELAY_VALUES:
-                for loss in LOSS_VALUES:
-                    print('\033[1;34mINFO:\t\tRate = {}Mbit/s, Delay = {}ms, Packet Loss Rate = {}%.\033[0m'.format(rate, delay, loss), file=sys.stdout)
-                    # Change network emulation to specified delay and loss
-                    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns1', 'tc', 'qdisc', 'change', 'dev', 'veth101', 'root', 'netem', 'rate', str(rate)+'mbit', 'delay', str(delay)+'ms', 'loss',str(loss)+'%'])
-                    subprocess.run(['sudo', 'ip', 'netns', 'exec', 'ns2', 'tc', 'qdisc', 'change', 'dev', 'veth102', 'root', 'netem', 'rate', str(rate)+'mbit', 'delay', str(delay)+'ms', 'loss',str(loss)+'%'])
-                    
-                    # Execute the test using s_timer
-                    run_benchmark_test(0)
+        print('\033[1;34mINFO:\t\tPair {}: server {} on CPUs {}, client {} on CPUs {}.\033[0m'.format(pair.index, pair.server_ns, pair.server_cpus, pair.client_ns, pair.client_cpus), file=sys.stdout)
+    
+    # Collect the test cells of the plan (algorithm, rate, delay, loss, TCP settings, group, cipher suite, mode and for load tests concurrency and arrival rate)
+    # Note: Finished tests of a resumed sweep are skipped, unfinished ones continue at the next round
+    cells = []
+    for test in plan:
+        alg = test[0]
+        if alg not in pki_paths:
+            continue
+        if concurrency_values:
+            # A load test with committed handshakes is finished
+            if journal.rounds_of(test) > 0 or journal.is_done(test):
+                continue
+            cells.append((alg, algnames[alg], pki_paths[alg]) + test[1:10] + (0,) + test[10:])
+            continue
+        if journal.is_done(test):
+            continue
+        cells.append((alg, algnames[alg], pki_paths[alg]) + test[1:] + (journal.rounds_of(test),))
+    
+    # Perform the benchmark tests, each cell runs on the next free namespace pair
+    print('\033[1;34mINFO:\t\tStarting {} benchmark tests on {} namespace pair(s).\033[0m'.format(len(cells), pairs), file=sys.stdout)
+    # Note: The s_server and s_timer processes of all pairs are run by the process supervisor from one event loop
+    supervisor = ProcessSupervisor()
+    records_dir = tempfile.mkdtemp(prefix="pqtls-records-")
+    atexit.register(shutil.rmtree, records_dir, True)
+    asyncio.run(run_cells(ns_pairs, cells))
+    close_contexts()
         
           
     # Cleaning up namespaces and virtual Ethernet devices
-    namespaces_cleanup()
-    
-    print('\033[1;32mSUCCESS:\tResults were stored in "{}". Finished.\033[0m'.format(results_file_name), file=sys.stdout)
+    for pair in ns_pairs:
+        pair.netem.close()
+    namespaces_cleanup(pairs)
+    
+    results_sink.close()
+    usage_sink.close()
+    if concurrency_values:
+        load_sink.close()
+        histogram_sink.close()
+    print('\033[1;32mSUCCESS:\tResults were stored in {}. Finished.\033[0m'.format(" and ".join('"{}.{}"'.format(results_file_name, extension) for extension in formats)), file=sys.stdout)
     sys.exit(0)
@@ -4,6 +4,17 @@ import sys
 import subprocess
 import shutil
 
+# Path to directory with the shared benchmark modules
+BENCH_LIB = "../bench-lib"
+sys.path.append(BENCH_LIB)
+from pki_setup import write_config
+from pki_cache import PKI_BACKENDS, default_cache_dir, build_pkis, print_pki_errors, copy_pki
+
+# Path to OpenSSL CA config file
+OSSL_CA_CONFIG = "./oqs-openssl-ca.cnf"
+# Path to OpenSSL ICA config file
+OSSL_ICA_CONFIG = "./oqs-openssl-ica.cnf"
+
 # List of the traditional algorithms used for reference
 # Comment out if an algorithm should not be included in the test
 TRADITIONAL_SIG_ALGS = []
@@ -14,156 +25,23 @@ TRADITIONAL_SIG_ALGS.append("RSA:3072")
 TRADITIONAL_SIG_ALGS.append("ECDSAprime256v1")
 #TRADITIONAL_SIG_ALGS.append("ECDSAsecp384r1")
 
-def pki_setup(alg, algstring, out_dir):
-    
-    # Prepare parent directory for algorithm specific PKI
-    pki_path = os.path.join(out_dir, "pki-{}".format(algstring))
-    create_dir(pki_path)
-    ca_config = pki_path+"/oqs-openssl-ca.cnf"
-    ica_config = pki_path+"/oqs-openssl-ica.cnf"             
-    
-    # Create sub-directory for CA, prepare file paths, create and init serial-number file
-    ca_path = os.path.join(pki_path, "ca")
-    create_dir(ca_path)
-    ca_cert = ca_path+"/ca.crt"
-    ca_key = ca_path+"/ca.key"
-    serial_file = open(ca_path+"/serial", "a")
-    serial_file.write("1000")
-    serial_file.close()
-    index_file = open(ca_path+"/index.txt", "a")
-    index_file.close()
-    # Copy CA config, but set real CA path
-    with open('./oqs-openssl-ca.cnf', "rt") as template_config:
-        with open(ca_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', ca_path))
-    
-    # Create sub-directory for ICA, prepare file paths, create and init serial-number file
-    ica_path = os.path.join(pki_path, "ica")
-    create_dir(ica_path)
-    ica_cert = ica_path+"/ica.crt"
-    ica_csr = ica_path+"/ica.csr"
-    ica_key = ica_path+"/ica.key"
-    file = open(ica_path+"/serial", "a")
-    file.write("1000")
-    file.close()
-    index_file = open(ica_path+"/index.txt", "a")
-    index_file.close()
-    # Copy ICA config, but set real ICA path
-    with open('./oqs-openssl-ica.cnf', "rt") as template_config:
-        with open(ica_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', ica_path))
-    
-    ####################################################################
-    # Create CA key and certificate
-    # Note: if/else is needed, because ECDSA needs additional arguments than EdDSA, RSA and PQC
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Root CA"
-        ec_param = 'ec_paramgen_curve:'+alg[5:]
-        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', 'ec', '-pkeyopt', ec_param, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output = True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Root CA"
-        ca_cert_process = subprocess.run(['openssl', 'req', '-x509', '-new', '-sha256', '-newkey', alg, '-keyout', ca_key, '-out', ca_cert, '-nodes', '-subj', subject, '-days', '7300', '-extensions', 'v3_ca', '-config', ca_config], capture_output=True, text = True)
-    
-    
-    if ca_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(ca_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during CA setup. Aborting.\033[0m', file=sys.stderr)
-        sys.exit(-1)
+def pki_setup(algname, cached_pki_path, out_dir):
     
+    # Copy the cached PKI to the output directory
+    pki_path = os.path.join(out_dir, "pki-{}".format(algname))
     
-    ####################################################################
-    # Create Intermediate-CA key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Test Intermediate CA"
-        ica_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', ica_key,], capture_output=True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Test Intermediate CA"
-        ica_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', ica_key, '-config', ica_config], capture_output=True, text = True)
-    
-    ica_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', ica_key, '-out', ica_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    ica_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'v3_intermediate_ca', '-md', 'sha256', '-batch', '-in', ica_csr, '-out', ica_cert, '-days', '3650', '-config', ca_config], capture_output=True, text = True)
-    
-    
-    if ica_key_process.returncode != 0 or ica_csr_process.returncode != 0 or ica_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(ica_key_process.stderr)
-        print(ica_csr_process.stderr)
-        print(ica_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during ICA setup. Aborting.\033[0m', file=sys.stderr)
-        sys.exit(-1)
-    
-    # Create sub-directory for server certificate, prepare file paths
-    server_path = os.path.join(pki_path, "server")
-    create_dir(server_path)
-    server_cert = server_path+"/server.crt"
-    server_csr = server_path+"/server.csr"
-    server_key = server_path+"/server.key"
-        
-    
-    ####################################################################
-    # Create Server key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Server Certificate"
-        server_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', server_key,], capture_output=True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Server Certificate"
-        server_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', server_key, '-config', ica_config], capture_output=True, text = True)
-    
-    server_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', server_key, '-out', server_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    server_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', server_csr, '-out', server_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
-    
-    
-    if server_key_process.returncode != 0 or server_csr_process.returncode != 0 or server_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(server_key_process.stderr)
-        print(server_csr_process.stderr)
-        print(server_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during server certificate setup. Aborting.\033[0m', file=sys.stderr)
-        sys.exit(-1)
-    
-    # Create sub-directory for client certificate, prepare file paths
-    client_path = os.path.join(pki_path, "client")
-    create_dir(client_path)
-    client_cert = client_path+"/client.crt"
-    client_csr = client_path+"/client.csr"
-    client_key = client_path+"/client.key"
-    
-    
-    ####################################################################
-    # Create Client key, CSR and certificate
-    if alg.startswith("ECDSA"):
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg[5:]+" - Client Certificate"
-        client_key_process = subprocess.run(['openssl', 'ecparam', '-name', alg[5:], '-genkey', '-out', client_key,], capture_output=True, text = True)
-    else:
-        subject = "/C=CH/ST=Zug/L=Rotkreuz/O=Lucerne University of Applied Sciences and Arts/OU=Applied Cyber Security Research Lab/CN="+alg+" - Client Certificate"
-        client_key_process = subprocess.run(['openssl', 'genpkey', '-algorithm', alg, '-out', client_key, '-config', ica_config], capture_output=True, text = True)
-    
-    client_csr_process = subprocess.run(['openssl', 'req', '-new', '-sha256', '-key', client_key, '-out', client_csr, '-subj', subject, '-config', ica_config], capture_output=True, text = True)        
-    client_cert_process = subprocess.run(['openssl', 'ca', '-extensions', 'server_cert', '-md', 'sha256', '-batch', '-in', client_csr, '-out', client_cert, '-days', '365', '-config', ica_config], capture_output=True, text = True)
-    
-    
-    if client_key_process.returncode != 0 or client_csr_process.returncode != 0 or client_cert_process.returncode != 0:
-        # Print the error messages from subprocess
-        print(client_key_process.stderr)
-        print(client_csr_process.stderr)
-        print(client_cert_process.stderr)
-        print('\033[1;31mERROR:\t\tError during server certificate setup. Aborting.\033[0m', file=sys.stderr)
-        sys.exit(-1)
-    
+    if os.path.exists(pki_path):
+        overwriting = ask_for_overwrite(pki_path)
+        if overwriting != "yes":
+            print('\033[1;34mINFO:\t\tFile/Directory "{}" is not overwritten.\033[0m'.format(pki_path), file=sys.stdout)
+            return
+        shutil.rmtree(pki_path)
+        print('\033[1;34mINFO:\t\tFile/Directory "{}" overwritten.\033[0m'.format(pki_path), file=sys.stdout)
+    copy_pki(cached_pki_path, pki_path)
     
     # Overwrite CA and ICA config files again to prepare it for usage in Docker container
-    with open('./oqs-openssl-ca.cnf', "rt") as template_config:
-        with open(ca_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', '/pqc-tls-tests/pki/pki-{}/ca'.format(algstring)))
-    
-    with open('./oqs-openssl-ica.cnf', "rt") as template_config:
-        with open(ica_config, "wt") as new_config:
-            for line in template_config:
-                new_config.write(line.replace('{path}', '/pqc-tls-tests/pki/pki-{}/ica'.format(algstring)))
+    write_config(OSSL_CA_CONFIG, pki_path+"/oqs-openssl-ca.cnf", '/pqc-tls-tests/pki/pki-{}/ca'.format(algname))
+    write_config(OSSL_ICA_CONFIG, pki_path+"/oqs-openssl-ica.cnf", '/pqc-tls-tests/pki/pki-{}/ica'.format(algname))
     
     return
 
@@ -199,26 +77,6 @@ def read_pq_sigalgs(sig_file):
     file.close()
     return algs_from_file
 
-def create_dir(path):
-    if not os.path.exists(path):
-        os.mkdir(path)
-    else:
-        overwriting = ask_for_overwrite(path)
-        
-        if overwriting == "yes":
-            # Delete directory and all contained subdirs and files
-            shutil.rmtree(path)
-            
-            # Re-create the directory
-            os.mkdir(path)
-            print('\033[1;34mINFO:\t\tFile/Directory "{}" overwritten.\033[0m'.format(path), file=sys.stdout)
-        elif overwriting == "no":
-            print('\033[1;34mINFO:\t\tFile/Directory "{}" is not overwritten.\033[0m'.format(path), file=sys.stdout)
-        else:
-            print('\033[1;31mERROR:\t\tFailure during file/directory operation. Aborting.\033[0m', file=sys.stderr)
-            sys.exit(-1)
-    return
-
 def ask_for_overwrite(path):
     yes = {'yes','y', 'ye'}
     no = {'no','n', ''}
@@ -241,11 +99,15 @@ if __name__ == '__main__':
         description='Set-up Script for PKIs.')
     parser.add_argument('-sigs', help='path to file with list of PQ signature algorithms to be included in the set up', metavar='<file path>', required=True)
     parser.add_argument('-out', help='path to directory where the results should be saved to', metavar='<dir path>', required=True)
+    parser.add_argument('-pki-cache', help='path to the directory where generated PKIs are cached, default is $PQTLS_PKI_CACHE or ~/.cache/pqtls-pki', metavar='<dir path>', default=default_cache_dir(), required=False)
+    parser.add_argument('-pki-backend', help='how missing PKIs are set up: "cli" (openssl commands) or "libcrypto" (in-process), default is cli', choices=list(PKI_BACKENDS), default='cli', required=False)
     
     args = parser.parse_args()
     
     sig_file = args.sigs
     out_dir = args.out
+    pki_cache = args.pki_cache
+    pki_backend = args.pki_backend
     
     # Make sure that the PQ signature algorithm file exists
     if not os.path.isfile(sig_file):
@@ -263,17 +125,20 @@ if __name__ == '__main__':
     # Add the reference algorithms (traditional crypto, provided in global variable) to the list
     sig_algs = TRADITIONAL_SIG_ALGS + pq_sig_algs
      
-    # Set up PKI for each signature algorithm
+    # For RSA, replace ":" with "" for the alg name used in the file paths
+    algnames = {alg: alg.replace(":", "") if alg.startswith("RSA") else alg for alg in sig_algs}
+    
+    # Setting up the PKI (CA, ICA and EE certificates) of all signature algorithms in parallel, cached PKIs are reused
+    pki_paths, pki_errors = build_pkis([(alg, algnames[alg]) for alg in sig_algs], OSSL_CA_CONFIG, OSSL_ICA_CONFIG, pki_cache, pki_backend)
+    print_pki_errors(pki_errors)
+    
+    # Copy the PKI of each signature algorithm to the output directory
     for alg in sig_algs:
-        print('\033[1;34mINFO:\t\tSetting up "{}" PKI.\033[0m'.format(alg), file=sys.stdout)
-        
-        # For RSA, replace ":" with "" for the alg name used in the file paths
-        if alg.startswith("RSA"):
-            algname = alg.replace(":", "")
-        else:
-            algname = alg
-        
-        # Setting up the PKI (CA, ICA and EE certificates)
-        pki_setup(alg, algname, out_dir)
+        if alg in pki_paths:
+            pki_setup(algnames[alg], pki_paths[alg], out_dir)
+    
+    if pki_errors:
+        print('\033[1;31mERROR:\t\tPKI set up failed for {} algorithm(s).\033[0m'.format(len(pki_errors)), file=sys.stderr)
+        sys.exit(-1)
         
     sys.exit(0)
@@ -9,17 +9,60 @@
 ##############################################################################################
 
 import argparse
+import asyncio
+import atexit
 import os
+import random
 import sys
-import subprocess
 import shutil
-import time
+import tempfile
 from datetime import datetime
 
+# Path to directory with the shared benchmark modules
+BENCH_LIB = "./bench-lib"
+sys.path.append(BENCH_LIB)
+from results_sink import TEXT_LENGTH, ResultsSink
+from adaptive_sampling import ADAPTIVE_SAMPLE_SIZE, has_converged
+from process_supervisor import ProcessSupervisor
+from experiment_spec import DEFAULT_HANDSHAKE_MS, ORDER_STRATEGIES, ExperimentSpec, SpecError, load_spec, expand_plan, parse_shard, select_shard, estimate_cell_seconds, print_plan
+from process_stats import ProcessUsage, usage_columns, parse_rusage
+from path_prober import PROBE_METHODS, DEFAULT_INTERVAL, DEFAULT_WINDOW, PROBE_COLUMNS, PATH_COLUMNS, ProberError, PathProber
+from stimer_records import DEFAULT_GROUPS, DEFAULT_CIPHERSUITES, KEX_COLUMNS, MODES, MODE_COLUMNS, PHASE_COLUMNS, LOAD_COLUMNS, LOAD_SUMMARY_COLUMNS, HISTOGRAM_COLUMNS, RecordsError, load_round_records, phase_offsets, mode_values, latencies, parse_load_output, clock_offset_ns, start_times
+
 # Path to s_timer
 STIMER_BINARY = "/opt/stimer/s_timer"
 
-# Dict with Signature Algorithm and Port Mapping
+# Defaults of the experiment, a spec file (-spec) overrides them (see experiment-specs/)
+
+# Maximum duration in seconds for a single handshake (used for timeout)
+MAX_HS_DUR = 30
+
+# Consecutive batches of a test which reached the timeout before the run is aborted (the remaining rounds of a batch are
+# repeated in the next pass)
+MAX_BATCH_TIMEOUTS = 3
+
+# Rounds of a latency test per s_timer run (batch), the batches of all tests are interleaved (see run_latency_tests)
+SAMPLE_SIZE = 50
+
+# Rounds of the check that the server resumes the sessions (and accepts the early data) of the resumption modes
+RESUMPTION_CHECK_ROUNDS = 5
+
+# Lists of key exchange groups and TLS 1.3 cipher suites, each value is passed to s_timer as is
+# Note: The servers accept all of them (-groups and -ciphersuites in docker-compose.yml of the server)
+# Uncomment if a group or cipher suite should be included in the test
+GROUP_VALUES = [DEFAULT_GROUPS]
+#GROUP_VALUES.append("x25519")
+#GROUP_VALUES.append("kyber512")
+#GROUP_VALUES.append("kyber768")
+#GROUP_VALUES.append("kyber1024")
+#GROUP_VALUES.append("p256_kyber512")
+#GROUP_VALUES.append("p384_kyber768")
+#GROUP_VALUES.append("p521_kyber1024")
+CIPHERSUITE_VALUES = [DEFAULT_CIPHERSUITES]
+#CIPHERSUITE_VALUES.append("TLS_AES_128_GCM_SHA256")
+#CIPHERSUITE_VALUES.append("TLS_CHACHA20_POLY1305_SHA256")
+
+# Dict with Signature Algorithm and Port Mapping (the [ports] section of a spec replaces it)
 algs = {}
 algs['RSA:3072'] = 50001
 algs['ECDSAprime256v1'] = 50002
@@ -35,72 +78,348 @@ algs['sphincssha2128ssimple'] = 50011
 algs['sphincssha2192ssimple'] = 50012
 algs['sphincssha2256ssimple'] = 50013
 
+# Columns of the results files (key, type, CSV header)
+RESULTS_COLUMNS = [
+    ("algorithm", "str", "Signature Algorithm"),
+    ("round", "int", "Test Round"),
+    ("success", "bool", "Success"),
+    ("duration", "float", "Handshake Duration [ms]"),
+]
+
+# Wall clock start of each round and the pass of the scheduler it was run in (key, type, CSV header)
+TIME_COLUMNS = [
+    ("start_time", "float", "Start Time [s]"),
+    ("pass", "int", "Pass"),
+]
+
+# Index of the start time in the result rows, the path conditions around it are appended to the rows (PATH_COLUMNS)
+START_TIME_INDEX = len(RESULTS_COLUMNS) + len(KEX_COLUMNS)
+
+# Columns identifying a test in the usage, summary and histogram files (key, type, CSV header)
+TEST_COLUMNS = [RESULTS_COLUMNS[0]] + KEX_COLUMNS + MODE_COLUMNS[:1]
+LOAD_TEST_COLUMNS = TEST_COLUMNS + LOAD_COLUMNS[:2]
+
+# CPU time, context switches and peak RSS of s_timer per test
+# Note: The servers run on the remote host, their usage is not accounted here
+USAGE_COLUMNS = [("handshakes", "int", "Handshakes")] + usage_columns("client", "Client")
+
+
+class TestProgress:
+    # Progress of a latency test (algorithm, group, cipher suite, mode), whose rounds are run in batches
+    
+    def __init__(self, test):
+        self.test = test
+        self.done_rounds = 0
+        # Durations of the successful handshakes, for the convergence check in adaptive mode
+        self.durations = []
+        self.rows = []
+        self.usage = ProcessUsage()
+        # Consecutive batches which reached the timeout
+        self.timeouts = 0
+        self.finished = False
 
-def run_benchmark_test(alg, algname, rounds, dest_ip, port):
+
+async def run_benchmarks(dest_ip):
+    # Probe RTT and Packet Loss of the path in the background for the whole run
+    if prober is not None:
+        print('\033[1;34mINFO:\t\tProbing RTT and Packet Loss to "{}" ({} probes every {}s).\n\033[0m'.format(dest_ip, prober.method, prober.interval), file=sys.stdout)
+        try:
+            await prober.start()
+        except ProberError as e:
+            print('\033[1;31mERROR:\t\tPath prober could not be started ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+            sys.exit(-1)
+    
+    try:
+        await check_resumption(dest_ip)
+        
+        if concurrency_values:
+            # Load tests run one after the other in the order of the plan (algorithm, group, cipher suite, mode, concurrency and arrival rate)
+            # Note: A load test saturates its server, so it is not interleaved with other tests
+            for pass_index, test in enumerate(plan, 1):
+                alg = test[0]
+                print('\033[1;34mINFO:\t\tStarting "{}" load test with {}, {}, {} handshakes.\033[0m'.format(alg, test[1], test[2], test[3]), file=sys.stdout)
+                await run_load_test(alg, pki_name(alg), dest_ip, algs[alg], *test[1:], pass_index)
+        else:
+            await run_latency_tests(dest_ip)
+        
+        # The path conditions of the last rounds need the probes of the window after them
+        if prober is not None and pending_rows:
+            await prober.wait_until(max(row[START_TIME_INDEX] for row in pending_rows) + prober.window)
+    finally:
+        # Stop the prober and s_timer, the pending rows get the path conditions probed so far if the run is aborted
+        if prober is not None:
+            await prober.stop()
+            flush_rows(True)
+        await supervisor.close()
+    
+    return
+
+async def check_resumption(dest_ip):
+    # A few handshakes per resumption mode against the server of the first test, every one of them has to resume the
+    # session (and have its early data accepted), otherwise the rounds of the mode would be measured as full handshakes
+    alg, group, ciphersuite = plan[0][:3]
+    pki_path="./pki/pki-{}".format(pki_name(alg))
+    records_file_name = records_path(algs[alg])
+    
+    for mode in [mode for mode in modes if mode != "full"]:
+        results = await supervisor.run([STIMER_BINARY, '-h', '{}:{}'.format(dest_ip, algs[alg]), '-r', str(RESUMPTION_CHECK_ROUNDS), '--cert='+pki_path+"/client/client.crt", '--key='+pki_path+"/client/client.key", '--rootcert='+pki_path+"/ca/ca.crt", '--chaincert='+pki_path+"/ica/ica.crt", '--records='+records_file_name, '--groups='+group, '--ciphersuites='+ciphersuite, '--mode='+mode], MAX_HS_DUR * RESUMPTION_CHECK_ROUNDS, "s_timer")
+        if results.timed_out:
+            print('\033[1;31mERROR:\t\tTimeout reached in the resumption check of {} ({} handshakes). Aborting.\033[0m'.format(alg, mode), file=sys.stderr)
+            sys.exit(-1)
+        check_stimer_output(results)
+        
+        resumed = sum(1 for _, session_resumed, early_data in mode_values(read_records(records_file_name)) if session_resumed and (early_data or mode != "early-data"))
+        if resumed < RESUMPTION_CHECK_ROUNDS:
+            print('\033[1;31mERROR:\t\tServer of {} resumed only {} of {} {} handshakes. Aborting.\033[0m'.format(alg, resumed, RESUMPTION_CHECK_ROUNDS, mode), file=sys.stderr)
+            sys.exit(-1)
+        print('\033[1;34mINFO:\t\tServer of {} resumed all {} {} handshakes of the check.\033[0m'.format(alg, RESUMPTION_CHECK_ROUNDS, mode), file=sys.stdout)
+    
+    return
+
+async def run_latency_tests(dest_ip):
+    # The latency tests run in passes, each pass runs the next batch (sample_size rounds) of every unfinished test
+    # The order of the batches in a pass is the plan order ("interleaved"), shuffled per pass ("randomized") or only the
+    # first unfinished test ("sequential", all rounds of a test before the next one)
+    # Note: All algorithms are measured in every pass, so drifts of the network path over the run affect them alike
+    tests = [TestProgress(test) for test in plan]
+    shuffle = random.Random(seed)
+    # With -parallel, the batches of a pass run concurrently, at most one batch per server port at a time
+    slots = asyncio.Semaphore(parallel)
+    port_locks = {port: asyncio.Lock() for port in set(algs[test[0]] for test in plan)}
+    
+    pass_index = 0
+    while True:
+        pass_tests = [progress for progress in tests if not progress.finished]
+        if not pass_tests:
+            break
+        if strategy == "sequential":
+            pass_tests = pass_tests[:1]
+        elif strategy == "randomized":
+            shuffle.shuffle(pass_tests)
+        pass_index = pass_index + 1
+        
+        tasks = [asyncio.create_task(run_guarded_batch(progress, pass_index, dest_ip, slots, port_locks)) for progress in pass_tests]
+        try:
+            for task in asyncio.as_completed(tasks):
+                abort = await task
+                if abort is not None:
+                    raise abort
+        finally:
+            # If a batch aborted, the other batches of the pass are cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    return
+
+async def run_guarded_batch(progress, pass_index, dest_ip, slots, port_locks):
+    # sys.exit() of a batch is returned instead of raised, as it would otherwise leave the event loop before the cleanup
+    try:
+        # The port is taken before the slot, so a batch waiting for its port does not hold a slot
+        async with port_locks[algs[progress.test[0]]]:
+            async with slots:
+                await run_test_batch(progress, pass_index, dest_ip)
+    except SystemExit as abort:
+        return abort
+    return None
+
+async def run_test_batch(progress, pass_index, dest_ip):
+    alg, group, ciphersuite, mode = progress.test
+    budget = max_rounds if adaptive else rounds
+    run_rounds = min(sample_size, budget - progress.done_rounds)
+    
+    if progress.done_rounds == 0:
+        print('\033[1;34mINFO:\t\tStarting "{}" benchmark test with {}, {}, {} handshakes.\033[0m'.format(alg, group, ciphersuite, mode), file=sys.stdout)
+    
+    result_rows, batch_usage, timed_out = await run_stimer_batch(alg, pki_name(alg), run_rounds, dest_ip, algs[alg], group, ciphersuite, mode, progress.done_rounds + 1, pass_index)
+    # Only the finished rounds count, the remaining rounds of a batch which reached the timeout are run in the next pass
+    progress.done_rounds = progress.done_rounds + len(result_rows)
+    progress.rows.extend(result_rows)
+    progress.usage.add(batch_usage)
+    
+    if timed_out:
+        progress.timeouts = progress.timeouts + 1
+        if progress.timeouts >= MAX_BATCH_TIMEOUTS:
+            print('\033[1;31mERROR:\t\tTimeout reached for {} ({} handshakes) in {} consecutive batches. Aborting.\033[0m'.format(alg, mode, progress.timeouts), file=sys.stderr)
+            sys.exit(-1)
+        print('\033[1;31mERROR:\t\tTimeout reached for {} ({} handshakes) after {} of {} rounds. Repeating the remaining rounds in the next pass.\033[0m'.format(alg, mode, len(result_rows), run_rounds), file=sys.stderr)
+    else:
+        progress.timeouts = 0
+    
+    if progress.done_rounds >= budget:
+        progress.finished = True
+    elif adaptive:
+        # In adaptive mode, the test ends as soon as the percentiles converged, at most after max_rounds
+        progress.durations.extend(row[3] for row in result_rows if row[2])
+        converged, widths = has_converged(progress.durations, ci_width)
+        if converged and progress.done_rounds >= min_rounds:
+            print('\033[1;34mINFO:\t\tConverged after {} rounds for {} ({} handshakes, relative CI widths of median and p95: {:.3f}, {:.3f}).\033[0m'.format(progress.done_rounds, alg, mode, widths[0], widths[1]), file=sys.stdout)
+            progress.finished = True
+    
+    if progress.finished:
+        write_usage(progress.test, progress.rows, progress.usage)
+        progress.rows = []
+    
+    return
+
+def pki_name(alg):
+    # For RSA, replace ":" with "" for the alg name used in the file paths
+    if alg.startswith("RSA"):
+        return alg.replace(":", "")
+    return alg
+
+def records_path(port):
+    # Records file of the s_timer run on a port, there is at most one run per port at a time
+    return os.path.join(records_dir, "s_timer-{}.bin".format(port))
+
+async def run_stimer_batch(alg, algname, rounds, dest_ip, port, group, ciphersuite, mode, first_round, pass_index):
     # Prepare file paths
     pki_path="./pki/pki-{}".format(algname)
     ca_cert = pki_path+"/ca/ca.crt"
     ica_cert = pki_path+"/ica/ica.crt"
     client_cert = pki_path+"/client/client.crt"
     client_key = pki_path+"/client/client.key"
+    records_file_name = records_path(port)
     
     print(pki_path)
     
-    # Start s_timer process
-    # Note: Use run (not Popen), as it should be waited until the process execution in finished
-    #       The test is repeated "rounds" times
+    # Run s_timer process, the test is repeated "rounds" times
+    # Note: The supervisor reads the output while s_timer runs, it is stopped if it needs more than MAX_HS_DUR seconds per handshake
+    # s_timer writes a binary record per round as soon as it finished, the round timestamps are converted to wall clock time
+    clock_offset = clock_offset_ns()
+    results = await supervisor.run([STIMER_BINARY, '-h', '{}:{}'.format(dest_ip, port), '-r', str(rounds), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert, '--records='+records_file_name, '--groups='+group, '--ciphersuites='+ciphersuite, '--mode='+mode, '--rusage'] + (['--phases'] if phases else []), MAX_HS_DUR * rounds, "s_timer")
+    
+    if results.timed_out:
+        # Keep the rounds finished before the deadline
+        try:
+            result_rows = records_to_rows(alg, first_round, group, ciphersuite, load_round_records(records_file_name), clock_offset, pass_index)
+        except (RecordsError, OSError):
+            result_rows = []
+        write_rows(result_rows)
+        return result_rows, ProcessUsage(), True
+    
+    # Check the s_timer output (OpenSSL version and provider), then read the round records
+    s_time_output = check_stimer_output(results)
+    result_rows = records_to_rows(alg, first_round, group, ciphersuite, read_records(records_file_name), clock_offset, pass_index)
+    # Hand the rows to the background writer of the results sink
+    write_rows(result_rows)
+    
+    print('\033[1;32mSUCCESS:\tResults for {} ({} handshakes) written to file.\n\033[0m'.format(alg, mode), file=sys.stdout)
+                
+    return result_rows, parse_rusage(s_time_output[2:]) or ProcessUsage(), False
+
+async def run_load_test(alg, algname, dest_ip, port, group, ciphersuite, mode, concurrency, arrival_rate, pass_index):
+    # Prepare file paths
+    pki_path="./pki/pki-{}".format(algname)
+    ca_cert = pki_path+"/ca/ca.crt"
+    ica_cert = pki_path+"/ica/ica.crt"
+    client_cert = pki_path+"/client/client.crt"
+    client_key = pki_path+"/client/client.key"
+    records_file_name = records_path(port)
+    
+    # s_timer runs the handshakes from "concurrency" worker threads for load_duration seconds, in an open loop if an arrival rate is set
+    # Note: The handshakes still running at the end are given MAX_HS_DUR seconds to finish
+    clock_offset = clock_offset_ns()
+    results = await supervisor.run([STIMER_BINARY, '-h', '{}:{}'.format(dest_ip, port), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert, '--records='+records_file_name, '--concurrency='+str(concurrency), '--arrival-rate='+str(arrival_rate), '--duration='+str(load_duration), '--groups='+group, '--ciphersuites='+ciphersuite, '--mode='+mode, '--rusage'] + (['--phases'] if phases else []), load_duration + MAX_HS_DUR, "s_timer")
     
-    results = subprocess.run([STIMER_BINARY, '-h', '{}:{}'.format(dest_ip, port), '-r', str(rounds), '--cert='+client_cert, '--key='+client_key, '--rootcert='+ca_cert, '--chaincert='+ica_cert], capture_output=True)
+    if results.timed_out:
+        # Keep the handshakes finished before the deadline
+        try:
+            records = load_round_records(records_file_name)
+            write_rows(records_to_rows(alg, 1, group, ciphersuite, records, clock_offset, pass_index, (concurrency, arrival_rate)))
+        except (RecordsError, OSError):
+            pass
+        print('\033[1;31mERROR:\t\tTimeout reached for {} ({} handshakes) with concurrency {} and arrival rate {}/s. Aborting.\033[0m'.format(alg, mode, concurrency, arrival_rate), file=sys.stderr)
+        sys.exit(-1)
+    
+    s_time_output = check_stimer_output(results)
+    try:
+        summary, histogram = parse_load_output(s_time_output[2:])
+    except (RecordsError, ValueError, KeyError) as e:
+        print('\033[1;31mERROR:\t\tLoad summary of s_timer could not be read ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+        sys.exit(-1)
+    
+    result_rows = records_to_rows(alg, 1, group, ciphersuite, read_records(records_file_name), clock_offset, pass_index, (concurrency, arrival_rate))
+    write_rows(result_rows)
+    write_usage((alg, group, ciphersuite, mode, concurrency, arrival_rate), result_rows, parse_rusage(s_time_output[2:]) or ProcessUsage())
+    load_sink.write((alg, group, ciphersuite, mode, concurrency, arrival_rate) + summary)
+    histogram_sink.write_many([(alg, group, ciphersuite, mode, concurrency, arrival_rate) + bucket for bucket in histogram if bucket[1] > 0])
     
+    print('\033[1;32mSUCCESS:\t{} ({} handshakes) with concurrency {} and arrival rate {}/s: {:.1f} handshakes/s, p99 latency {:.2f}ms.\n\033[0m'.format(alg, mode, concurrency, arrival_rate, summary[4], summary[7]), file=sys.stdout)
     
+    return
+
+def write_usage(test, result_rows, client_usage):
+    # Usage of s_timer over all rounds of the test, the CPU time per handshake counts the successful handshakes only
+    handshakes = sum(1 for row in result_rows if row[2])
+    usage_sink.write(test + (handshakes,) + client_usage.values(handshakes))
+    return
+
+def check_stimer_output(results):
     # Save output line by line in array
     s_time_output = bytes.decode(results.stdout, 'utf-8').splitlines()
+    
+    # s_timer prints version and provider state on two lines (the results are in the records file), anything else means it failed
+    if len(s_time_output) < 2:
+        print('\033[1;31mERROR:\t\ts_timer exited with code {} without results. Aborting.\033[0m'.format(results.returncode), file=sys.stderr)
+        print(bytes.decode(results.stderr, 'utf-8', 'replace'), file=sys.stderr)
+        sys.exit(-1)
         
     # Check that OpenSSL 3.2.0 was used (no older version)
     # Note: s_timer outputs the OpenSSL version in the first output line
-    
     if s_time_output[0].find('OpenSSL 3.2.0 ') < 0:
         # Correct version string not found, abort
         print('\033[1;31mERROR:\t\tWrong OpenSSL version in s_timer. Aborting.\033[0m', file=sys.stderr)
         sys.exit(-1)
-    else:
-        # Check if provider could be loaded successfully
-        # Note: s_timer output if provider load was successful on the second line
-        if s_time_output[1].find('provider loaded successfully') < 0:
-            # Provider not found
-            print('\033[1;31mERROR:\t\tOQS-Provider in s_timer not loaded. Aborting.\033[0m', file=sys.stderr)
-            sys.exit(-1)
-        else:
-            # Provider loaded successfully, print results
-            i = 1
-            for result in s_time_output[2].split(","):
-                # s_timer outputs results as pairs of measurement:success (float:bool)
-                # Note: If connection was unsuccessful (success=false), a dummy value of 0.0ms is returned as measurement
-                measurement, success = result.split(":")
-                results_file = open(results_file_name, "a")
-                results_file.write(alg+","+str(i)+","+success+","+measurement+"\n")
-                results_file.close()
-                i = i + 1
-            
-            print('\033[1;32mSUCCESS:\tResults for {} written to file.\n\033[0m'.format(alg), file=sys.stdout)
-                
-    return
-
-def run_ping(dest_ip):
-    # Prepare file for output
-    ping_file_name = out_dir+"ping_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".txt"
     
-    print('\033[1;34mINFO:\t\tMeasuring RTT and Packet Loss to "{}".\n\033[0m'.format(dest_ip), file=sys.stdout)
-    ping_results = subprocess.run(['ping', '-c', '10', str(dest_ip)], capture_output=True)
-    
-    # Save output
-    ping_output = bytes.decode(ping_results.stdout, 'utf-8')
-    
-    # Write output to file
-    ping_file = open(ping_file_name, "a")
-    ping_file.write(ping_output)
-    ping_file.close()
+    # Check if provider could be loaded successfully
+    # Note: s_timer output if provider load was successful on the second line
+    if s_time_output[1].find('provider loaded successfully') < 0:
+        # Provider not found
+        print('\033[1;31mERROR:\t\tOQS-Provider in s_timer not loaded. Aborting.\033[0m', file=sys.stderr)
+        sys.exit(-1)
     
+    return s_time_output
+
+def read_records(records_file_name):
+    try:
+        records = load_round_records(records_file_name)
+    except (RecordsError, OSError) as e:
+        print('\033[1;31mERROR:\t\tRecords of s_timer could not be read ({}). Aborting.\033[0m'.format(e), file=sys.stderr)
+        sys.exit(-1)
+    return records
+
+def records_to_rows(alg, first_round, group, ciphersuite, records, clock_offset, pass_index, load=None):
+    # Result rows of the round records of one s_timer run
+    # Note: If a connection was unsuccessful (status 0), s_timer records a dummy value of 0.0ms as duration
+    rows = [(alg, first_round + i, status == 1, duration, group, ciphersuite, start_time, pass_index) for i, (status, duration, start_time) in enumerate(zip(records["status"].tolist(), records["duration_ms"].tolist(), start_times(records, clock_offset).tolist()))]
+    # If not only full handshakes are tested, the mode of each round and whether the session was resumed (and the early data accepted) follow
+    if modes != ["full"]:
+        rows = [row + values for row, values in zip(rows, mode_values(records))]
+    # In load mode, the concurrency, arrival rate and latency of each handshake follow
+    if load is not None:
+        rows = [row + load + (latency,) for row, latency in zip(rows, latencies(records).tolist())]
+    # With -phases, the phase columns (ms after the start of the round) follow
+    if phases:
+        rows = [row + tuple(offsets) for row, offsets in zip(rows, phase_offsets(records).tolist())]
+    return rows
+
+def write_rows(rows):
+    # Without prober, the rows are written right away, otherwise as soon as the window after their round was probed
+    if prober is None:
+        results_sink.write_many(rows)
+        return
+    pending_rows.extend(rows)
+    flush_rows(False)
+    return
+
+def flush_rows(all_rows):
+    # Write the pending rows whose path conditions are complete (all of them at the end of the run) with the conditions appended
+    global pending_rows
+    latest = prober.times[-1] if prober.times else 0.0
+    ready = [row for row in pending_rows if all_rows or row[START_TIME_INDEX] + prober.window < latest]
+    pending_rows = [row for row in pending_rows if not (all_rows or row[START_TIME_INDEX] + prober.window < latest)]
+    results_sink.write_many(prober.annotate(ready, START_TIME_INDEX))
     return
 
 
@@ -109,42 +428,148 @@ if __name__ == '__main__':
         prog='Post-Quantum TLS Handshake Benchmarker',
         description='Benchmarking Post-Quantum TLS Handshake performance using different signature algorithms with OpenSSL s_time.')
     parser.add_argument('-rounds', help='the number of times the test should be performed for, default is 10', metavar='INT', type=int, default='10', required=False)
-    parser.add_argument('-out', help='path to directory where the results should be saved to', metavar='<dir path>', required=True)
+    parser.add_argument('-out', help='path to directory where the results should be saved to, required unless -plan is set', metavar='<dir path>', required=False)
     parser.add_argument('-ip', help='IP address of TLS server', metavar='<IP>', default='localhost', required=False)
+    parser.add_argument('-adaptive', help='if set, each test runs until the confidence intervals of median and p95 handshake duration are narrower than -ci-width (-rounds is ignored)', action='store_true', required=False)
+    parser.add_argument('-min-rounds', help='the minimum number of rounds per test in adaptive mode, default is 100', metavar='INT', type=int, default='100', required=False)
+    parser.add_argument('-max-rounds', help='the maximum number of rounds per test in adaptive mode, default is 10000', metavar='INT', type=int, default='10000', required=False)
+    parser.add_argument('-ci-width', help='the target width of the 95%% confidence intervals relative to the estimate in adaptive mode, default is 0.1', metavar='FLOAT', type=float, default='0.1', required=False)
+    parser.add_argument('-phases', help='if set, the timestamps of the handshake phases (TCP connect, ServerHello, certificates, Finished) are added to the results', action='store_true', required=False)
+    parser.add_argument('-mode', help='the handshake modes to be tested: "full" (certificates in every handshake), "resume" (session ticket of the previous handshake) and "early-data" (resumption with 0-RTT data), default is full', choices=MODES, nargs='+', default=['full'], required=False)
+    parser.add_argument('-concurrency', help='if set, each test is a load test with this number of concurrent connections instead of a latency test (-rounds and -adaptive are ignored), multiple values are tested one after the other', metavar='INT', type=int, nargs='+', required=False)
+    parser.add_argument('-arrival-rate', help='the handshake arrival rates per second of the load tests (open loop), 0 starts a new handshake as soon as a connection is free (closed loop), default is 0', metavar='FLOAT', type=float, nargs='+', default=[0.0], required=False)
+    parser.add_argument('-load-duration', help='the duration in seconds of each load test, default is 10', metavar='INT', type=int, default='10', required=False)
+    parser.add_argument('-sample-size', help='the number of rounds of a latency test per batch, the batches of all tests are interleaved, default is {}'.format(SAMPLE_SIZE), metavar='INT', type=int, default=SAMPLE_SIZE, required=False)
+    parser.add_argument('-order', help='the order of the batches: "sequential" (all batches of a test before the next test), "interleaved" (one batch of every test per pass in plan order) or "randomized" (like interleaved, shuffled per pass), default is randomized', choices=ORDER_STRATEGIES, default='randomized', required=False)
+    parser.add_argument('-parallel', help='the number of batches run concurrently, each on a different algorithm port, default is 1', metavar='INT', type=int, default='1', required=False)
+    parser.add_argument('-probe', help='how RTT and Packet Loss of the path are probed during the run: "tcp" (TCP connects to a server port), "icmp" (echo requests) or "none", default is tcp', choices=PROBE_METHODS + ['none'], default='tcp', required=False)
+    parser.add_argument('-probe-interval', help='the interval in seconds between two probes, default is {}'.format(DEFAULT_INTERVAL), metavar='FLOAT', type=float, default=DEFAULT_INTERVAL, required=False)
+    parser.add_argument('-probe-window', help='the probes within this many seconds before and after the start of a round make up its path conditions, default is {}'.format(DEFAULT_WINDOW), metavar='FLOAT', type=float, default=DEFAULT_WINDOW, required=False)
+    parser.add_argument('-spec', help='path to a TOML experiment spec (algorithms and ports, dimensions, rounds, load tests, cell order and output formats), its values take precedence over the command line', metavar='<file path>', required=False)
+    parser.add_argument('-plan', help='if set, the cell plan is printed with its estimated wall time and no test is run', action='store_true', required=False)
+    parser.add_argument('-shard', help='if set, only shard I of N of the cell plan is run (every N-th cell from the I-th on)', metavar='I/N', type=parse_shard, required=False)
     
     args = parser.parse_args()
     
-    rounds = args.rounds
+    # The command line and the defaults of this script make up the experiment, a spec file overrides them
+    # Note: Without algorithms in the spec, all algorithms of the port mapping are tested
+    spec = ExperimentSpec({"algorithms": None, "ports": algs, "groups": GROUP_VALUES, "ciphersuites": CIPHERSUITE_VALUES, "modes": args.mode, "rounds": args.rounds,
+                           "sample_size": args.sample_size, "max_handshake_duration": MAX_HS_DUR, "adaptive": args.adaptive, "min_rounds": args.min_rounds, "max_rounds": args.max_rounds, "ci_width": args.ci_width,
+                           "concurrency": args.concurrency, "arrival_rate": args.arrival_rate, "load_duration": args.load_duration, "strategy": args.order, "seed": 0, "parallel": args.parallel,
+                           "formats": ["rec", "csv"], "phases": args.phases, "probe": args.probe, "probe_interval": args.probe_interval, "probe_window": args.probe_window,
+                           "handshake_ms": DEFAULT_HANDSHAKE_MS, "rtt_ms": 0.0})
+    if args.spec is not None:
+        try:
+            spec = load_spec(args.spec, spec.values)
+        except SpecError as e:
+            print('\033[1;31mERROR:\t\tExperiment spec "{}" is invalid: {}. Aborting.\033[0m'.format(args.spec, e), file=sys.stderr)
+            sys.exit(-1)
+    
+    MAX_HS_DUR = spec.max_handshake_duration
+    GROUP_VALUES = spec.groups
+    CIPHERSUITE_VALUES = spec.ciphersuites
+    algs = spec.ports
+    
+    rounds = spec.rounds
     out_dir = args.out
     dest_ip = args.ip
+    adaptive = spec.adaptive
+    min_rounds = spec.min_rounds
+    max_rounds = spec.max_rounds
+    ci_width = spec.ci_width
+    phases = spec.phases
+    modes = spec.modes
+    concurrency_values = spec.concurrency
+    arrival_rate_values = spec.arrival_rate
+    load_duration = spec.load_duration
+    formats = tuple(spec.formats)
+    strategy = spec.strategy
+    seed = spec.seed
+    parallel = spec.parallel
+    # In adaptive mode, the convergence is checked after each batch
+    sample_size = min(spec.sample_size, ADAPTIVE_SAMPLE_SIZE) if adaptive else spec.sample_size
+    sig_algs = spec.algorithms if spec.algorithms is not None else list(algs)
+    
+    # Every algorithm needs the port of its server
+    for alg in sig_algs:
+        if alg not in algs:
+            print('\033[1;31mERROR:\t\tNo server port of algorithm "{}" (add it to the [ports] of the spec). Aborting.\033[0m'.format(alg), file=sys.stderr)
+            sys.exit(-1)
+    
+    if spec.probe_interval <= 0 or spec.probe_window <= 0:
+        print('\033[1;31mERROR:\t\tProbe interval and window must be positive.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    if sample_size < 1 or parallel < 1:
+        print('\033[1;31mERROR:\t\tSample size and number of parallel batches must be at least 1.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    if concurrency_values is not None and (min(concurrency_values) < 1 or min(arrival_rate_values) < 0 or load_duration < 1):
+        print('\033[1;31mERROR:\t\tConcurrency and load duration must be at least 1, arrival rates must not be negative.\033[0m', file=sys.stderr)
+        sys.exit(-1)
+    
+    # Group and cipher suite lists are stored in fixed-size text columns of the results files
+    if max(len(value.encode("utf-8")) for value in GROUP_VALUES + CIPHERSUITE_VALUES) > TEXT_LENGTH:
+        print('\033[1;31mERROR:\t\tKey exchange groups and cipher suites must not be longer than {} bytes.\033[0m'.format(TEXT_LENGTH), file=sys.stderr)
+        sys.exit(-1)
+    
+    # Expand the cell plan, one cell per combination of the dimension values in the order of the spec
+    dimensions = [sig_algs, GROUP_VALUES, CIPHERSUITE_VALUES, modes] + ([concurrency_values, arrival_rate_values] if concurrency_values else [])
+    plan = expand_plan(dimensions, spec.strategy, spec.seed)
+    if args.shard is not None:
+        plan = select_shard(plan, args.shard)
+    
+    # Report the plan with its estimated duration (with the RTT of the spec, as the path is only probed during the run) and stop
+    if args.plan:
+        cell_seconds = [estimate_cell_seconds(spec, spec.rtt_ms, 0.0, bool(concurrency_values)) for cell in plan]
+        print_plan([column[2] for column in (LOAD_TEST_COLUMNS if concurrency_values else TEST_COLUMNS)], plan, cell_seconds, 1 if concurrency_values else parallel)
+        sys.exit(0)
     
     # Check if output directory exists
-    if not os.path.isdir(out_dir):
+    if out_dir is None or not os.path.isdir(out_dir):
         print('\033[1;31mERROR:\t\tDirectory "{}" does not exist. Please provide a directory to store the resulting files in.\033[0m'.format(out_dir), file=sys.stderr) 
         sys.exit(-1)
     
-    # Run ping to measure RTT and Packet Loss
-    run_ping(dest_ip)
+    # Prepare files for benchmark results (binary records and CSV export)
+    # Note: The sink is also closed (and thereby flushed) if the run is aborted
+    results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    results_sink = ResultsSink(results_file_name, RESULTS_COLUMNS + KEX_COLUMNS + TIME_COLUMNS + (MODE_COLUMNS if modes != ["full"] else []) + (LOAD_COLUMNS if concurrency_values else []) + (PHASE_COLUMNS if phases else []) + (PATH_COLUMNS if spec.probe != "none" else []), formats)
+    atexit.register(results_sink.close)
     
-    # Prepare file for benchmark results
-    results_file_name = out_dir+"results_"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".csv"
-    results_file = open(results_file_name, "a")
-    results_file.write("Signature Algorithm,Test Round,Success,Handshake Duration [ms]"+"\n")
-    results_file.close()
+    # The probe samples of the path are written to their own file, the TCP probes connect to the server of the first algorithm
+    prober = None
+    pending_rows = []
+    if spec.probe != "none":
+        path_sink = ResultsSink(results_file_name+"_path", PROBE_COLUMNS, formats)
+        atexit.register(path_sink.close)
+        prober = PathProber(dest_ip, algs[sig_algs[0]], spec.probe, spec.probe_interval, spec.probe_window, path_sink)
     
-    # Perform benchmark test for each signature algorithm
-    for alg, port in algs.items():
-               
-        print('\033[1;34mINFO:\t\tStarting "{}" benchmark tests.\033[0m'.format(alg), file=sys.stdout)
-        
-        # For RSA, replace ":" with "" for the alg name used in the file paths
-        if alg.startswith("RSA"):
-            algname = alg.replace(":", "")
-        else:
-            algname = alg
-        
-        # Run s_timer benchmark test
-        run_benchmark_test(alg, algname, rounds, dest_ip, port)
+    # CPU time, context switches and peak RSS of s_timer are written per test
+    usage_sink = ResultsSink(results_file_name+"_usage", (LOAD_TEST_COLUMNS if concurrency_values else TEST_COLUMNS) + USAGE_COLUMNS, formats)
+    atexit.register(usage_sink.close)
+    
+    # Load tests write a summary (throughput and latency percentiles) and the latency histogram per test
+    if concurrency_values:
+        load_sink = ResultsSink(results_file_name+"_load", LOAD_TEST_COLUMNS + LOAD_SUMMARY_COLUMNS, formats)
+        atexit.register(load_sink.close)
+        histogram_sink = ResultsSink(results_file_name+"_histogram", LOAD_TEST_COLUMNS + HISTOGRAM_COLUMNS, formats)
+        atexit.register(histogram_sink.close)
+    
+    # Probe the path and perform the benchmark tests
+    # Note: s_timer is run by the process supervisor, which drains its output continuously
+    supervisor = ProcessSupervisor()
+    records_dir = tempfile.mkdtemp(prefix="pqtls-records-")
+    atexit.register(shutil.rmtree, records_dir, True)
+    asyncio.run(run_benchmarks(dest_ip))
     
-    print('\033[1;32mSUCCESS:\tResults were stored in "{}". Finished.\033[0m'.format(results_file_name), file=sys.stdout)
+    results_sink.close()
+    usage_sink.close()
+    if prober is not None:
+        path_sink.close()
+        path_rtt, path_loss, path_samples = prober.summary()
+        print('\033[1;34mINFO:\t\tPath to "{}": median RTT {:.3f}ms, {:.2f}% packet loss ({} probes).\033[0m'.format(dest_ip, path_rtt, path_loss, path_samples), file=sys.stdout)
+    if concurrency_values:
+        load_sink.close()
+        histogram_sink.close()
+    print('\033[1;32mSUCCESS:\tResults were stored in {}. Finished.\033[0m'.format(" and ".join('"{}.{}"'.format(results_file_name, extension) for extension in formats)), file=sys.stdout)
     sys.exit(0)
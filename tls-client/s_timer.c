@@ -23,6 +23,14 @@
 #include <stdbool.h>
 #include <argp.h>
 #include <time.h>
+#include <stdint.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <inttypes.h>
+#include <pthread.h>
+#include <poll.h>
+#include <sys/resource.h>
 
 #include <openssl/ssl.h>
 #include <openssl/err.h>
@@ -30,12 +38,102 @@
 
 #define NS_IN_MS 1000000.0
 #define MS_IN_S 1000
+#define NS_IN_S 1000000000ULL
+
+// Binary round records (read by bench-lib/stimer_records.py), all fields in native (little endian) byte order
+#define RECORDS_MAGIC "STIMREC"
+#define RECORDS_VERSION 4
+
+// Handshake phases (--phases), timestamps taken in the info and message callbacks of OpenSSL
+enum phase {
+    PHASE_TCP_CONNECT,              // TCP connection established (separate connect before SSL_connect)
+    PHASE_CLIENT_HELLO,             // ClientHello sent
+    PHASE_SERVER_HELLO,             // ServerHello received
+    PHASE_SERVER_CERTIFICATE,       // Server Certificate received
+    PHASE_SERVER_CERT_VERIFY,       // Server CertificateVerify received (server chain verified)
+    PHASE_SERVER_FINISHED,          // Server Finished received (CertificateVerify signature verified)
+    PHASE_CLIENT_CERTIFICATE,       // Client Certificate sent
+    PHASE_CLIENT_CERT_VERIFY,       // Client CertificateVerify sent (signed)
+    PHASE_CLIENT_FINISHED,          // Client Finished sent
+    PHASE_HANDSHAKE_DONE,           // Handshake done (info callback)
+    PHASE_COUNT
+};
+
+// Handshake modes (--mode), in the order of MODES in bench-lib/stimer_records.py
+enum handshake_mode {
+    MODE_FULL,          // Full handshake with certificates in every round
+    MODE_RESUME,        // Resumption with the session ticket of the previous round (PSK, no certificates)
+    MODE_EARLY_DATA,    // Resumption sending EARLY_DATA as 0-RTT data
+    MODE_COUNT
+};
+
+static const char *mode_names[MODE_COUNT] = { "full", "resume", "early-data" };
+
+// Request sent as early data, read by s_server if it was started with -early_data
+#define EARLY_DATA "GET / HTTP/1.1\r\n\r\n"
+
+// Default key exchange groups (--groups) and TLS 1.3 cipher suites (--ciphersuites), colon-separated lists as in OpenSSL
+#define DEFAULT_GROUPS "x25519_kyber768"
+#define DEFAULT_CIPHERSUITES "TLS_AES_256_GCM_SHA384"
+
+// Session tickets arrive after the handshake, they are read for at most TICKET_READS records or TICKET_TIMEOUT seconds
+#define TICKET_READS 4
+#define TICKET_TIMEOUT 1
+
+struct records_header {
+    char magic[8];
+    uint32_t version;
+    uint32_t record_size;
+};
+
+// One record per round, written as soon as the round finished (no padding, 128 bytes)
+struct round_record {
+    uint64_t round;         // Index of the round in this run, starting at 0
+    uint64_t start_ns;      // CLOCK_MONOTONIC_RAW before the handshake
+    uint64_t end_ns;        // CLOCK_MONOTONIC_RAW after the handshake
+    double duration_ms;     // Handshake duration, 0.0 if unsuccessful
+    uint32_t status;        // 1 if the handshake was successful, otherwise 0
+    uint16_t mode;          // Handshake mode of the round (enum handshake_mode)
+    uint8_t resumed;        // 1 if the server resumed the session
+    uint8_t early_data;     // 1 if the server accepted the early data
+    uint64_t phase_ns[PHASE_COUNT];     // CLOCK_MONOTONIC_RAW of each phase, 0 if not reached or not measured
+    uint64_t scheduled_ns;  // CLOCK_MONOTONIC_RAW of the scheduled arrival (--arrival-rate), otherwise 0
+};
+
+// Load mode (--concurrency): histogram of the handshake latencies with 4 log-spaced buckets per doubling
+#define HISTOGRAM_BUCKETS 80
+#define HISTOGRAM_MIN_MS 0.1
+#define HISTOGRAM_STEP 1.189207115002721    // 2^(1/4)
+#define DEFAULT_LOAD_DURATION 10
+
+struct load_state {
+    uint64_t start_ns;      // Start of the measurement, the first arrival of an open loop
+    uint64_t end_ns;        // No handshakes are started after this time
+    uint64_t next_ticket;   // Index of the next handshake
+    uint64_t last_ns;       // End of the last handshake
+    uint64_t handshakes;    // Successful handshakes
+    uint64_t failures;
+    uint64_t dropped;       // Arrivals of an open loop which could not be started before the end
+    double max_ms;
+    double bounds_ms[HISTOGRAM_BUCKETS];    // Upper bound of each bucket, the last bucket also takes all larger latencies
+    uint64_t histogram[HISTOGRAM_BUCKETS];
+    int records_fd;
+    bool error;
+    pthread_mutex_t lock;   // Protects the counters, the histogram and the records output
+};
+
+struct load_worker {
+    struct load_state *state;
+    SSL_CTX *ssl_ctx;       // Every worker has its own SSL_CTX, the workers do not share any OpenSSL state
+    SSL_SESSION *session;   // Session resumed by the next handshake of the worker (--mode resume and early-data)
+    pthread_t thread;
+};
 
 // Command Line Argument Parser
 const char *argp_program_version = "s_timer-0.0.1";
 const char *argp_program_bug_address = "joshua.drexel@stud.hslu.ch";
 static char doc[] = "This is an adaption of the OpenSSL s_time program. This program performs an mTLS handshake and measures the time it takes to complete the handshake.";
-static char args_doc[] = "-h HOST:PORT -r ROUNDS --config=PATH --rootcert=PATH --chaincert=PATH --cert=PATH --key=PATH";
+static char args_doc[] = "-h HOST:PORT -r ROUNDS --config=PATH --rootcert=PATH --chaincert=PATH --cert=PATH --key=PATH [--records=PATH | --records-fd=FD] [--phases] [--mode=full|resume|early-data] [--groups=LIST] [--ciphersuites=LIST] [--rusage] [--concurrency=INT [--arrival-rate=FLOAT] [--duration=INT]]";
 static struct argp_option options[] = { 
     { "host", 'h', "IP:PORT", 0, "Destination host IP address and Port." },
     { "rounds", 'r', "INT", 0, "Number of rounds the test should be repeated." },
@@ -44,6 +142,16 @@ static struct argp_option options[] = {
     { "chaincert", 3, "PATH", 0, "Path to the Intermediate-CA certificate." },
     { "cert", 4, "PATH", 0, "Path to the client certificate." },
     { "key", 5, "PATH", 0, "Path to the client key." },
+    { "records", 6, "PATH", 0, "Write a binary record per round to this file instead of printing the results at the end." },
+    { "records-fd", 7, "FD", 0, "Write a binary record per round to this inherited file descriptor instead of printing the results at the end." },
+    { "phases", 8, 0, 0, "Record the timestamps of the handshake phases (only with --records or --records-fd)." },
+    { "concurrency", 9, "INT", 0, "Load mode: Run handshakes from this many worker threads for --duration seconds (--rounds is ignored) and print throughput and latency histogram." },
+    { "arrival-rate", 10, "FLOAT", 0, "Load mode: Start handshakes at this fixed rate per second (open loop), 0 starts the next handshake as soon as a worker is free (closed loop)." },
+    { "duration", 11, "INT", 0, "Load mode: Duration of the measurement in seconds, default is 10." },
+    { "rusage", 13, 0, 0, "Print the resource usage of s_timer (CPU time, context switches, peak RSS) at the end." },
+    { "mode", 12, "MODE", 0, "Handshake mode: full (default), resume (session ticket of the previous handshake) or early-data (resumption with 0-RTT data)." },
+    { "groups", 14, "LIST", 0, "Key exchange groups offered in the ClientHello (colon-separated, the first one gets a key share), default is " DEFAULT_GROUPS "." },
+    { "ciphersuites", 15, "LIST", 0, "TLS 1.3 cipher suites offered (colon-separated), default is " DEFAULT_CIPHERSUITES "." },
     { 0 } 
 };
 
@@ -55,6 +163,16 @@ struct arguments{
     char *ica_cert;
     char *client_cert;
     char *client_key;
+    char *records_file;
+    int records_fd;
+    bool phases;
+    size_t concurrency;
+    double arrival_rate;
+    size_t duration;
+    enum handshake_mode mode;
+    bool rusage;
+    char *groups;
+    char *ciphersuites;
 };
 
 static struct arguments arguments;
@@ -85,6 +203,43 @@ static error_t parse_opt(int key, char *arg, struct argp_state *state){
         case 5:
             arguments->client_key = arg;
             break;
+        case 6:
+            arguments->records_file = arg;
+            break;
+        case 7:
+            arguments->records_fd = atoi(arg);
+            break;
+        case 8:
+            arguments->phases = true;
+            break;
+        case 9:
+            arguments->concurrency = atoi(arg);
+            break;
+        case 10:
+            arguments->arrival_rate = atof(arg);
+            break;
+        case 11:
+            arguments->duration = atoi(arg);
+            break;
+        case 12:
+            for (int mode = 0; mode <= MODE_COUNT; mode++) {
+                if (mode == MODE_COUNT) {
+                    argp_error(state, "Unknown mode: %s", arg);
+                } else if (strcmp(arg, mode_names[mode]) == 0) {
+                    arguments->mode = mode;
+                    break;
+                }
+            }
+            break;
+        case 13:
+            arguments->rusage = true;
+            break;
+        case 14:
+            arguments->groups = arg;
+            break;
+        case 15:
+            arguments->ciphersuites = arg;
+            break;
 
         default:
             return ARGP_ERR_UNKNOWN;
@@ -107,9 +262,197 @@ int loadOQSProvider(const char *providerPath) {
     return 0;
 }
 
+// Write the complete buffer, as records must not be split by short writes
+int write_all(int fd, const void *buffer, size_t length) {
+    const char *data = buffer;
+    while (length > 0) {
+        ssize_t written = write(fd, data, length);
+        if (written < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            return 1;
+        }
+        data += written;
+        length -= written;
+    }
+
+    return 0;
+}
+
+uint64_t timespec_ns(const struct timespec *time) {
+    return (uint64_t)time->tv_sec * NS_IN_S + (uint64_t)time->tv_nsec;
+}
+
+uint64_t now_ns(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC_RAW, &now);
+    return timespec_ns(&now);
+}
+
+// Phase timestamps of the current round, only the first occurrence of a phase is kept
+// Note: Thread-local, as the workers of the load mode run their handshakes concurrently
+static _Thread_local uint64_t phase_ns[PHASE_COUNT];
+
+void mark_phase(enum phase phase) {
+    struct timespec now;
+    if (phase_ns[phase] == 0) {
+        clock_gettime(CLOCK_MONOTONIC_RAW, &now);
+        phase_ns[phase] = timespec_ns(&now);
+    }
+}
+
+// Called by OpenSSL for every protocol message sent (write_p = 1) or received (write_p = 0)
+void phase_msg_callback(int write_p, int version, int content_type, const void *buf, size_t len, SSL *ssl, void *arg) {
+    (void)version;
+    (void)ssl;
+    (void)arg;
+
+    if (content_type != SSL3_RT_HANDSHAKE || len == 0) {
+        return;
+    }
+
+    switch (((const unsigned char *)buf)[0]) {
+        case SSL3_MT_CLIENT_HELLO:
+            if (write_p) mark_phase(PHASE_CLIENT_HELLO);
+            break;
+        case SSL3_MT_SERVER_HELLO:
+            if (!write_p) mark_phase(PHASE_SERVER_HELLO);
+            break;
+        case SSL3_MT_CERTIFICATE:
+            mark_phase(write_p ? PHASE_CLIENT_CERTIFICATE : PHASE_SERVER_CERTIFICATE);
+            break;
+        case SSL3_MT_CERTIFICATE_VERIFY:
+            mark_phase(write_p ? PHASE_CLIENT_CERT_VERIFY : PHASE_SERVER_CERT_VERIFY);
+            break;
+        case SSL3_MT_FINISHED:
+            mark_phase(write_p ? PHASE_CLIENT_FINISHED : PHASE_SERVER_FINISHED);
+            break;
+    }
+}
+
+void phase_info_callback(const SSL *ssl, int where, int ret) {
+    (void)ssl;
+    (void)ret;
+
+    if (where & SSL_CB_HANDSHAKE_DONE) {
+        // With early data, OpenSSL also reports the handshake as done once the early data was written, the last report is kept
+        phase_ns[PHASE_HANDSHAKE_DONE] = 0;
+        mark_phase(PHASE_HANDSHAKE_DONE);
+    }
+}
+
+// Session of the last NewSessionTicket received by this thread, taken by read_session
+static _Thread_local SSL_SESSION* ticket_session;
+
+int new_session_callback(SSL *ssl, SSL_SESSION *session) {
+    (void)ssl;
+
+    SSL_SESSION_free(ticket_session);
+    ticket_session = session;
+    // The reference to the session is kept
+    return 1;
+}
+
+// Set up a client SSL_CTX with the TLS 1.3 parameters (--groups, --ciphersuites) and the client certificate, NULL on error
+SSL_CTX* create_ssl_ctx(void)
+{
+    SSL_CTX* ssl_ctx = SSL_CTX_new(TLS_client_method());
+    if (!ssl_ctx)
+    {
+        return NULL;
+    }
+
+    SSL_CTX_set_mode(ssl_ctx, SSL_MODE_AUTO_RETRY);
+    SSL_CTX_set_quiet_shutdown(ssl_ctx, 1);
+
+    if (SSL_CTX_set_min_proto_version(ssl_ctx, TLS1_3_VERSION) != 1)
+    {
+        goto error;
+    }
+
+    if (SSL_CTX_set_max_proto_version(ssl_ctx, TLS1_3_VERSION) != 1)
+    {
+        goto error;
+    }
+
+    SSL_CTX_set_options(ssl_ctx, SSL_OP_NO_COMPRESSION);
+
+    if (SSL_CTX_set_ciphersuites(ssl_ctx, arguments.ciphersuites) != 1)
+    {
+        goto error;
+    }
+    
+    if (SSL_CTX_set1_groups_list(ssl_ctx, arguments.groups) != 1)
+    {
+        goto error;
+    }
+
+    // Load CA certificate as trust anchor
+    if (SSL_CTX_load_verify_locations(ssl_ctx, arguments.ca_cert, 0) <= 0)
+    {
+        goto error;
+    }
+    
+    // Load the intermediate CA certificate
+    X509 *intermediate_cert = NULL;
+    FILE *intermediate_file = fopen(arguments.ica_cert, "r");
+    if (intermediate_file) {
+        intermediate_cert = PEM_read_X509(intermediate_file, NULL, NULL, NULL);
+        fclose(intermediate_file);
+    }
+
+    if (!intermediate_cert) {
+        fprintf(stderr, "Error loading intermediate CA certificate.\n");
+        goto error;
+    }
+
+    // Add the intermediate CA certificate to the chain
+    if (SSL_CTX_add_extra_chain_cert(ssl_ctx, intermediate_cert) <= 0) {
+        fprintf(stderr, "Error adding intermediate CA certificate to the chain.\n");
+        X509_free(intermediate_cert);
+        goto error;
+    }
+    
+    // Load the client certificate and key
+    if (SSL_CTX_use_certificate_file(ssl_ctx, arguments.client_cert, SSL_FILETYPE_PEM) <= 0) {
+        goto error;
+    }
+    
+    if (SSL_CTX_use_PrivateKey_file(ssl_ctx, arguments.client_key, SSL_FILETYPE_PEM) <= 0) {
+        goto error;
+    }
+
+    // Check if the private key matches the certificate
+    if (!SSL_CTX_check_private_key(ssl_ctx)) {
+        fprintf(stderr, "Private key does not match the certificate.\n");
+        goto error;
+    }
+    
+    SSL_CTX_set_verify(ssl_ctx, SSL_VERIFY_PEER, NULL);
+    
+    // The phase callbacks are only installed if requested, as they run inside the measured handshake
+    if (arguments.phases) {
+        SSL_CTX_set_msg_callback(ssl_ctx, phase_msg_callback);
+        SSL_CTX_set_info_callback(ssl_ctx, phase_info_callback);
+    }
+    
+    // Resumption modes: Every session ticket is passed to new_session_callback
+    if (arguments.mode != MODE_FULL) {
+        SSL_CTX_set_session_cache_mode(ssl_ctx, SSL_SESS_CACHE_CLIENT | SSL_SESS_CACHE_NO_INTERNAL_STORE);
+        SSL_CTX_sess_set_new_cb(ssl_ctx, new_session_callback);
+    }
+
+    return ssl_ctx;
+
+error:
+    SSL_CTX_free(ssl_ctx);
+    return NULL;
+}
+
 // This is the function for which the time is measured, 
 // therefore keep it as clean as possible
-SSL* do_tls_handshake(SSL_CTX* ssl_ctx)
+SSL* do_tls_handshake(SSL_CTX* ssl_ctx, SSL_SESSION* session)
 {
     BIO* conn;
     SSL* ssl;
@@ -123,11 +466,39 @@ SSL* do_tls_handshake(SSL_CTX* ssl_ctx)
     
     BIO_set_conn_hostname(conn, arguments.host_name);
     BIO_set_conn_mode(conn, BIO_SOCK_NODELAY);
+    
+    // With phases, the TCP connection is established before SSL_connect to get its own timestamp
+    if (arguments.phases)
+    {
+        if (BIO_do_connect(conn) <= 0)
+        {
+            ERR_print_errors_fp(stderr);
+            BIO_free(conn);
+            return 0;
+        }
+        mark_phase(PHASE_TCP_CONNECT);
+    }
 
     ssl = SSL_new(ssl_ctx);
 
     SSL_set_bio(ssl, conn, conn);
 
+    // Resumption: The session of a previous handshake is offered to the server
+    if (session)
+    {
+        SSL_set_session(ssl, session);
+        if (arguments.mode == MODE_EARLY_DATA && SSL_SESSION_get_max_early_data(session) > 0)
+        {
+            size_t written;
+            if (!SSL_write_early_data(ssl, EARLY_DATA, strlen(EARLY_DATA), &written))
+            {
+                ERR_print_errors_fp(stderr);
+                SSL_free(ssl);
+                return 0;
+            }
+        }
+    }
+
     /* ok, lets connect */
     ret = SSL_connect(ssl);
     if (ret <= 0)
@@ -151,6 +522,282 @@ SSL* do_tls_handshake(SSL_CTX* ssl_ctx)
     return ssl;
 }
 
+// Close a connection after the handshake without TLS shutdown, returns -1 if the socket could not be closed
+int close_connection(SSL* ssl)
+{
+    int ret;
+
+    SSL_set_shutdown(ssl, SSL_SENT_SHUTDOWN | SSL_RECEIVED_SHUTDOWN);
+    // The connect BIO must not close the socket again, in load mode another worker may already have reused its number
+    BIO_set_close(SSL_get_rbio(ssl), BIO_NOCLOSE);
+    ret = BIO_closesocket(SSL_get_fd(ssl));
+    SSL_free(ssl);
+    return ret;
+}
+
+// Read the session tickets the server sends after the handshake (not measured), returns the session of a new ticket or NULL
+// Note: A ticket is only used once, as a server with early data enabled rejects tickets which were used before (anti-replay)
+SSL_SESSION* read_session(SSL* ssl)
+{
+    char buffer[256];
+    struct pollfd socket_poll = { .fd = SSL_get_fd(ssl), .events = POLLIN };
+    SSL_SESSION* session = NULL;
+
+    // Without auto retry, SSL_read returns after each record which is not application data (e.g. a NewSessionTicket)
+    SSL_clear_mode(ssl, SSL_MODE_AUTO_RETRY);
+    for (int i = 0; i <= TICKET_READS; i++)
+    {
+        if (ticket_session)
+        {
+            session = ticket_session;
+            ticket_session = NULL;
+            return session;
+        }
+
+        if (i == TICKET_READS || poll(&socket_poll, 1, TICKET_TIMEOUT * MS_IN_S) <= 0)
+        {
+            break;
+        }
+        if (SSL_read(ssl, buffer, sizeof(buffer)) <= 0 && !SSL_want_read(ssl))
+        {
+            break;
+        }
+    }
+
+    ERR_clear_error();
+    return NULL;
+}
+
+// Full handshake which is not measured, its session is resumed by the first round
+SSL_SESSION* establish_session(SSL_CTX* ssl_ctx)
+{
+    SSL_SESSION* session = NULL;
+    SSL* ssl = do_tls_handshake(ssl_ctx, NULL);
+
+    if (ssl)
+    {
+        session = read_session(ssl);
+        close_connection(ssl);
+    }
+    if (!session)
+    {
+        fprintf(stderr, "Error establishing a session for resumption.\n");
+    }
+    return session;
+}
+
+// Replace the session with the one of the given connection, so every round resumes with a fresh ticket
+void update_session(SSL* ssl, SSL_SESSION** session)
+{
+    SSL_SESSION* next = read_session(ssl);
+
+    if (next)
+    {
+        SSL_SESSION_free(*session);
+        *session = next;
+    }
+}
+
+// Resource usage of the whole process (all threads), read by bench-lib/process_stats.py
+void print_rusage(void)
+{
+    struct rusage usage;
+
+    if (getrusage(RUSAGE_SELF, &usage) != 0)
+    {
+        return;
+    }
+    printf("rusage:user_s=%ld.%06ld,system_s=%ld.%06ld,voluntary_switches=%ld,involuntary_switches=%ld,peak_rss_kb=%ld\n",
+           (long)usage.ru_utime.tv_sec, (long)usage.ru_utime.tv_usec, (long)usage.ru_stime.tv_sec, (long)usage.ru_stime.tv_usec,
+           usage.ru_nvcsw, usage.ru_nivcsw, usage.ru_maxrss);
+}
+
+// Sleep until the given CLOCK_MONOTONIC_RAW time (which clock_nanosleep does not support)
+void sleep_until_ns(uint64_t target_ns) {
+    uint64_t now;
+    while ((now = now_ns()) < target_ns) {
+        struct timespec wait = { (target_ns - now) / NS_IN_S, (target_ns - now) % NS_IN_S };
+        nanosleep(&wait, NULL);
+    }
+}
+
+void* run_load_worker(void* arg) {
+    struct load_worker *worker = arg;
+    struct load_state *state = worker->state;
+
+    while (1) {
+        uint64_t ticket, scheduled_ns = 0, start_ns, end_ns;
+        bool success;
+
+        pthread_mutex_lock(&state->lock);
+        ticket = state->next_ticket++;
+        bool stop = state->error;
+        pthread_mutex_unlock(&state->lock);
+        if (stop) {
+            break;
+        }
+
+        if (arguments.arrival_rate > 0) {
+            // Open loop: The handshakes arrive at a fixed rate, independent of how fast the previous ones completed
+            scheduled_ns = state->start_ns + (uint64_t)(ticket * (NS_IN_S / arguments.arrival_rate));
+            if (scheduled_ns >= state->end_ns) {
+                break;
+            }
+            if (now_ns() >= state->end_ns) {
+                // All workers were busy until the end, the arrival is not served anymore
+                pthread_mutex_lock(&state->lock);
+                state->dropped++;
+                pthread_mutex_unlock(&state->lock);
+                continue;
+            }
+            sleep_until_ns(scheduled_ns);
+        } else if (now_ns() >= state->end_ns) {
+            break;
+        }
+
+        memset(phase_ns, 0, sizeof(phase_ns));
+        start_ns = now_ns();
+        SSL* ssl = do_tls_handshake(worker->ssl_ctx, worker->session);
+        end_ns = now_ns();
+        success = ssl != NULL;
+        bool resumed = ssl && SSL_session_reused(ssl);
+        bool early_data = ssl && SSL_get_early_data_status(ssl) == SSL_EARLY_DATA_ACCEPTED;
+        if (ssl && arguments.mode != MODE_FULL) {
+            update_session(ssl, &worker->session);
+        }
+        if (ssl && close_connection(ssl) == -1) {
+            fprintf(stderr, "Unrecoverable OpenSSL error.\n");
+            ERR_print_errors_fp(stderr);
+            pthread_mutex_lock(&state->lock);
+            state->error = true;
+            pthread_mutex_unlock(&state->lock);
+            break;
+        }
+
+        // The latency of an open loop is taken from the scheduled arrival, so a handshake waiting for a free worker is not hidden
+        double duration_ms = success ? (end_ns - start_ns) / NS_IN_MS : 0.0;
+        double latency_ms = (end_ns - (scheduled_ns ? scheduled_ns : start_ns)) / NS_IN_MS;
+        struct round_record record = { ticket, start_ns, end_ns, duration_ms, success, arguments.mode, resumed, early_data, { 0 }, scheduled_ns };
+        memcpy(record.phase_ns, phase_ns, sizeof(phase_ns));
+
+        pthread_mutex_lock(&state->lock);
+        if (success) {
+            size_t bucket = 0;
+            while (bucket < HISTOGRAM_BUCKETS - 1 && latency_ms > state->bounds_ms[bucket]) {
+                bucket++;
+            }
+            state->histogram[bucket]++;
+            state->handshakes++;
+            if (latency_ms > state->max_ms) {
+                state->max_ms = latency_ms;
+            }
+        } else {
+            state->failures++;
+        }
+        if (end_ns > state->last_ns) {
+            state->last_ns = end_ns;
+        }
+        if (state->records_fd >= 0 && write_all(state->records_fd, &record, sizeof(record)) != 0) {
+            fprintf(stderr, "Error writing round record.\n");
+            state->error = true;
+        }
+        pthread_mutex_unlock(&state->lock);
+    }
+
+    return NULL;
+}
+
+// Upper bound of the bucket in which the given share of the successful handshakes is reached
+double histogram_percentile(const struct load_state *state, double share) {
+    uint64_t count = 0;
+    for (size_t i = 0; i < HISTOGRAM_BUCKETS - 1; i++) {
+        count += state->histogram[i];
+        if (count >= share * state->handshakes) {
+            return state->bounds_ms[i] < state->max_ms ? state->bounds_ms[i] : state->max_ms;
+        }
+    }
+    return state->max_ms;
+}
+
+// Load mode: Handshakes are run from --concurrency worker threads for --duration seconds
+int run_load(int records_fd) {
+    int ret = -1;
+    size_t started = 0;
+    struct load_state state;
+    struct load_worker *workers = calloc(arguments.concurrency, sizeof(*workers));
+
+    memset(&state, 0, sizeof(state));
+    state.records_fd = records_fd;
+    pthread_mutex_init(&state.lock, NULL);
+    state.bounds_ms[0] = HISTOGRAM_MIN_MS;
+    for (size_t i = 1; i < HISTOGRAM_BUCKETS; i++) {
+        state.bounds_ms[i] = state.bounds_ms[i - 1] * HISTOGRAM_STEP;
+    }
+
+    // The SSL_CTX of the workers are set up before the measurement starts
+    for (size_t i = 0; i < arguments.concurrency; i++) {
+        workers[i].state = &state;
+        workers[i].ssl_ctx = create_ssl_ctx();
+        if (!workers[i].ssl_ctx) {
+            fprintf(stderr, "Unrecoverable OpenSSL error.\n");
+            ERR_print_errors_fp(stderr);
+            goto end;
+        }
+        if (arguments.mode != MODE_FULL) {
+            workers[i].session = establish_session(workers[i].ssl_ctx);
+            if (!workers[i].session) {
+                goto end;
+            }
+        }
+    }
+
+    state.start_ns = now_ns();
+    state.end_ns = state.start_ns + arguments.duration * NS_IN_S;
+    for (started = 0; started < arguments.concurrency; started++) {
+        if (pthread_create(&workers[started].thread, NULL, run_load_worker, &workers[started]) != 0) {
+            fprintf(stderr, "Error starting worker thread.\n");
+            pthread_mutex_lock(&state.lock);
+            state.error = true;
+            pthread_mutex_unlock(&state.lock);
+            break;
+        }
+    }
+    for (size_t i = 0; i < started; i++) {
+        pthread_join(workers[i].thread, NULL);
+    }
+    if (state.error) {
+        goto end;
+    }
+
+    // Throughput over the time from the start until the last handshake finished
+    double elapsed_s = state.last_ns > state.start_ns ? (state.last_ns - state.start_ns) / (double)NS_IN_S : 0.0;
+    printf("load:concurrency=%zu,arrival_rate=%f,duration_s=%f,handshakes=%" PRIu64 ",failures=%" PRIu64 ",dropped=%" PRIu64 ",throughput=%f,p50_ms=%f,p90_ms=%f,p99_ms=%f,max_ms=%f\n",
+           arguments.concurrency, arguments.arrival_rate, elapsed_s, state.handshakes, state.failures, state.dropped,
+           elapsed_s > 0 ? state.handshakes / elapsed_s : 0.0,
+           histogram_percentile(&state, 0.5), histogram_percentile(&state, 0.9), histogram_percentile(&state, 0.99), state.max_ms);
+
+    // Histogram of the latencies of the successful handshakes as upper bound in ms and count, the last bucket is unbounded
+    printf("histogram:");
+    for (size_t i = 0; i < HISTOGRAM_BUCKETS; i++) {
+        if (i == HISTOGRAM_BUCKETS - 1) {
+            printf("inf:%" PRIu64 "\n", state.histogram[i]);
+        } else {
+            printf("%f:%" PRIu64 ",", state.bounds_ms[i], state.histogram[i]);
+        }
+    }
+
+    ret = 0;
+
+end:
+    for (size_t i = 0; i < arguments.concurrency; i++) {
+        SSL_SESSION_free(workers[i].session);
+        SSL_CTX_free(workers[i].ssl_ctx);
+    }
+    free(workers);
+    pthread_mutex_destroy(&state.lock);
+    return ret;
+}
+
 int main(int argc, char *args[])
 {
     int ret = -1;
@@ -164,6 +811,16 @@ int main(int argc, char *args[])
     arguments.ica_cert = "";
     arguments.client_cert = "";
     arguments.client_key = "";
+    arguments.records_file = NULL;
+    arguments.records_fd = -1;
+    arguments.phases = false;
+    arguments.concurrency = 0;
+    arguments.arrival_rate = 0.0;
+    arguments.duration = DEFAULT_LOAD_DURATION;
+    arguments.mode = MODE_FULL;
+    arguments.rusage = false;
+    arguments.groups = DEFAULT_GROUPS;
+    arguments.ciphersuites = DEFAULT_CIPHERSUITES;
 
     // Parse the CLI arguments
     argp_parse(&argp, argc, args, 0, 0, &arguments);
@@ -171,108 +828,41 @@ int main(int argc, char *args[])
     // Counter for number of measurements taken (performed rounds)
     size_t measurements = 0;
     
-    // Fix cipher suite
-    const char* ciphersuites = "TLS_AES_256_GCM_SHA384";
-    
-    // Fix KEX mechanism
-    const char* kex = "x25519_kyber768";
-    
-    const SSL_METHOD* ssl_meth = TLS_client_method();
     SSL* ssl = NULL;
+    SSL_SESSION* session = NULL;
+    bool resumed, early_data;
 
     struct timespec start, finish;
     double* handshake_times_ms = malloc(arguments.rounds * sizeof(*handshake_times_ms));
     bool* conn_success = malloc(arguments.rounds * sizeof(*conn_success));
-
-    ssl_ctx = SSL_CTX_new(ssl_meth);
-    if (!ssl_ctx)
-    {
-        goto ossl_error;
-    }
     
-    // Print OpenSSL version and build information
-    printf("OpenSSL Version: %s\n", OpenSSL_version(OPENSSL_VERSION));
-
-    SSL_CTX_set_mode(ssl_ctx, SSL_MODE_AUTO_RETRY);
-    SSL_CTX_set_quiet_shutdown(ssl_ctx, 1);
-
-    ret = SSL_CTX_set_min_proto_version(ssl_ctx, TLS1_3_VERSION);
-    if (ret != 1)
-    {
-        goto ossl_error;
+    // Open the binary records output, each round is written as soon as it finished
+    // Note: If the process is killed (e.g. timeout), the records of all finished rounds are kept
+    int records_fd = arguments.records_fd;
+    if (arguments.records_file) {
+        records_fd = open(arguments.records_file, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+        if (records_fd < 0) {
+            fprintf(stderr, "Error opening records file %s.\n", arguments.records_file);
+            return ret;
+        }
     }
-
-    ret = SSL_CTX_set_max_proto_version(ssl_ctx, TLS1_3_VERSION);
-    if (ret != 1)
-    {
-        goto ossl_error;
+    if (records_fd >= 0) {
+        struct records_header header = { RECORDS_MAGIC, RECORDS_VERSION, sizeof(struct round_record) };
+        if (write_all(records_fd, &header, sizeof(header)) != 0) {
+            fprintf(stderr, "Error writing records header.\n");
+            return ret;
+        }
     }
 
-    SSL_CTX_set_options(ssl_ctx, SSL_OP_NO_COMPRESSION);
-
-    ret = SSL_CTX_set_ciphersuites(ssl_ctx, ciphersuites);
-    if (ret != 1)
-    {
-        goto ossl_error;
-    }
-    
-    ret = SSL_CTX_set1_groups_list(ssl_ctx, kex);
-    if (ret != 1)
-    {
-        goto ossl_error;
-    }
+    // Print OpenSSL version and build information
+    printf("OpenSSL Version: %s\n", OpenSSL_version(OPENSSL_VERSION));
 
-    // Load CA certificate as trust anchor
-    ret = SSL_CTX_load_verify_locations(ssl_ctx, arguments.ca_cert, 0);
-    if(ret <= 0)
+    ssl_ctx = create_ssl_ctx();
+    if (!ssl_ctx)
     {
         goto ossl_error;
     }
     
-    // Load the intermediate CA certificate
-    X509 *intermediate_cert = NULL;
-    FILE *intermediate_file = fopen(arguments.ica_cert, "r");
-    if (intermediate_file) {
-        intermediate_cert = PEM_read_X509(intermediate_file, NULL, NULL, NULL);
-        fclose(intermediate_file);
-    }
-
-    if (!intermediate_cert) {
-        fprintf(stderr, "Error loading intermediate CA certificate.\n");
-        SSL_CTX_free(ssl_ctx);
-        goto ossl_error;
-    }
-
-    // Add the intermediate CA certificate to the chain
-    if (SSL_CTX_add_extra_chain_cert(ssl_ctx, intermediate_cert) <= 0) {
-        fprintf(stderr, "Error adding intermediate CA certificate to the chain.\n");
-        X509_free(intermediate_cert);
-        SSL_CTX_free(ssl_ctx);
-        goto ossl_error;
-    }
-    
-    // Load the client certificate and key
-    if (SSL_CTX_use_certificate_file(ssl_ctx, arguments.client_cert, SSL_FILETYPE_PEM) <= 0) {
-        ERR_print_errors_fp(stderr);
-        SSL_CTX_free(ssl_ctx);
-        goto ossl_error;
-    }
-    
-    if (SSL_CTX_use_PrivateKey_file(ssl_ctx, arguments.client_key, SSL_FILETYPE_PEM) <= 0) {
-        ERR_print_errors_fp(stderr);
-        SSL_CTX_free(ssl_ctx);
-        goto ossl_error;
-    }
-
-    // Check if the private key matches the certificate
-    if (!SSL_CTX_check_private_key(ssl_ctx)) {
-        fprintf(stderr, "Private key does not match the certificate.\n");
-        SSL_CTX_free(ssl_ctx);
-        goto ossl_error;
-    }
-    
-    SSL_CTX_set_verify(ssl_ctx, SSL_VERIFY_PEER, NULL);
-    
     // Load OQS-Provider
     const char *providerPath = arguments.config_file;
     if (loadOQSProvider(providerPath) == 0) {
@@ -282,12 +872,33 @@ int main(int argc, char *args[])
         goto ossl_error;
     }
     
+    // In load mode, the summary is printed instead of the results per round
+    if (arguments.concurrency > 0) {
+        ret = run_load(records_fd);
+        if (ret == 0 && arguments.rusage) {
+            print_rusage();
+        }
+        goto end;
+    }
+    
+    // Resumption modes: The first session is set up by a handshake which is not measured
+    if (arguments.mode != MODE_FULL) {
+        session = establish_session(ssl_ctx);
+        if (!session) {
+            ret = -1;
+            goto end;
+        }
+    }
+    
 
     while(measurements < arguments.rounds)
     {
+        memset(phase_ns, 0, sizeof(phase_ns));
         clock_gettime(CLOCK_MONOTONIC_RAW, &start);
-        ssl = do_tls_handshake(ssl_ctx);
+        ssl = do_tls_handshake(ssl_ctx, session);
         clock_gettime(CLOCK_MONOTONIC_RAW, &finish);
+        resumed = false;
+        early_data = false;
         if (!ssl) { 
         // Handshake unsuccessful
             conn_success[measurements] = false;
@@ -297,15 +908,29 @@ int main(int argc, char *args[])
         // Handshake successful
             conn_success[measurements] = true;
             handshake_times_ms[measurements] = ((finish.tv_sec - start.tv_sec) * MS_IN_S) + ((finish.tv_nsec - start.tv_nsec) / NS_IN_MS);
+            resumed = SSL_session_reused(ssl);
+            early_data = SSL_get_early_data_status(ssl) == SSL_EARLY_DATA_ACCEPTED;
+            
+            // The next round resumes with the session tickets of this handshake (not measured)
+            if (arguments.mode != MODE_FULL) {
+                update_session(ssl, &session);
+            }
             
-            SSL_set_shutdown(ssl, SSL_SENT_SHUTDOWN | SSL_RECEIVED_SHUTDOWN);
-            ret = BIO_closesocket(SSL_get_fd(ssl));
+            ret = close_connection(ssl);
             if(ret == -1)
             {
                 goto ossl_error;
             }
-
-            SSL_free(ssl);
+        }
+        
+        if (records_fd >= 0) {
+            struct round_record record = { measurements, timespec_ns(&start), timespec_ns(&finish), handshake_times_ms[measurements], conn_success[measurements], arguments.mode, resumed, early_data, { 0 }, 0 };
+            memcpy(record.phase_ns, phase_ns, sizeof(phase_ns));
+            if (write_all(records_fd, &record, sizeof(record)) != 0) {
+                fprintf(stderr, "Error writing round record.\n");
+                ret = -1;
+                goto end;
+            }
         }
         
         // Go to next test round
@@ -313,11 +938,21 @@ int main(int argc, char *args[])
         measurements++;
     }
 
-    for(size_t i = 0; i < measurements - 1; i++)
-    {
-        printf("%f:%i,", handshake_times_ms[i], conn_success[i]);
+    // Results were written as records already
+    if (records_fd < 0) {
+        for(size_t i = 0; i < measurements - 1; i++)
+        {
+            printf("%f:%i,", handshake_times_ms[i], conn_success[i]);
+        }
+        printf("%f:%i", handshake_times_ms[measurements - 1], conn_success[measurements -1]);
+        if (arguments.rusage) {
+            printf("\n");
+        }
+    }
+    
+    if (arguments.rusage) {
+        print_rusage();
     }
-    printf("%f:%i", handshake_times_ms[measurements - 1], conn_success[measurements -1]);
 
     ret = 0;
     goto end;
@@ -326,6 +961,7 @@ ossl_error:
     fprintf(stderr, "Unrecoverable OpenSSL error.\n");
     ERR_print_errors_fp(stderr);
 end:
+    SSL_SESSION_free(session);
     SSL_CTX_free(ssl_ctx);
     return ret;
 }
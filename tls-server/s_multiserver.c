@@ -0,0 +1,482 @@
+/*
+ * Multi-algorithm benchmark server for the real network assessment.
+ *
+ * One process serves the certificate chains of all signature algorithms of the port mapping
+ * (info_alg-port-mapping.txt): Every algorithm gets its own SSL_CTX and listening port, a pool
+ * of worker threads accepts the connections of all ports and performs the mTLS handshakes.
+ * The TLS parameters are the ones of the former s_server fleet (TLS 1.3 only, client
+ * certificate verified with the CA of the algorithm, optional 0-RTT data).
+ *
+ * Written for the Master's Thesis by Joshua Drexel, Lucerne University of Applied Sciences and Arts.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdbool.h>
+#include <argp.h>
+#include <errno.h>
+#include <signal.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <poll.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/socket.h>
+#include <sys/time.h>
+
+#include <openssl/ssl.h>
+#include <openssl/err.h>
+#include <openssl/conf.h>
+
+// Default key exchange groups (--groups) and TLS 1.3 cipher suites (--ciphersuites), as accepted by the s_server fleet
+#define DEFAULT_GROUPS "x25519_kyber768:x25519:kyber512:kyber768:kyber1024:p256_kyber512:p384_kyber768:p521_kyber1024"
+#define DEFAULT_CIPHERSUITES "TLS_AES_256_GCM_SHA384:TLS_AES_128_GCM_SHA256:TLS_CHACHA20_POLY1305_SHA256"
+
+#define MAX_ALGORITHMS 64
+#define MAX_NAME_LENGTH 128
+#define MAX_PATH_LENGTH 512
+#define LISTEN_BACKLOG 1024
+// Early data accepted per connection (--early-data), s_server's default
+#define MAX_EARLY_DATA 16384
+// A connection is closed if the client does not send anything for this many seconds (stalled handshakes keep no worker busy)
+#define IDLE_TIMEOUT 10
+// Handshakes wait for the round trips to the client, so there are more workers than cores
+#define WORKERS_PER_CPU 4
+
+struct algorithm {
+    char name[MAX_NAME_LENGTH];     // Signature algorithm as in the port mapping (e.g. RSA:3072)
+    char pki_name[MAX_NAME_LENGTH]; // Name of the PKI directory (pki-<name> without colons, e.g. pki-RSA3072)
+    int port;
+    int listen_fd;
+    SSL_CTX *ssl_ctx;
+};
+
+static struct algorithm algorithms[MAX_ALGORITHMS];
+static size_t algorithm_count = 0;
+
+// Command Line Argument Parser
+const char *argp_program_version = "s_multiserver-0.0.1";
+const char *argp_program_bug_address = "joshua.drexel@stud.hslu.ch";
+static char doc[] = "This program serves the mTLS handshakes of all signature algorithms of a port mapping from one process, with a pool of worker threads shared by all ports.";
+static char args_doc[] = "--mapping=PATH --pki=PATH [--config=PATH] [--threads=INT] [--early-data] [--groups=LIST] [--ciphersuites=LIST]";
+static struct argp_option options[] = {
+    { "mapping", 1, "PATH", 0, "Path to the port mapping (one ALGORITHM,PORT per line, e.g. info_alg-port-mapping.txt)." },
+    { "pki", 2, "PATH", 0, "Path to the directory with the PKI of each algorithm (pki-<algorithm>/ca, ica and server)." },
+    { "config", 3, "PATH", 0, "Path to openssl config file that has the oqs-provider enabled, default is the config of the OpenSSL installation." },
+    { "threads", 4, "INT", 0, "Number of worker threads, default is 4 per online CPU." },
+    { "early-data", 5, 0, 0, "Accept 0-RTT data of resumed sessions." },
+    { "groups", 6, "LIST", 0, "Key exchange groups accepted (colon-separated), default is " DEFAULT_GROUPS "." },
+    { "ciphersuites", 7, "LIST", 0, "TLS 1.3 cipher suites accepted (colon-separated), default is " DEFAULT_CIPHERSUITES "." },
+    { 0 }
+};
+
+struct arguments{
+    char *mapping_file;
+    char *pki_dir;
+    char *config_file;
+    size_t threads;
+    bool early_data;
+    char *groups;
+    char *ciphersuites;
+};
+
+static struct arguments arguments;
+
+static error_t parse_opt(int key, char *arg, struct argp_state *state){
+
+    struct arguments *arguments = state->input;
+    switch(key){
+
+        case 1:
+            arguments->mapping_file = arg;
+            break;
+        case 2:
+            arguments->pki_dir = arg;
+            break;
+        case 3:
+            arguments->config_file = arg;
+            break;
+        case 4:
+            arguments->threads = atoi(arg);
+            break;
+        case 5:
+            arguments->early_data = true;
+            break;
+        case 6:
+            arguments->groups = arg;
+            break;
+        case 7:
+            arguments->ciphersuites = arg;
+            break;
+
+        default:
+            return ARGP_ERR_UNKNOWN;
+    }
+
+    return 0;
+}
+
+static struct argp argp = {options, parse_opt, args_doc, doc};
+
+// Read the algorithms and ports of the mapping, 0 on success
+int read_mapping(const char *path) {
+    char line[MAX_PATH_LENGTH];
+    FILE *mapping = fopen(path, "r");
+    if (!mapping) {
+        fprintf(stderr, "Error opening port mapping %s.\n", path);
+        return 1;
+    }
+
+    while (fgets(line, sizeof(line), mapping)) {
+        line[strcspn(line, "\r\n")] = '\0';
+        if (line[0] == '\0') {
+            continue;
+        }
+
+        // Note: Algorithm names contain colons (RSA:3072) but no commas
+        char *separator = strrchr(line, ',');
+        int port = separator ? atoi(separator + 1) : 0;
+        if (!separator || port <= 0 || port > 65535 || separator - line >= MAX_NAME_LENGTH) {
+            fprintf(stderr, "Invalid line in port mapping: %s\n", line);
+            fclose(mapping);
+            return 1;
+        }
+        if (algorithm_count == MAX_ALGORITHMS) {
+            fprintf(stderr, "More than %d algorithms in port mapping.\n", MAX_ALGORITHMS);
+            fclose(mapping);
+            return 1;
+        }
+
+        struct algorithm *algorithm = &algorithms[algorithm_count++];
+        memcpy(algorithm->name, line, separator - line);
+        algorithm->name[separator - line] = '\0';
+        size_t length = 0;
+        for (const char *c = algorithm->name; *c; c++) {
+            if (*c != ':') {
+                algorithm->pki_name[length++] = *c;
+            }
+        }
+        algorithm->pki_name[length] = '\0';
+        algorithm->port = port;
+        algorithm->listen_fd = -1;
+        algorithm->ssl_ctx = NULL;
+    }
+
+    fclose(mapping);
+    if (algorithm_count == 0) {
+        fprintf(stderr, "No algorithms in port mapping %s.\n", path);
+        return 1;
+    }
+
+    return 0;
+}
+
+// Set up a server SSL_CTX with the chain of the algorithm, the TLS 1.3 parameters (--groups, --ciphersuites) and client certificate verification, NULL on error
+SSL_CTX* create_ssl_ctx(const struct algorithm *algorithm)
+{
+    char path[MAX_PATH_LENGTH];
+    SSL_CTX* ssl_ctx = SSL_CTX_new(TLS_server_method());
+    if (!ssl_ctx)
+    {
+        return NULL;
+    }
+
+    SSL_CTX_set_mode(ssl_ctx, SSL_MODE_AUTO_RETRY);
+    SSL_CTX_set_quiet_shutdown(ssl_ctx, 1);
+
+    if (SSL_CTX_set_min_proto_version(ssl_ctx, TLS1_3_VERSION) != 1)
+    {
+        goto error;
+    }
+
+    if (SSL_CTX_set_max_proto_version(ssl_ctx, TLS1_3_VERSION) != 1)
+    {
+        goto error;
+    }
+
+    // Clients which close the connection without close_notify are not an error (s_server -ignore_unexpected_eof)
+    SSL_CTX_set_options(ssl_ctx, SSL_OP_NO_COMPRESSION | SSL_OP_IGNORE_UNEXPECTED_EOF);
+
+    if (SSL_CTX_set_ciphersuites(ssl_ctx, arguments.ciphersuites) != 1)
+    {
+        goto error;
+    }
+
+    if (SSL_CTX_set1_groups_list(ssl_ctx, arguments.groups) != 1)
+    {
+        goto error;
+    }
+
+    // Load CA certificate as trust anchor of the client certificates
+    snprintf(path, sizeof(path), "%s/pki-%s/ca/ca.crt", arguments.pki_dir, algorithm->pki_name);
+    if (SSL_CTX_load_verify_locations(ssl_ctx, path, 0) <= 0)
+    {
+        fprintf(stderr, "Error loading CA certificate %s.\n", path);
+        goto error;
+    }
+
+    // Load the intermediate CA certificate
+    X509 *intermediate_cert = NULL;
+    snprintf(path, sizeof(path), "%s/pki-%s/ica/ica.crt", arguments.pki_dir, algorithm->pki_name);
+    FILE *intermediate_file = fopen(path, "r");
+    if (intermediate_file) {
+        intermediate_cert = PEM_read_X509(intermediate_file, NULL, NULL, NULL);
+        fclose(intermediate_file);
+    }
+
+    if (!intermediate_cert) {
+        fprintf(stderr, "Error loading intermediate CA certificate %s.\n", path);
+        goto error;
+    }
+
+    // Add the intermediate CA certificate to the chain
+    if (SSL_CTX_add_extra_chain_cert(ssl_ctx, intermediate_cert) <= 0) {
+        fprintf(stderr, "Error adding intermediate CA certificate to the chain.\n");
+        X509_free(intermediate_cert);
+        goto error;
+    }
+
+    // Load the server certificate and key
+    snprintf(path, sizeof(path), "%s/pki-%s/server/server.crt", arguments.pki_dir, algorithm->pki_name);
+    if (SSL_CTX_use_certificate_file(ssl_ctx, path, SSL_FILETYPE_PEM) <= 0) {
+        fprintf(stderr, "Error loading server certificate %s.\n", path);
+        goto error;
+    }
+
+    snprintf(path, sizeof(path), "%s/pki-%s/server/server.key", arguments.pki_dir, algorithm->pki_name);
+    if (SSL_CTX_use_PrivateKey_file(ssl_ctx, path, SSL_FILETYPE_PEM) <= 0) {
+        fprintf(stderr, "Error loading server key %s.\n", path);
+        goto error;
+    }
+
+    if (SSL_CTX_check_private_key(ssl_ctx) != 1) {
+        goto error;
+    }
+
+    // Request and verify the client certificate (s_server -verify 2 -verify_return_error)
+    SSL_CTX_set_verify(ssl_ctx, SSL_VERIFY_PEER | SSL_VERIFY_CLIENT_ONCE, NULL);
+    SSL_CTX_set_verify_depth(ssl_ctx, 2);
+
+    // Sessions with a verified client certificate are only resumed within the same context
+    if (SSL_CTX_set_session_id_context(ssl_ctx, (const unsigned char *)algorithm->pki_name, strlen(algorithm->pki_name)) != 1) {
+        goto error;
+    }
+
+    if (arguments.early_data) {
+        if (SSL_CTX_set_max_early_data(ssl_ctx, MAX_EARLY_DATA) != 1 || SSL_CTX_set_recv_max_early_data(ssl_ctx, MAX_EARLY_DATA) != 1) {
+            goto error;
+        }
+    }
+
+    return ssl_ctx;
+
+error:
+    SSL_CTX_free(ssl_ctx);
+    return NULL;
+}
+
+// Non-blocking listening socket on all addresses, -1 on error
+// Note: The workers poll all listening sockets, a connection is accepted by the first free worker
+int open_listener(int port) {
+    int on = 1;
+    struct sockaddr_in6 address;
+    int fd = socket(AF_INET6, SOCK_STREAM | SOCK_NONBLOCK, 0);
+    if (fd < 0) {
+        return -1;
+    }
+
+    int off = 0;
+    memset(&address, 0, sizeof(address));
+    address.sin6_family = AF_INET6;
+    address.sin6_addr = in6addr_any;
+    address.sin6_port = htons(port);
+    if (setsockopt(fd, SOL_SOCKET, SO_REUSEADDR, &on, sizeof(on)) != 0
+        || setsockopt(fd, IPPROTO_IPV6, IPV6_V6ONLY, &off, sizeof(off)) != 0
+        || bind(fd, (struct sockaddr *)&address, sizeof(address)) != 0
+        || listen(fd, LISTEN_BACKLOG) != 0) {
+        close(fd);
+        return -1;
+    }
+
+    return fd;
+}
+
+// Perform the handshake on an accepted connection and read until the client closes it
+void serve_connection(const struct algorithm *algorithm, int fd) {
+    char buffer[MAX_EARLY_DATA];
+    char first_byte;
+    size_t read_bytes;
+    int on = 1;
+    struct timeval timeout = { IDLE_TIMEOUT, 0 };
+
+    setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &on, sizeof(on));
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &timeout, sizeof(timeout));
+    setsockopt(fd, SOL_SOCKET, SO_SNDTIMEO, &timeout, sizeof(timeout));
+
+    // Connections closed before the ClientHello are not reported (e.g. the TCP probes of the path prober of the client)
+    if (recv(fd, &first_byte, 1, MSG_PEEK) <= 0) {
+        close(fd);
+        return;
+    }
+
+    SSL *ssl = SSL_new(algorithm->ssl_ctx);
+    if (!ssl || SSL_set_fd(ssl, fd) != 1) {
+        goto error;
+    }
+
+    // Early data is read before the handshake is completed, the session tickets are sent at its end
+    if (arguments.early_data) {
+        int status;
+        do {
+            status = SSL_read_early_data(ssl, buffer, sizeof(buffer), &read_bytes);
+        } while (status == SSL_READ_EARLY_DATA_SUCCESS);
+        if (status == SSL_READ_EARLY_DATA_ERROR) {
+            goto error;
+        }
+    }
+
+    if (SSL_accept(ssl) != 1) {
+        goto error;
+    }
+
+    while (SSL_read(ssl, buffer, sizeof(buffer)) > 0) {
+        // Requests are not answered, the benchmark only measures the handshake
+    }
+
+    // Marks the connection as shut down (quiet shutdown, nothing is sent), otherwise SSL_free() treats the session as
+    // bad and removes it from the cache, which invalidates the single-use ticket of the early data mode
+    SSL_shutdown(ssl);
+    SSL_free(ssl);
+    close(fd);
+    ERR_clear_error();
+    return;
+
+error:
+    fprintf(stderr, "Handshake of %s failed.\n", algorithm->name);
+    ERR_print_errors_fp(stderr);
+    SSL_free(ssl);
+    close(fd);
+    return;
+}
+
+void* worker(void *arg) {
+    (void)arg;
+    struct pollfd listeners[MAX_ALGORITHMS];
+
+    for (size_t i = 0; i < algorithm_count; i++) {
+        listeners[i].fd = algorithms[i].listen_fd;
+        listeners[i].events = POLLIN;
+    }
+
+    while (true) {
+        if (poll(listeners, algorithm_count, -1) < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            perror("poll");
+            return NULL;
+        }
+
+        for (size_t i = 0; i < algorithm_count; i++) {
+            if (!(listeners[i].revents & POLLIN)) {
+                continue;
+            }
+            // Another worker may have accepted the connection already (EAGAIN)
+            int fd = accept(listeners[i].fd, NULL, NULL);
+            if (fd >= 0) {
+                serve_connection(&algorithms[i], fd);
+            }
+        }
+    }
+
+    return NULL;
+}
+
+int main(int argc, char *args[])
+{
+    int ret = -1;
+    pthread_t *threads = NULL;
+
+    // Prepare for CLI arguments parsing
+    arguments.mapping_file = "";
+    arguments.pki_dir = "";
+    arguments.config_file = NULL;
+    arguments.threads = 0;
+    arguments.early_data = false;
+    arguments.groups = DEFAULT_GROUPS;
+    arguments.ciphersuites = DEFAULT_CIPHERSUITES;
+
+    // Parse the CLI arguments
+    argp_parse(&argp, argc, args, 0, 0, &arguments);
+
+    if (arguments.threads == 0) {
+        long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+        arguments.threads = WORKERS_PER_CPU * (cpus > 0 ? cpus : 1);
+    }
+
+    // Clients which close the connection must not kill the server
+    signal(SIGPIPE, SIG_IGN);
+
+    // Print OpenSSL version and build information
+    printf("OpenSSL Version: %s\n", OpenSSL_version(OPENSSL_VERSION));
+
+    // Load OQS-Provider (without --config, the config of the OpenSSL installation is loaded on initialization)
+    if (arguments.config_file && CONF_modules_load_file(NULL, arguments.config_file, 0) <= 0) {
+        fprintf(stderr, "Error loading OQS provider from %s\n", arguments.config_file);
+        goto ossl_error;
+    }
+
+    if (read_mapping(arguments.mapping_file) != 0) {
+        goto end;
+    }
+
+    for (size_t i = 0; i < algorithm_count; i++) {
+        algorithms[i].ssl_ctx = create_ssl_ctx(&algorithms[i]);
+        if (!algorithms[i].ssl_ctx) {
+            fprintf(stderr, "Error setting up the context of %s.\n", algorithms[i].name);
+            goto ossl_error;
+        }
+
+        algorithms[i].listen_fd = open_listener(algorithms[i].port);
+        if (algorithms[i].listen_fd < 0) {
+            fprintf(stderr, "Error listening on port %d (%s): %s\n", algorithms[i].port, algorithms[i].name, strerror(errno));
+            goto end;
+        }
+        printf("Serving %s on port %d.\n", algorithms[i].name, algorithms[i].port);
+    }
+
+    threads = malloc(arguments.threads * sizeof(*threads));
+    if (!threads) {
+        goto end;
+    }
+    for (size_t i = 0; i < arguments.threads; i++) {
+        if (pthread_create(&threads[i], NULL, worker, NULL) != 0) {
+            fprintf(stderr, "Error starting worker thread.\n");
+            goto end;
+        }
+    }
+    printf("%zu algorithms served by %zu worker threads.\n", algorithm_count, arguments.threads);
+    fflush(stdout);
+
+    // The workers run until the server is stopped (SIGTERM)
+    for (size_t i = 0; i < arguments.threads; i++) {
+        pthread_join(threads[i], NULL);
+    }
+
+    ret = 0;
+    goto end;
+
+ossl_error:
+    fprintf(stderr, "Unrecoverable OpenSSL error.\n");
+    ERR_print_errors_fp(stderr);
+end:
+    for (size_t i = 0; i < algorithm_count; i++) {
+        if (algorithms[i].listen_fd >= 0) {
+            close(algorithms[i].listen_fd);
+        }
+        SSL_CTX_free(algorithms[i].ssl_ctx);
+    }
+    free(threads);
+    return ret;
+}
@@ -1,18 +1,29 @@
 #!/bin/sh
 
+# Number of namespace pairs to clean up (first argument, default is 1)
+PAIRS=${1:-1}
+
 # Starting
-echo "Start cleaning up..."
+echo "Start cleaning up $PAIRS namespace pair(s)..."
+
+i=1
+while [ "$i" -le "$PAIRS" ]; do
+    SERVER=$((2 * i - 1))
+    CLIENT=$((2 * i))
+
+    # Shutting down the veth devices
+    sudo ip -n ns$SERVER link set dev veth$((100 + SERVER)) down
+    sudo ip -n ns$CLIENT link set dev veth$((100 + CLIENT)) down
 
-# Shutting down the veth devices
-sudo ip -n ns1 link set dev veth101 down
-sudo ip -n ns2 link set dev veth102 down
+    # Delete the veth pair (this command will remove both veth devices of the pair)
+    sudo ip -n ns$SERVER link delete veth$((100 + SERVER)) type veth
 
-# Delete the veth pair (this command will remove both veth101 and veth102)
-sudo sudo ip -n ns1 link delete veth101 type veth
+    # Delete the two namespaces
+    sudo ip netns del ns$SERVER
+    sudo ip netns del ns$CLIENT
 
-# Delete the two namespaces
-sudo ip netns del ns1
-sudo ip netns del ns2
+    i=$((i + 1))
+done
 
 # Finished
 echo "Cleanup finished."
@@ -1,27 +1,46 @@
 #!/bin/sh
 
+# Number of namespace pairs to set up (first argument, default is 1)
+# Pair i consists of the namespaces ns(2i-1) (server) and ns(2i) (client), connected by veth(100+2i-1) and veth(100+2i).
+# Note: Pair 1 is the classic ns1/ns2 setup with veth101/veth102, 192.168.101.1 and 192.168.102.1
+PAIRS=${1:-1}
+
+if [ "$PAIRS" -lt 1 ] || [ "$PAIRS" -gt 77 ]; then
+    echo "Number of namespace pairs must be between 1 and 77."
+    exit 1
+fi
+
 # Starting
-echo "Start the setup..."
+echo "Start the setup of $PAIRS namespace pair(s)..."
+
+i=1
+while [ "$i" -le "$PAIRS" ]; do
+    SERVER=$((2 * i - 1))
+    CLIENT=$((2 * i))
+    SERVER_MAC=$(printf "00:00:00:00:00:%02x" "$SERVER")
+    CLIENT_MAC=$(printf "00:00:00:00:00:%02x" "$CLIENT")
 
-# Set up two namespaces with the name ns1 and ns2
-sudo ip netns add ns1 
-sudo ip netns add ns2
+    # Set up two namespaces with the name ns(2i-1) and ns(2i)
+    sudo ip netns add ns$SERVER || exit 1
+    sudo ip netns add ns$CLIENT || exit 1
 
-# Create a virtual Ethernet pair (veth101 and veth102) and link them to the namespaces (ns1 and ns2, respectively)
-sudo ip link add name veth101 address 00:00:00:00:00:01 netns ns1 type veth peer name veth102 address 00:00:00:00:00:02 netns ns2
+    # Create a virtual Ethernet pair and link them to the namespaces
+    sudo ip link add name veth$((100 + SERVER)) address $SERVER_MAC netns ns$SERVER type veth peer name veth$((100 + CLIENT)) address $CLIENT_MAC netns ns$CLIENT || exit 1
 
-# Assign an IP address to each veth device and change the device state to "up"
-sudo ip -n ns1 addr add 192.168.101.1/24 dev veth101 && sudo ip -n ns1 link set dev veth101 up
-sudo ip -n ns2 addr add 192.168.102.1/24 dev veth102 && sudo ip -n ns2 link set dev veth102 up
+    # Assign an IP address to each veth device and change the device state to "up"
+    sudo ip -n ns$SERVER addr add 192.168.$((100 + SERVER)).1/24 dev veth$((100 + SERVER)) && sudo ip -n ns$SERVER link set dev veth$((100 + SERVER)) up || exit 1
+    sudo ip -n ns$CLIENT addr add 192.168.$((100 + CLIENT)).1/24 dev veth$((100 + CLIENT)) && sudo ip -n ns$CLIENT link set dev veth$((100 + CLIENT)) up || exit 1
 
-# Add default route configs
-sudo ip -n ns1 route add 192.168.102.0/24 dev veth101
-sudo ip -n ns2 route add 192.168.101.0/24 dev veth102
+    # Add default route configs
+    sudo ip -n ns$SERVER route add 192.168.$((100 + CLIENT)).0/24 dev veth$((100 + SERVER)) || exit 1
+    sudo ip -n ns$CLIENT route add 192.168.$((100 + SERVER)).0/24 dev veth$((100 + CLIENT)) || exit 1
 
-# Disable TCP Segmentation Offload (TSO), GSO and GRO
-sudo ip netns exec ns1 ethtool -K veth101 gso off gro off tso off
-sudo ip netns exec ns2 ethtool -K veth102 gso off gro off tso off
+    # Disable TCP Segmentation Offload (TSO), GSO and GRO
+    sudo ip netns exec ns$SERVER ethtool -K veth$((100 + SERVER)) gso off gro off tso off
+    sudo ip netns exec ns$CLIENT ethtool -K veth$((100 + CLIENT)) gso off gro off tso off
+
+    i=$((i + 1))
+done
 
 # Finished.
 echo "Setup finished."
-
@@ -30,6 +30,7 @@ def create_box_plots(csv_files, comparison_file, output_folder):
     plt.subplots_adjust(hspace=0.4)
     
     location_names = ['Windisch', 'Altdorf', 'Kemnitz']
+    # RTTs measured by ping before the runs, used for results without the path conditions of the prober
     rtt_values = [5.246, 9.775, 29.731]
 
     # Read comparison data
@@ -39,6 +40,10 @@ def create_box_plots(csv_files, comparison_file, output_folder):
         # Read the CSV file
         df = pd.read_csv(csv_file)
 
+        # Median RTT of the path conditions probed around the rounds, if the results have them
+        if 'Path RTT [ms]' in df.columns and (df['Path RTT [ms]'] >= 0).any():
+            rtt_values[i] = round(df.loc[df['Path RTT [ms]'] >= 0, 'Path RTT [ms]'].median(), 3)
+
         # Group data by Signature Algorithm
         grouped_data = df.groupby('Signature Algorithm')
 